@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+
+_ = r"""
+this hook logs the size and path of each uploaded file,
+and rejects uploads of files that are larger than 1 GiB
+
+instead of running this as a new python process for each
+event, copyparty imports it and calls main() directly,
+so it is much faster, especially with lots of small files;
+however, if this hangs or crashes then so does copyparty
+
+example usage as global config:
+    --xau I,c,bin/hooks/import-me.py
+
+example usage as a volflag (per-volume config):
+    -v srv/inc:inc:r:rw,ed:c,xau=I,c,bin/hooks/import-me.py
+                           ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+    (share filesystem-path srv/inc as volume /inc,
+     readable by everyone, read-write for user 'ed',
+     running this plugin on all uploads with the params listed below)
+
+parameters explained,
+    xau = execute after upload
+    I   = import into copyparty and call main() for each upload
+    c   = check return value; reject the upload if nonzero
+
+the same hook can also be used with --xiu, in which case
+main() is called once per batch with ka["ups"] as the list
+"""
+
+
+MAX_SZ = 1024 * 1024 * 1024
+
+
+def main(ka):
+    log = ka["log"] or print
+    ups = ka.get("ups") or [ka]  # xiu gives a list
+    for up in ups:
+        log("import-me: %d bytes, %s" % (up["sz"], up["ap"]))
+        if up["sz"] > MAX_SZ:
+            log("import-me: too big; rejecting")
+            return 1
+
+    return 0
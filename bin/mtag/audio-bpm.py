@@ -2,6 +2,7 @@
 
 import os
 import sys
+import json
 import vamp
 import tempfile
 import numpy as np
@@ -20,14 +21,14 @@ dep: ffmpeg
 SAVE = False
 
 
-def det(tf):
+def det(fp, tf):
     # fmt: off
     sp.check_call([
         b"ffmpeg",
         b"-nostdin",
         b"-hide_banner",
         b"-v", b"fatal",
-        b"-y", b"-i", fsenc(sys.argv[1]),
+        b"-y", b"-i", fsenc(fp),
         b"-map", b"0:a:0",
         b"-ac", b"1",
         b"-ar", b"22050",
@@ -47,8 +48,7 @@ def det(tf):
             # fallback; 73% accuracy
             plug = "vamp-example-plugins:fixedtempo"
             c = vamp.collect(d, 22050, plug, parameters={"maxdflen": 40})
-            print(c["list"][0]["label"].split(" ")[0])
-            return
+            return c["list"][0]["label"].split(" ")[0]
 
     # throws if detection failed:
     beats = [float(x["timestamp"]) for x in cl]
@@ -59,10 +59,10 @@ def det(tf):
     bds = bds[n0:n1]
     bpm = sum(bds)
     bpm = round(60 * (len(bds) / bpm), 2)
-    print(f"{bpm:.2f}")
+    ret = f"{bpm:.2f}"
 
     if SAVE:
-        fdir, fname = os.path.split(sys.argv[1])
+        fdir, fname = os.path.split(fp)
         bdir = os.path.join(fdir, ".beats")
         try:
             os.mkdir(fsenc(bdir))
@@ -74,19 +74,31 @@ def det(tf):
             txt = "\n".join([f"{x:.2f}" for x in beats])
             f.write(txt.encode("utf-8"))
 
+    return ret
 
-def main():
+
+def run(fp):
     with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as f:
         f.write(b"h")
         tf = f.name
 
     try:
-        det(tf)
+        return det(fp, tf)
     except:
-        pass  # mute
+        return ""  # mute
     finally:
         os.unlink(tf)
 
 
+def main():
+    if len(sys.argv) > 1:
+        print(run(sys.argv[1]))
+        return
+
+    # mtp flag cp; one json object per line on stdin, one reply per line
+    for ln in sys.stdin:
+        print(run(json.loads(ln)["path"]), flush=True)
+
+
 if __name__ == "__main__":
     main()
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import json
 import tempfile
 import subprocess as sp
 import keyfinder
@@ -20,14 +21,14 @@ dep: ffmpeg
 # obvious when mixing 9a ghostly parapara ship
 
 
-def det(tf):
+def det(fp, tf):
     # fmt: off
     sp.check_call([
         b"ffmpeg",
         b"-nostdin",
         b"-hide_banner",
         b"-v", b"fatal",
-        b"-y", b"-i", fsenc(sys.argv[1]),
+        b"-y", b"-i", fsenc(fp),
         b"-map", b"0:a:0",
         b"-t", b"300",
         b"-sample_fmt", b"s16",
@@ -35,21 +36,31 @@ def det(tf):
     ])
     # fmt: on
 
-    print(keyfinder.key(tf).camelot())
+    return keyfinder.key(tf).camelot()
 
 
-def main():
+def run(fp):
     with tempfile.NamedTemporaryFile(suffix=".flac", delete=False) as f:
         f.write(b"h")
         tf = f.name
 
     try:
-        det(tf)
+        return det(fp, tf)
     except:
-        pass  # mute
+        return ""  # mute
     finally:
         os.unlink(tf)
 
 
+def main():
+    if len(sys.argv) > 1:
+        print(run(sys.argv[1]))
+        return
+
+    # mtp flag cp; one json object per line on stdin, one reply per line
+    for ln in sys.stdin:
+        print(run(json.loads(ln)["path"]), flush=True)
+
+
 if __name__ == "__main__":
     main()
@@ -78,6 +78,9 @@ VT100 = platform.system() != "Windows"
 
 req_ses = requests.Session()
 
+hs_batch = True  # server supports batched handshakes (until proven otherwise)
+up_pack = True  # server supports packed uploads (until proven otherwise)
+
 
 class Daemon(threading.Thread):
     def __init__(self, target, name=None, a=None):
@@ -124,6 +127,7 @@ class File(object):
         self.t0_up = 0.0  # type: float
         self.t1_up = 0.0  # type: float
         self.nojoin = 0  # type: int
+        self.nopack = 0  # type: int
         self.up_b = 0  # type: int
         self.up_c = 0  # type: int
         self.cd = 0  # type: int
@@ -187,6 +191,56 @@ class FileSlice(object):
         return ret
 
 
+class FilePack(object):
+    """
+    file-like object for uploading several small files in one POST;
+    each FileSlice (one whole file) is preceded by "wark chunkhash size\n"
+    """
+
+    def __init__(self, fsls):
+        # type: (list[FileSlice]) -> None
+
+        self.parts = []  # type: list[Union[bytes, FileSlice]]
+        self.len = 0
+        for fsl in fsls:
+            zs = "%s %s %d\n" % (fsl.file.wark, fsl.cids[0], fsl.len)
+            zb = zs.encode("utf-8")
+            self.parts.extend([zb, fsl])
+            self.len += len(zb) + fsl.len
+
+        self.ofs = 0
+
+    def tell(self):
+        return self.ofs
+
+    def read(self, sz):
+        ret = b""
+        while self.parts and len(ret) < sz:
+            part = self.parts[0]
+            if isinstance(part, bytes):
+                buf = part[: sz - len(ret)]
+                self.parts[0] = part[len(buf) :]
+            else:
+                buf = part.read(sz - len(ret))
+                if not buf and part.ofs < part.len:
+                    raise Exception("file changed while uploading: %s" % (part.file.name,))
+
+            if not buf:
+                if not isinstance(part, bytes):
+                    part.f.close()
+                self.parts.pop(0)
+
+            ret += buf
+
+        self.ofs += len(ret)
+        return ret
+
+    def close(self):
+        for part in self.parts:
+            if not isinstance(part, bytes):
+                part.f.close()
+
+
 class MTHash(object):
     def __init__(self, cores):
         self.f = None
@@ -562,13 +616,98 @@ def get_hashlist(file, pcb, mth):
                 pcb(file, file_ofs)
 
     file.t_hash = time.time() - t0
-    file.cids = ret
+    set_hashlist(file, ret)
+
+
+def set_hashlist(file, cids):
+    # type: (File, list[tuple[str, int, int]]) -> None
+    file.cids = cids
     file.kchunks = {}
-    for k, v1, v2 in ret:
+    for k, v1, v2 in cids:
         if k not in file.kchunks:
             file.kchunks[k] = [v1, v2]
 
 
+class HashCache(object):
+    """
+    remembers the chunk hashes of previously hashed files (--hc),
+    keyed by device and inode, and only trusted if size and
+    last-modified are unchanged; entries unused for 30 days are dropped
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.cur = self.db.cursor()
+        self.cur.execute(
+            "create table if not exists hc (dev int, ino int, sz int, mt real, t int, hs text)"
+        )
+        self.cur.execute("create unique index if not exists hc_i on hc(dev, ino)")
+        self.db.commit()
+        self.t_commit = time.time()
+        self.nhit = 0
+        self.nmiss = 0
+
+    def get(self, file, inf):
+        # type: (File, os.stat_result) -> bool
+        """loads the hashlist into `file` if it is known and still valid"""
+        if not inf.st_ino:
+            return False
+
+        t0 = time.time()
+        q = "select sz, mt, t, hs from hc where dev = ? and ino = ?"
+        r = self.cur.execute(q, (inf.st_dev, inf.st_ino)).fetchone()
+        if not r or r[0] != inf.st_size or r[1] != inf.st_mtime:
+            self.nmiss += 1
+            return False
+
+        hashes = r[3].split(",") if r[3] else []
+        chunk_sz = up2k_chunksize(file.size)
+        if len(hashes) != (file.size + chunk_sz - 1) // chunk_sz:
+            self.nmiss += 1
+            return False
+
+        cids = []
+        for n, zs in enumerate(hashes):
+            ofs = n * chunk_sz
+            cids.append([zs, ofs, min(chunk_sz, file.size - ofs)])
+
+        set_hashlist(file, cids)
+        file.t_hash = time.time() - t0
+        self.nhit += 1
+
+        if r[2] < t0 - 86400:
+            q = "update hc set t = ? where dev = ? and ino = ?"
+            self.cur.execute(q, (int(t0), inf.st_dev, inf.st_ino))
+            self._commit(t0)
+
+        return True
+
+    def put(self, file, inf):
+        # type: (File, os.stat_result) -> None
+        if not inf.st_ino:
+            return
+
+        now = time.time()
+        zs = ",".join([x[0] for x in file.cids])
+        zt = (inf.st_dev, inf.st_ino, inf.st_size, inf.st_mtime, int(now), zs)
+        self.cur.execute("insert or replace into hc values (?,?,?,?,?,?)", zt)
+        self._commit(now)
+
+    def _commit(self, now):
+        if now - self.t_commit > 5:
+            self.db.commit()
+            self.t_commit = now
+
+    def close(self):
+        zi = int(time.time()) - 86400 * 30
+        self.cur.execute("delete from hc where t < ?", (zi,))
+        self.db.commit()
+        self.db.close()
+        eprint("hash cache: %d hits, %d misses\n" % (self.nhit, self.nmiss))
+
+
 def handshake(ar, file, search):
     # type: (argparse.Namespace, File, bool) -> tuple[list[str], bool]
     """
@@ -656,6 +795,88 @@ def handshake(ar, file, search):
     return r["hash"], r["sprs"]
 
 
+def handshakes(ar, files):
+    # type: (argparse.Namespace, list[File]) -> list[Optional[tuple[list[str], bool]]]
+    """
+    handshake for several files in one request; for each file,
+    returns the same as handshake() if it went well, or None if
+    that file should be retried with a regular handshake()
+    """
+
+    global hs_batch
+
+    reqs = []
+    for file in files:
+        req = {
+            "hash": [x[0] for x in file.cids],
+            "name": file.name,
+            "lmod": file.lmod,
+            "size": file.size,
+        }
+        if ar.touch:
+            req["umod"] = True
+        if ar.ow:
+            req["replace"] = True
+        if b"/" in file.rel:
+            req["rd"] = file.rel.rsplit(b"/", 1)[0].decode("utf-8", "replace")
+
+        file.recheck = False
+        reqs.append(req)
+
+    headers = {"Content-Type": "text/plain"}
+    if ar.a:
+        headers["Cookie"] = "=".join(["cppwd", ar.a])
+
+    sc = 0
+    rets = None
+    try:
+        zs = json.dumps({"batch": reqs}, separators=(",", ":"))
+        r = req_ses.post(ar.url, headers=headers, data=zs)
+        sc = r.status_code
+        if sc < 400:
+            rets = r.json()["batch"]
+    except:
+        pass
+
+    if not rets or len(rets) != len(files):
+        if sc in (400, 422, 500):
+            # server is too old (no "name" in the body); stop trying,
+            # but 401/403/413/503 etc. are just this batch failing
+            hs_batch = False
+        return [None] * len(files)
+
+    try:
+        pre, zs = ar.url.split("://")
+        pre += "://" + zs.split("/")[0]
+    except:
+        pre = ar.url.split("/")[0]
+
+    ret = []  # type: list[Optional[tuple[list[str], bool]]]
+    for file, r in zip(files, rets):
+        if "err" in r:
+            sc = r["err"]
+            msg = r["msg"]
+            if (
+                sc == 422
+                or msg.startswith("partial upload exists at a different")
+                or msg.startswith("source file busy; please try again")
+            ):
+                file.recheck = True
+                ret.append(([], False))
+            elif sc == 409 or msg.startswith("upload rejected, file already exists"):
+                ret.append(([], False))
+            else:
+                ret.append(None)
+            continue
+
+        file.url = pre + r["purl"]
+        file.name = r["name"]
+        file.wark = r["wark"]
+        ret.append((r["hash"], r["sprs"]))
+
+    return ret
+
+
 def upload(fsl, pw, stats):
     # type: (FileSlice, str, str) -> None
     """upload a range of file data, defined by one or more `cid` (chunk-hash)"""
@@ -692,6 +913,44 @@ def upload(fsl, pw, stats):
         fsl.f.close()
 
 
+def upload_pack(fsls, pw, stats):
+    # type: (list[FileSlice], str, str) -> Optional[dict[str, str]]
+    """
+    upload several small files (one chunk each) in one request;
+    returns {wark: error} for the files which did not make it,
+    or None if the server does not understand packs
+    """
+
+    headers = {
+        "X-Up2k-Pack": "1",
+        "Content-Type": "application/octet-stream",
+    }
+
+    if stats:
+        headers["X-Up2k-Stat"] = stats
+
+    if pw:
+        headers["Cookie"] = "=".join(["cppwd", pw])
+
+    pack = FilePack(fsls)
+    try:
+        r = req_ses.post(fsls[0].file.url, headers=headers, data=pack)
+        sc = r.status_code
+        if sc in (408, 429) or sc > 500:
+            # timeout, ratelimit or server busy; worth another try
+            raise Exception(repr(r))
+
+        if sc >= 400:
+            return None  # too old; 405 or "missing x-up2k-hash"
+
+        try:
+            return r.json()["err"]
+        except:
+            return None
+    finally:
+        pack.close()
+
+
 class Ctl(object):
     """
     the coordinator which runs everything in parallel
@@ -749,6 +1008,7 @@ class Ctl(object):
 
         self.filegen = walkdirs([], ar.files, ar.x)
         self.recheck = []  # type: list[File]
+        self.hc = HashCache(ar.hc) if ar.hc else None
 
         if ar.safe:
             self._safe()
@@ -784,6 +1044,9 @@ class Ctl(object):
 
             self._fancy()
 
+        if self.hc:
+            self.hc.close()
+
         self.ok = not self.errs
 
     def _safe(self):
@@ -797,7 +1060,7 @@ class Ctl(object):
             upath = file.abs.decode("utf-8", "replace")
 
             print("{0} {1}\n  hash...".format(self.nfiles - nf, upath))
-            get_hashlist(file, None, None)
+            self.get_hashlist(file, inf, None, None)
 
             burl = self.ar.url[:12] + self.ar.url[8:].split("/")[0] + "/"
             while True:
@@ -1015,7 +1278,7 @@ class Ctl(object):
 
                 time.sleep(0.05)
 
-            get_hashlist(file, self.cb_hasher, self.mth)
+            self.get_hashlist(file, inf, self.cb_hasher, self.mth)
             with self.mutex:
                 self.hash_f += 1
                 self.hash_c += len(file.cids)
@@ -1026,125 +1289,203 @@ class Ctl(object):
         self.hasher_busy = 0
         self.st_hash = [None, "(finished)"]
 
+    def get_hashlist(self, file, inf, pcb, mth):
+        # type: (File, os.stat_result, Any, Any) -> None
+        """get_hashlist, unless the hashes are in the --hc cache"""
+        if not self.hc:
+            get_hashlist(file, pcb, mth)
+        elif not self.hc.get(file, inf):
+            get_hashlist(file, pcb, mth)
+            self.hc.put(file, inf)
+
     def handshaker(self):
         search = self.ar.s
-        burl = self.ar.url[:8] + self.ar.url[8:].split("/")[0] + "/"
-        while True:
+        eof = False
+        while not eof:
             file = self.q_handshake.get()
             if not file:
-                self.q_upload.put(None)
                 break
 
-            upath = file.abs.decode("utf-8", "replace")
-            if not VT100:
-                upath = upath.lstrip("\\?")
+            # grab whatever else is ready, to handshake them all at once
+            files = [file]
+            nbytes = 0
+            while not search and hs_batch and len(files) < self.ar.hsb:
+                if nbytes > 512 * 1024:
+                    break
+                try:
+                    file = self.q_handshake.get_nowait()
+                except:
+                    break
+                if not file:
+                    eof = True
+                    break
+                files.append(file)
+                nbytes += len(file.rel) + 48 * len(file.cids) + 99
+
+            live = []
+            for file in files:
+                file.nhs += 1
+                if file.nhs > 32:
+                    upath = file.abs.decode("utf-8", "replace")
+                    print("ERROR: giving up on file %s" % (upath))
+                    self.errs += 1
+                    continue
 
-            file.nhs += 1
-            if file.nhs > 32:
-                print("ERROR: giving up on file %s" % (upath))
-                self.errs += 1
-                continue
+                with self.mutex:
+                    self.handshaker_busy += 1
 
-            with self.mutex:
-                self.handshaker_busy += 1
+                while time.time() < file.cd:
+                    time.sleep(0.1)
 
-            while time.time() < file.cd:
-                time.sleep(0.1)
+                live.append(file)
 
-            hs, sprs = handshake(self.ar, file, search)
-            if search:
-                if hs:
-                    for hit in hs:
-                        t = "found: {0}\n  {1}{2}\n"
-                        print(t.format(upath, burl, hit["rp"]), end="")
-                else:
-                    print("NOT found: {0}\n".format(upath), end="")
+            batch = []
+            for file in live:
+                try:
+                    # new files only, with utf8 paths
+                    if not file.url and file.rel.decode("utf-8"):
+                        batch.append(file)
+                except:
+                    pass
 
-                with self.mutex:
-                    self.up_f += 1
-                    self.up_c += len(file.cids)
-                    self.up_b += file.size
-                    self.handshaker_busy -= 1
+            hss = {}
+            if len(batch) > 1:
+                for file, zt in zip(batch, handshakes(self.ar, batch)):
+                    if zt:
+                        hss[id(file)] = zt
 
-                continue
+            for file in live:
+                try:
+                    hs, sprs = hss[id(file)]
+                except KeyError:
+                    hs, sprs = handshake(self.ar, file, search)
 
-            if file.recheck:
-                self.recheck.append(file)
+                self.handshaked(file, hs, sprs)
 
-            with self.mutex:
-                if hs and not sprs and not self.serialized:
-                    t = "server filesystem does not support sparse files; serializing uploads\n"
-                    eprint(t)
-                    self.serialized = True
-                    for _ in range(self.ar.j - 1):
-                        self.q_upload.put(None)
-                if not hs:
-                    # all chunks done
-                    self.up_f += 1
-                    self.up_c += len(file.cids) - file.up_c
-                    self.up_b += file.size - file.up_b
-
-                    if not file.recheck:
-                        self.up_done(file)
-
-                if hs and file.up_c:
-                    # some chunks failed
-                    self.up_c -= len(hs)
-                    file.up_c -= len(hs)
-                    for cid in hs:
-                        sz = file.kchunks[cid][1]
-                        self.up_b -= sz
-                        file.up_b -= sz
+        self.q_upload.put(None)
 
-                file.ucids = hs
+    def handshaked(self, file, hs, sprs):
+        # type: (File, list[str], bool) -> None
+        search = self.ar.s
+        burl = self.ar.url[:8] + self.ar.url[8:].split("/")[0] + "/"
+        upath = file.abs.decode("utf-8", "replace")
+        if not VT100:
+            upath = upath.lstrip("\\?")
+
+        if search:
+            if hs:
+                for hit in hs:
+                    t = "found: {0}\n  {1}{2}\n"
+                    print(t.format(upath, burl, hit["rp"]), end="")
+            else:
+                print("NOT found: {0}\n".format(upath), end="")
+
+            with self.mutex:
+                self.up_f += 1
+                self.up_c += len(file.cids)
+                self.up_b += file.size
                 self.handshaker_busy -= 1
 
-            if not hs:
-                self.at_hash += file.t_hash
+            return
 
-                if self.ar.spd:
-                    if VT100:
-                        c1 = "\033[36m"
-                        c2 = "\033[0m"
-                    else:
-                        c1 = c2 = ""
+        if file.recheck:
+            self.recheck.append(file)
 
-                    spd_h = humansize(file.size / file.t_hash, True)
-                    if file.up_b:
-                        t_up = file.t1_up - file.t0_up
-                        spd_u = humansize(file.size / t_up, True)
+        with self.mutex:
+            if hs and not sprs and not self.serialized:
+                t = "server filesystem does not support sparse files; serializing uploads\n"
+                eprint(t)
+                self.serialized = True
+                for _ in range(self.ar.j - 1):
+                    self.q_upload.put(None)
+            if not hs:
+                # all chunks done
+                self.up_f += 1
+                self.up_c += len(file.cids) - file.up_c
+                self.up_b += file.size - file.up_b
+
+                if not file.recheck:
+                    self.up_done(file)
+
+            if hs and file.up_c:
+                # some chunks failed
+                self.up_c -= len(hs)
+                file.up_c -= len(hs)
+                for cid in hs:
+                    sz = file.kchunks[cid][1]
+                    self.up_b -= sz
+                    file.up_b -= sz
+
+            file.ucids = hs
+            self.handshaker_busy -= 1
+
+        if not hs:
+            self.at_hash += file.t_hash
+
+            if self.ar.spd:
+                if VT100:
+                    c1 = "\033[36m"
+                    c2 = "\033[0m"
+                else:
+                    c1 = c2 = ""
 
-                        t = "uploaded %s %s(h:%.2fs,%s/s,up:%.2fs,%s/s)%s"
-                        print(t % (upath, c1, file.t_hash, spd_h, t_up, spd_u, c2))
-                    else:
-                        t = "   found %s %s(%.2fs,%s/s)%s"
-                        print(t % (upath, c1, file.t_hash, spd_h, c2))
+                spd_h = humansize(file.size / (file.t_hash or 1), True)
+                if file.up_b:
+                    t_up = file.t1_up - file.t0_up
+                    spd_u = humansize(file.size / t_up, True)
+
+                    t = "uploaded %s %s(h:%.2fs,%s/s,up:%.2fs,%s/s)%s"
+                    print(t % (upath, c1, file.t_hash, spd_h, t_up, spd_u, c2))
                 else:
-                    kw = "uploaded" if file.up_b else "   found"
-                    print("{0} {1}".format(kw, upath))
-
-            chunksz = up2k_chunksize(file.size)
-            njoin = (self.ar.sz * 1024 * 1024) // chunksz
-            cs = hs[:]
-            while cs:
-                fsl = FileSlice(file, cs[:1])
-                try:
-                    if file.nojoin:
-                        raise Exception()
-                    for n in range(2, min(len(cs), njoin + 1)):
-                        fsl = FileSlice(file, cs[:n])
-                except:
-                    pass
-                cs = cs[len(fsl.cids) :]
-                self.q_upload.put(fsl)
+                    t = "   found %s %s(%.2fs,%s/s)%s"
+                    print(t % (upath, c1, file.t_hash, spd_h, c2))
+            else:
+                kw = "uploaded" if file.up_b else "   found"
+                print("{0} {1}".format(kw, upath))
+
+        chunksz = up2k_chunksize(file.size)
+        njoin = (self.ar.sz * 1024 * 1024) // chunksz
+        cs = hs[:]
+        while cs:
+            fsl = FileSlice(file, cs[:1])
+            try:
+                if file.nojoin:
+                    raise Exception()
+                for n in range(2, min(len(cs), njoin + 1)):
+                    fsl = FileSlice(file, cs[:n])
+            except:
+                pass
+            cs = cs[len(fsl.cids) :]
+            self.q_upload.put(fsl)
 
     def uploader(self):
+        pend = []  # type: list[Optional[FileSlice]]
         while True:
-            fsl = self.q_upload.get()
+            fsl = pend.pop() if pend else self.q_upload.get()
             if not fsl:
                 self.st_up = [None, "(finished)"]
                 break
 
+            # small files which fit in one chunk; grab whatever else is
+            # ready and send them all in one request
+            fsls = [fsl]
+            nbytes = fsl.len
+            maxbytes = self.ar.sz * 1024 * 1024
+            while up_pack and not self.ar.np and self._packable(fsls[-1]):
+                if nbytes > maxbytes or len(fsls) >= 4096:
+                    break
+                try:
+                    zf = self.q_upload.get_nowait()
+                except:
+                    break
+                if not zf or not self._packable(zf) or zf.file.url != fsl.file.url:
+                    # the server looks for the files in the volume of the
+                    # url, so only pack files going into the same folder
+                    pend.append(zf)
+                    break
+                fsls.append(zf)
+                nbytes += zf.len
+
             file = fsl.file
             cids = fsl.cids
 
@@ -1152,10 +1493,11 @@ class Ctl(object):
                 if not self.uploader_busy:
                     self.at_upr = time.time()
                 self.uploader_busy += 1
-                if not file.t0_up:
-                    file.t0_up = time.time()
-                    if not self.t0_up:
-                        self.t0_up = file.t0_up
+                for zf in fsls:
+                    if not zf.file.t0_up:
+                        zf.file.t0_up = time.time()
+                        if not self.t0_up:
+                            self.t0_up = zf.file.t0_up
 
             stats = "%d/%d/%d/%d %d/%d %s" % (
                 self.up_f,
@@ -1167,6 +1509,10 @@ class Ctl(object):
                 self.eta,
             )
 
+            if len(fsls) > 1:
+                self.upload_packed(fsls, stats)
+                continue
+
             try:
                 upload(fsl, self.ar.a, stats)
             except Exception as ex:
@@ -1192,6 +1538,65 @@ class Ctl(object):
                 if not self.uploader_busy:
                     self.at_up += time.time() - self.at_upr
 
+    def _packable(self, fsl):
+        # type: (FileSlice) -> bool
+        return len(fsl.file.cids) == 1 and not fsl.file.nopack
+
+    def upload_packed(self, fsls, stats):
+        # type: (list[FileSlice], str) -> None
+        global up_pack
+
+        try:
+            errs = upload_pack(fsls, self.ar.a, stats)
+            if errs is None:
+                # old server; the handshake will fix it
+                t = "server does not support packed uploads; sending %d files one by one instead\n"
+                eprint(t % (len(fsls),))
+                up_pack = False
+        except Exception as ex:
+            # connection trouble or server busy; try again later
+            t = "packed upload of %d files failed, retrying: %s\n"
+            eprint(t % (len(fsls), ex))
+            errs = None
+
+        if errs is None:
+            errs = {}
+            for fsl in fsls:
+                errs[fsl.file.wark] = ""
+
+        done = []
+        with self.mutex:
+            now = time.time()
+            for fsl in fsls:
+                file = fsl.file
+                file.ucids = []
+                file.t1_up = now
+                if file.wark in errs:
+                    if errs[file.wark]:
+                        t = "upload failed, retrying: %s (%s)\n"
+                        eprint(t % (file.name, errs[file.wark]))
+                        file.nopack = 1
+                    self.q_handshake.put(file)
+                else:
+                    # finalized by the server; no need to handshake again
+                    done.append(file)
+                    self.handshaker_busy += 1
+
+                self.st_up = [file, fsl.cids[0]]
+                file.up_b += fsl.len
+                self.up_b += fsl.len
+                self.up_br += fsl.len
+                file.up_c += 1
+                self.up_c += 1
+
+        for file in done:
+            self.handshaked(file, [], False)
+
+        with self.mutex:
+            self.uploader_busy -= 1
+            if not self.uploader_busy:
+                self.at_up += time.time() - self.at_upr
+
     def up_done(self, file):
         if self.ar.dl:
             os.unlink(file.abs)
@@ -1249,6 +1654,9 @@ source file/folder selection uses rsync syntax, meaning that:
     ap.add_argument("-j", type=int, metavar="CONNS", default=2, help="parallel connections")
     ap.add_argument("-J", type=int, metavar="CORES", default=hcores, help="num cpu-cores to use for hashing; set 0 or 1 for single-core hashing")
     ap.add_argument("--sz", type=int, metavar="MiB", default=64, help="try to make each POST this big")
+    ap.add_argument("--hsb", type=int, metavar="FILES", default=256, help="max num files to handshake in one request; 1 = one request per file")
+    ap.add_argument("--hc", type=unicode, metavar="PATH", default="", help="remember file hashes in a database at PATH, so unchanged files (same device, inode, size, last-modified) are not hashed again next time")
+    ap.add_argument("-np", action="store_true", help="no packing; upload each small file in a separate request")
     ap.add_argument("-nh", action="store_true", help="disable hashing while uploading")
     ap.add_argument("-ns", action="store_true", help="no status panel (for slow consoles and macos)")
     ap.add_argument("--cd", type=float, metavar="SEC", default=5, help="delay before reattempting a failed handshake/upload")
@@ -661,6 +661,7 @@ def get_sects():
              \033[36mf\033[35m forks the process, doesn't wait for completion
              \033[36mc\033[35m checks return code, blocks the action if non-zero
              \033[36mj\033[35m provides json with info as 1st arg instead of filepath
+             \033[36mI\033[35m imports a .py hook into copyparty instead of running it
              \033[36mwN\033[35m waits N sec after command has been started before continuing
              \033[36mtN\033[35m sets an N sec timeout before the command is abandoned
              \033[36miN\033[35m xiu only: volume must be idle for N sec (default = 5)
@@ -701,6 +702,15 @@ def get_sects():
             executed program on STDIN instead of as argv arguments, and
             it also includes the wark (file-id/hash) as a json property
 
+            the \033[36mI\033[0m flag loads the python file once and then calls its
+            \033[33mmain(ka)\033[0m for each event, with the json info as a dict (plus
+            a \033[33mlog\033[0m function); returning nonzero is like a nonzero exitcode.
+            this is much faster than starting a new python process each time,
+            but a hook which hangs or crashes will take copyparty with it.
+            with \033[36mf\033[0m the events are queued for one background thread
+            per hook, and uploads are throttled if it falls 256 events behind.
+            the file is reloaded if it changes; see \033[33mbin/hooks/import-me.py\033[0m
+
             \033[36mxban\033[0m can be used to overrule / cancel a user ban event;
             if the program returns 0 (true/OK) then the ban will NOT happen
 
@@ -948,6 +958,7 @@ def add_upload(ap):
     ap2.add_argument("--no-dupe", action="store_true", help="reject duplicate files during upload; only matches within the same volume (volflag=nodupe)")
     ap2.add_argument("--no-snap", action="store_true", help="disable snapshots -- forget unfinished uploads on shutdown; don't create .hist/up2k.snap files -- abandoned/interrupted uploads must be cleaned up manually")
     ap2.add_argument("--snap-wri", metavar="SEC", type=int, default=300, help="write upload state to ./hist/up2k.snap every \033[33mSEC\033[0m seconds; allows resuming incomplete uploads after a server crash")
+    ap2.add_argument("--snap-jnl", metavar="MiB", type=float, default=1.0, help="log upload progress to ./hist/up2k.jnl as it happens, and only rewrite up2k.snap (at the next \033[33m--snap-wri\033[0m) once the journal is larger than the snapshot or \033[33mMiB\033[0m megabytes, whichever is larger; 0 = always rewrite the full snapshot instead")
     ap2.add_argument("--snap-drop", metavar="MIN", type=float, default=1440.0, help="forget unfinished uploads after \033[33mMIN\033[0m minutes; impossible to resume them after that (360=6h, 1440=24h)")
     ap2.add_argument("--u2ts", metavar="TXT", type=u, default="c", help="how to timestamp uploaded files; [\033[32mc\033[0m]=client-last-modified, [\033[32mu\033[0m]=upload-time, [\033[32mfc\033[0m]=force-c, [\033[32mfu\033[0m]=force-u (volflag=u2ts)")
     ap2.add_argument("--rand", action="store_true", help="force randomized filenames, \033[33m--nrand\033[0m chars long (volflag=rand)")
@@ -977,6 +988,7 @@ def add_network(ap):
     else:
         ap2.add_argument("--freebind", action="store_true", help="allow listening on IPs which do not yet exist, for example if the network interfaces haven't finished going up. Only makes sense for IPs other than '0.0.0.0', '127.0.0.1', '::', and '::1'. May require running as root (unless net.ipv6.ip_nonlocal_bind)")
     ap2.add_argument("--s-thead", metavar="SEC", type=int, default=120, help="socket timeout (read request header)")
+    ap2.add_argument("--evloop", action="store_true", help="park idle keep-alive connections in an event-loop (epoll/kqueue/select) instead of holding a thread each; a worker thread is only assigned once a full request header has arrived. Combine with a larger \033[33m-nc\033[0m to hold many idle clients")
     ap2.add_argument("--s-tbody", metavar="SEC", type=float, default=186.0, help="socket timeout (read/write request/response bodies). Use 60 on fast servers (default is extremely safe). Disable with 0 if reverse-proxied for a 2%% speed boost")
     ap2.add_argument("--s-rd-sz", metavar="B", type=int, default=256*1024, help="socket read size in bytes (indirectly affects filesystem writes; recommendation: keep equal-to or lower-than \033[33m--iobuf\033[0m)")
     ap2.add_argument("--s-wr-sz", metavar="B", type=int, default=256*1024, help="socket write size in bytes")
@@ -985,6 +997,24 @@ def add_network(ap):
     ap2.add_argument("--rsp-jtr", metavar="SEC", type=float, default=0.0, help="debug: response delay, random duration 0..\033[33mSEC\033[0m")
 
 
+def add_bw(ap):
+    ap2 = ap.add_argument_group('bandwidth limit options (uploads and downloads are limited separately; per process if -j)')
+    ap2.add_argument("--bw-all", metavar="RATE", type=u, default="", help="max bytes/sec for the whole server, all clients combined; suffixes: [\033[32m500k\033[0m], [\033[32m10m\033[0m], ...")
+    ap2.add_argument("--bw-vol", metavar="RATE", type=u, default="", help="max bytes/sec for each volume, all clients combined (volflag=bwvol)")
+    ap2.add_argument("--bw-usr", metavar="RATE", type=u, default="", help="max bytes/sec for each user, or each ip if not logged in, in each volume (volflag=bwusr)")
+    ap2.add_argument("--bw-acct", metavar="U=RATE", type=u, action="append", help="override \033[33m--bw-usr\033[0m for account \033[33mU\033[0m, for example [\033[32med=0\033[0m] for unlimited, or [\033[32m*=100k\033[0m] for anonymous clients")
+    ap2.add_argument("--bw-grace", metavar="SZ", type=u, default="1m", help="the first \033[33mSZ\033[0m bytes of each transfer are not delayed by \033[33m--bw-all\033[0m and \033[33m--bw-vol\033[0m, so small requests (listings, thumbnails) stay snappy while big downloads are queued")
+
+
+def add_cz(ap):
+    ap2 = ap.add_argument_group('on-the-fly compression options (listings, json, html, text files)')
+    ap2.add_argument("--no-cz", action="store_true", help="never compress responses on the fly; only precompressed .gz files in .cpr/ are sent compressed")
+    ap2.add_argument("--cz", metavar="ALGS", type=u, default="zstd,br,gz", help="compression algorithms to offer, in order of preference; [\033[32mzstd\033[0m] and [\033[32mbr\033[0m] are skipped unless the python modules zstandard / brotli are installed")
+    ap2.add_argument("--cz-min", metavar="BYTES", type=int, default=2048, help="only compress responses larger than \033[33mBYTES\033[0m")
+    ap2.add_argument("--cz-fmax", metavar="MiB", type=int, default=4, help="only compress static text files smaller than \033[33mMiB\033[0m")
+    ap2.add_argument("--cz-cache", metavar="MiB", type=int, default=32, help="cache up to \033[33mMiB\033[0m of compressed static text files in memory (per process if -j); [\033[32m0\033[0m] disables compression of static files")
+
+
 def add_tls(ap, cert_path):
     ap2 = ap.add_argument_group('SSL/TLS options')
     ap2.add_argument("--http-only", action="store_true", help="disable ssl/tls -- force plaintext")
@@ -1223,6 +1253,8 @@ def add_logging(ap):
     ap2.add_argument("--no-ansi", action="store_true", default=not VT100, help="disable colors; same as environment-variable NO_COLOR")
     ap2.add_argument("--ansi", action="store_true", help="force colors; overrides environment-variable NO_COLOR")
     ap2.add_argument("--no-logflush", action="store_true", help="don't flush the logfile after each write; tiny bit faster")
+    ap2.add_argument("--log-q", metavar="N", type=int, default=0, help="hand log messages to a background thread through a queue of up to \033[33mN\033[0m messages, so slow terminals or logfiles don't stall requests; writes are batched and the logfile is flushed once per batch. 0 = log synchronously")
+    ap2.add_argument("--log-drop", action="store_true", help="when the \033[33m--log-q\033[0m is full, drop messages (counted in the log and /.cpr/metrics) instead of waiting for room")
     ap2.add_argument("--no-voldump", action="store_true", help="do not list volumes and permissions on startup")
     ap2.add_argument("--log-tdec", metavar="N", type=int, default=3, help="timestamp resolution / number of timestamp decimals")
     ap2.add_argument("--log-badpwd", metavar="N", type=int, default=1, help="log failed login attempt passwords: 0=terse, 1=plaintext, 2=hashed")
@@ -1258,6 +1290,7 @@ def add_thumbnail(ap):
     ap2.add_argument("--th-poke", metavar="SEC", type=int, default=300, help="activity labeling cooldown -- avoids doing keepalive pokes (updating the mtime) on thumbnail folders more often than \033[33mSEC\033[0m seconds")
     ap2.add_argument("--th-clean", metavar="SEC", type=int, default=43200, help="cleanup interval; 0=disabled")
     ap2.add_argument("--th-maxage", metavar="SEC", type=int, default=604800, help="max folder age -- folders which haven't been poked for longer than \033[33m--th-poke\033[0m seconds will get deleted every \033[33m--th-clean\033[0m seconds")
+    ap2.add_argument("--th-maxsz", metavar="SZ", type=u, default="0", help="max total size of thumbnails and transcodes in each histpath, for example [\033[32m20g\033[0m]; when exceeded, the least recently used ones are deleted; 0=unlimited")
     ap2.add_argument("--th-covers", metavar="N,N", type=u, default="folder.png,folder.jpg,cover.png,cover.jpg", help="folder thumbnails to stat/look for; enabling \033[33m-e2d\033[0m will make these case-insensitive, and try them as dotfiles (.folder.jpg), and also automatically select thumbnails for all folders that contain pics, even if none match this pattern")
     # https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html
     # https://github.com/libvips/libvips
@@ -1288,6 +1321,9 @@ def add_db_general(ap, hcores):
     ap2.add_argument("-e2v", action="store_true", help="verify file integrity; rehash all files and compare with db")
     ap2.add_argument("-e2vu", action="store_true", help="on hash mismatch: update the database with the new hash")
     ap2.add_argument("-e2vp", action="store_true", help="on hash mismatch: panic and quit copyparty")
+    ap2.add_argument("--e2v-age", metavar="SEC", type=int, default=0, help="continuous \033[33m-e2v\033[0m; rehash each file again when it was last verified more than \033[33mSEC\033[0m seconds ago; 0=just once on startup (resuming an unfinished check)")
+    ap2.add_argument("--e2v-bw", metavar="MiB/s", type=float, default=0, help="max read speed of \033[33m-e2v\033[0m integrity checks; 0=unlimited")
+    ap2.add_argument("--e2v-idle", metavar="SEC", type=float, default=0, help="only do \033[33m-e2v\033[0m integrity checks when there has been no uploads/renames/deletes for \033[33mSEC\033[0m seconds, and no filesystem rescans are running; 0=disabled")
     ap2.add_argument("--hist", metavar="PATH", type=u, default="", help="where to store volume data (db, thumbs); default is a folder named \".hist\" inside each volume (volflag=hist)")
     ap2.add_argument("--no-hash", metavar="PTN", type=u, default="", help="regex: disable hashing of matching absolute-filesystem-paths during e2ds folder scans (volflag=nohash)")
     ap2.add_argument("--no-idx", metavar="PTN", type=u, default=noidx, help="regex: disable indexing of matching absolute-filesystem-paths during e2ds folder scans (volflag=noidx)")
@@ -1295,9 +1331,13 @@ def add_db_general(ap, hcores):
     ap2.add_argument("--re-dhash", action="store_true", help="force a cache rebuild on startup; enable this once if it gets out of sync (should never be necessary)")
     ap2.add_argument("--no-forget", action="store_true", help="never forget indexed files, even when deleted from disk -- makes it impossible to ever upload the same file twice -- only useful for offloading uploads to a cloud service or something (volflag=noforget)")
     ap2.add_argument("--dbd", metavar="PROFILE", default="wal", help="database durability profile; sets the tradeoff between robustness and speed, see \033[33m--help-dbd\033[0m (volflag=dbd)")
+    ap2.add_argument("--fts", action="store_true", help="keep a trigram full-text index of filenames, paths and tags, so substring searches (\033[33mname *foo*\033[0m) don't have to scan the whole db; makes the db bigger and indexing a bit slower; needs sqlite 3.34+ (volflag=fts)")
     ap2.add_argument("--xlink", action="store_true", help="on upload: check all volumes for dupes, not just the target volume (volflag=xlink)")
-    ap2.add_argument("--hash-mt", metavar="CORES", type=int, default=hcores, help="num cpu cores to use for file hashing; set 0 or 1 for single-core hashing")
+    ap2.add_argument("--hash-mt", metavar="CORES", type=int, default=hcores, help="num cpu cores to use for file hashing; big files are split into chunks which are hashed in parallel, and small files are hashed several at a time; set 0 or 1 for single-core hashing")
+    ap2.add_argument("--idx-mt", metavar="N", type=int, default=8, help="num threads listing folders ahead of the e2ds filesystem scan; helps a lot on network-disks (NFS/SMB) and large disk arrays; set 0 or 1 to list one folder at a time")
+    ap2.add_argument("--idx-dev", metavar="N", type=int, default=4, help="max num threads from \033[33m--idx-mt\033[0m listing folders on the same device (disk/filesystem) at the same time")
     ap2.add_argument("--re-maxage", metavar="SEC", type=int, default=0, help="rescan filesystem for changes every \033[33mSEC\033[0m seconds; 0=off (volflag=scan)")
+    ap2.add_argument("--inotify", action="store_true", help="linux-only: watch -e2ds volumes for changes, and rescan changed folders within seconds instead of waiting for \033[33m--re-maxage\033[0m; if too many things happen at once, the whole volume is rescanned (volflag=inotify)")
     ap2.add_argument("--db-act", metavar="SEC", type=float, default=10.0, help="defer any scheduled volume reindexing until \033[33mSEC\033[0m seconds after last db write (uploads, renames, ...)")
     ap2.add_argument("--srch-time", metavar="SEC", type=int, default=45, help="search deadline -- terminate searches running for more than \033[33mSEC\033[0m seconds")
     ap2.add_argument("--srch-hits", metavar="N", type=int, default=7999, help="max search results to allow clients to fetch; 125 results will be shown initially")
@@ -1313,6 +1353,7 @@ def add_db_metadata(ap):
     ap2.add_argument("--no-mtag-ff", action="store_true", help="never use FFprobe as tag reader; is probably safer")
     ap2.add_argument("--mtag-to", metavar="SEC", type=int, default=60, help="timeout for FFprobe tag-scan")
     ap2.add_argument("--mtag-mt", metavar="CORES", type=int, default=CORES, help="num cpu cores to use for tag scanning")
+    ap2.add_argument("--mtag-mp", action="store_true", help="read tags with mutagen in \033[33m--mtag-mt\033[0m subprocesses instead of threads; faster initial \033[33m-e2ts\033[0m scans on multicore servers")
     ap2.add_argument("--mtag-v", action="store_true", help="verbose tag scanning; print errors from mtp subprocesses and such")
     ap2.add_argument("--mtag-vv", action="store_true", help="debug mtp settings and mutagen/FFprobe parsers")
     ap2.add_argument("-mtm", metavar="M=t,t,t", type=u, action="append", help="add/replace metadata mapping")
@@ -1426,6 +1467,8 @@ def run_argparse(
 
     add_general(ap, nc, srvname)
     add_network(ap)
+    add_bw(ap)
+    add_cz(ap)
     add_tls(ap, cert_path)
     add_cert(ap, cert_path)
     add_auth(ap)
@@ -106,6 +106,10 @@ class Lim(object):
 
         self.reg: Optional[dict[str, dict[str, Any]]] = None  # up2k registry
 
+        # with -j, nups/bups are tracked by the hub so all processes share them
+        self.ipc: Optional["BrokerCli"] = None
+        self.vpath = ""
+
         self.nups: dict[str, list[float]] = {}  # num tracker
         self.bups: dict[str, list[tuple[float, int]]] = {}  # byte tracker list
         self.bupc: dict[str, int] = {}  # byte tracker cache
@@ -278,12 +282,20 @@ class Lim(object):
         return os.path.join(sub, ret)
 
     def nup(self, ip: str) -> None:
+        if self.ipc:
+            self.ipc.say("lim_nup", self.vpath, ip)
+            return
+
         try:
             self.nups[ip].append(time.time())
         except:
             self.nups[ip] = [time.time()]
 
     def bup(self, ip: str, nbytes: int) -> None:
+        if self.ipc:
+            self.ipc.say("lim_bup", self.vpath, ip, nbytes)
+            return
+
         v = (time.time(), nbytes)
         try:
             self.bups[ip].append(v)
@@ -292,7 +304,16 @@ class Lim(object):
             self.bups[ip] = [v]
             self.bupc[ip] = nbytes
 
+    def chk_ipc(self, ip: str, bup: bool) -> None:
+        assert self.ipc
+        zs = self.ipc.ask("lim_chk", self.vpath, ip, bup).get()
+        if zs:
+            raise Pebkac(429, zs)
+
     def chk_nup(self, ip: str) -> None:
+        if self.nmax and self.ipc:
+            return self.chk_ipc(ip, False)
+
         if not self.nmax or ip not in self.nups:
             return
 
@@ -305,6 +326,9 @@ class Lim(object):
             raise Pebkac(429, "too many uploads")
 
     def chk_bup(self, ip: str) -> None:
+        if self.bmax and self.ipc:
+            return self.chk_ipc(ip, True)
+
         if not self.bmax or ip not in self.bups:
             return
 
@@ -794,12 +818,14 @@ class AuthSrv(object):
         log_func: Optional["RootLogger"],
         warn_anonwrite: bool = True,
         dargs: Optional[argparse.Namespace] = None,
+        ipc: Optional["BrokerCli"] = None,
     ) -> None:
         self.ah = PWHash(args)
         self.args = args
         self.dargs = dargs or args
         self.log_func = log_func
         self.warn_anonwrite = warn_anonwrite
+        self.ipc = ipc  # -j worker; share upload limits through the hub
         self.line_ctr = 0
         self.indent = ""
 
@@ -1664,6 +1690,10 @@ class AuthSrv(object):
                 use = True
                 lim.bmax, lim.bwin = [unhumanize(x) for x in zs.split(",")]
 
+            if lim.nmax or lim.bmax:
+                lim.ipc = self.ipc
+                lim.vpath = vol.vpath
+
             zs = vol.flags.get("vmaxb")
             if zs:
                 use = True
@@ -1786,6 +1816,12 @@ class AuthSrv(object):
                 if k in vol.flags:
                     vol.flags[k] = float(vol.flags[k])
 
+            for k in ("bwvol", "bwusr"):
+                if vol.flags.get(k) in ("", None):
+                    vol.flags.pop(k, None)  # not set; keep it out of the volflags
+                else:
+                    vol.flags[k] = unhumanize(str(vol.flags[k]))
+
             for k in ("mv_re", "rm_re"):
                 try:
                     zs1, zs2 = vol.flags[k + "try"].split("/")
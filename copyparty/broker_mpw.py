@@ -55,7 +55,7 @@ class MpWorker(BrokerCli):
                 signal.signal(sig, self.signal_handler)
 
         # starting to look like a good idea
-        self.asrv = AuthSrv(args, None, False)
+        self.asrv = AuthSrv(args, None, False, ipc=self)
 
         # instantiate all services here (TODO: inheritance?)
         self.iphash = HMaccas(os.path.join(self.args.E.cfg, "iphash"), 8)
@@ -100,6 +100,10 @@ class MpWorker(BrokerCli):
             elif dest == "set_netdevs":
                 self.httpsrv.set_netdevs(args[0])
 
+            elif dest == "ban":
+                # from the hub; another process (or ftp) banned someone
+                self.httpsrv.bans[args[0]] = args[1]
+
             elif dest == "retq":
                 # response from previous ipc call
                 with self.retpend_mutex:
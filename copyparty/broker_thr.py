@@ -65,6 +65,10 @@ class BrokerThr(BrokerCli):
             self.httpsrv.set_netdevs(args[0])
             return
 
+        if dest == "ban":
+            self.httpsrv.bans[args[0]] = args[1]
+            return
+
         # new ipc invoking managed service in hub
         obj = self.hub
         for node in dest.split("."):
@@ -34,9 +34,11 @@ def vf_bmap() -> dict[str, str]:
         "e2vu",
         "e2vp",
         "exp",
+        "fts",
         "grid",
         "gsel",
         "hardlink",
+        "inotify",
         "magic",
         "no_sb_md",
         "no_sb_lg",
@@ -55,6 +57,8 @@ def vf_bmap() -> dict[str, str]:
 def vf_vmap() -> dict[str, str]:
     """argv-to-volflag: simple values"""
     ret = {
+        "bw_usr": "bwusr",
+        "bw_vol": "bwvol",
         "no_hash": "nohash",
         "no_idx": "noidx",
         "re_maxage": "scan",
@@ -153,6 +157,10 @@ flagcats = {
         "sz=1k-3m": "allow filesizes between 1 KiB and 3MiB",
         "df=1g": "ensure 1 GiB free disk space",
     },
+    "bandwidth limits\n(per direction; uploads and downloads are separate)": {
+        "bwvol=10m": "all clients combined max 10 MiB/s in this volume",
+        "bwusr=1m": "each user (or ip if not logged in) max 1 MiB/s in this volume",
+    },
     "upload rotation\n(moves all uploads into the specified folder structure)": {
         "rotn=100,3": "3 levels of subfolders with 100 entries in each",
         "rotf=%Y-%m/%d-%H": "date-formatted organizing",
@@ -172,12 +180,14 @@ flagcats = {
         "d2d": "disables all database stuff, overrides -e2*",
         "hist=/tmp/cdb": "puts thumbnails and indexes at that location",
         "scan=60": "scan for new files every 60sec, same as --re-maxage",
+        "inotify": "rescan changed folders within seconds (linux only)",
         "nohash=\\.iso$": "skips hashing file contents if path matches *.iso",
         "noidx=\\.iso$": "fully ignores the contents at paths matching *.iso",
         "noforget": "don't forget files when deleted from disk",
         "fat32": "avoid excessive reindexing on android sdcardfs",
         "dbd=[acid|swal|wal|yolo]": "database speed-durability tradeoff",
         "xlink": "cross-volume dupe detection / linking",
+        "fts": "trigram index for fast substring searches (sqlite 3.34+)",
         "xdev": "do not descend into other filesystems",
         "xvol": "do not follow symlinks leaving the volume root",
         "dotsrch": "show dotfiles in search results",
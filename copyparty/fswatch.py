@@ -0,0 +1,174 @@
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import ctypes
+import errno
+import os
+import struct
+import threading
+import time
+
+from .util import Daemon, fsdec, fsenc, min_ex
+
+if True:  # pylint: disable=using-constant-test
+    from typing import Any, Callable
+
+    from .util import RootLogger
+
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+IN_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+
+
+class FsWatch(object):
+    """
+    linux inotify; collects the folders where something changed,
+    so up2k can rescan just those instead of the whole volume
+    """
+
+    def __init__(self, log: "RootLogger", cb: Callable[[], None]) -> None:
+        self.log_func = log
+        self.cb = cb
+        self.mutex = threading.Lock()
+        self.wds: dict[int, tuple[str, str]] = {}  # wd: (ptop, abspath)
+        self.aps: dict[str, int] = {}  # abspath: wd
+        self.dirty: dict[str, dict[str, bool]] = {}  # ptop: {abspath: deep}
+        self.overflow: set[str] = set()  # ptops which need a full rescan
+        self.t_ev = 0.0
+        self.full = False
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._init = libc.inotify_init1
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = self._init(IN_CLOEXEC)
+        if self.fd < 0:
+            zi = ctypes.get_errno()
+            raise OSError(zi, os.strerror(zi))
+
+        Daemon(self._reader, "fswatch")
+
+    def log(self, msg: str, c: Any = 0) -> None:
+        self.log_func("fswatch", msg, c)
+
+    def watch(self, ptop: str, ap: str) -> None:
+        """start (or keep) watching folder ap in volume ptop"""
+        if self.full:
+            return
+
+        wd = self._add(self.fd, fsenc(ap), IN_MASK)
+        if wd < 0:
+            zi = ctypes.get_errno()
+            if zi == errno.ENOSPC:
+                self.full = True
+                t = "ran out of inotify watches (sysctl fs.inotify.max_user_watches); changes in folders beyond this point will only be noticed by periodic rescans"
+                self.log(t, 3)
+            elif zi != errno.ENOENT:
+                self.log("cannot watch [%s]: %s" % (ap, os.strerror(zi)), 3)
+            return
+
+        with self.mutex:
+            self.wds[wd] = (ptop, ap)
+            self.aps[ap] = wd
+
+    def unwatch(self, ptop: str) -> None:
+        """stop watching all folders in volume ptop"""
+        with self.mutex:
+            for wd, (top, ap) in list(self.wds.items()):
+                if top == ptop:
+                    self._rm(self.fd, wd)
+                    self.aps.pop(ap, None)
+                    del self.wds[wd]
+
+            self.dirty.pop(ptop, None)
+
+    def get_dirty(self, settle: float) -> tuple[set[str], dict[str, dict[str, bool]]]:
+        """
+        returns volumes to rescan fully, and folders to rescan per volume,
+        as long as nothing has happened in the past settle seconds
+        """
+        with self.mutex:
+            if time.time() - self.t_ev < settle:
+                return set(), {}
+
+            ret = (self.overflow, self.dirty)
+            self.overflow = set()
+            self.dirty = {}
+            return ret
+
+    def _unwatch_tree(self, ap: str) -> None:
+        """mutex(fsw) me"""
+        pfx = ap + "/"
+        for zs in [x for x in self.aps if x == ap or x.startswith(pfx)]:
+            wd = self.aps.pop(zs)
+            self._rm(self.fd, wd)
+            self.wds.pop(wd, None)
+
+    def _reader(self) -> None:
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                self.log("stopped: %s" % (min_ex(),), 1)
+                return
+
+            ofs = 0
+            with self.mutex:
+                self.t_ev = time.time()
+                while ofs + 16 <= len(buf):
+                    wd, mask, _, nlen = struct.unpack_from("iIII", buf, ofs)
+                    name = buf[ofs + 16 : ofs + 16 + nlen].rstrip(b"\0")
+                    ofs += 16 + nlen
+                    self._event(wd, mask, fsdec(name))
+
+            self.cb()
+
+    def _event(self, wd: int, mask: int, name: str) -> None:
+        """mutex(fsw) me"""
+        if mask & IN_Q_OVERFLOW:
+            self.overflow.update([x[0] for x in self.wds.values()])
+            return
+
+        try:
+            ptop, ap = self.wds[wd]
+        except KeyError:
+            return
+
+        if mask & IN_IGNORED:
+            # folder was deleted, or the fs unmounted
+            del self.wds[wd]
+            if self.aps.get(ap) == wd:
+                del self.aps[ap]
+            return
+
+        if not name or name.endswith(".PARTIAL"):
+            # up2k writes chunks into those; the final rename is a MOVED_TO
+            return
+
+        dirty = self.dirty.setdefault(ptop, {})
+        dirty[ap] = dirty.get(ap, False)
+        if not mask & IN_ISDIR:
+            return
+
+        # new folders get walked entirely; deleted ones get forgotten entirely
+        sub = os.path.join(ap, name)
+        dirty[sub] = True
+        if mask & IN_MOVED_FROM:
+            self._unwatch_tree(sub)
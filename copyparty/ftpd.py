@@ -92,10 +92,9 @@ class FtpAuth(DummyAuthorizer):
                 bonk, ip = g.bonk(ip, handler.username)
                 if bonk:
                     logging.warning("client banned: invalid passwords")
-                    bans[ip] = bonk
+                    self.hub.ban(ip, bonk)
                     try:
                         # only possible if multiprocessing disabled
-                        self.hub.broker.httpsrv.bans[ip] = bonk  # type: ignore
                         self.hub.broker.httpsrv.nban += 1  # type: ignore
                     except:
                         pass
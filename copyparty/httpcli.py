@@ -13,6 +13,8 @@ import json
 import os
 import random
 import re
+import select
+import socket
 import stat
 import string
 import threading  # typechk
@@ -44,9 +46,11 @@ from .util import unquote  # type: ignore
 from .util import (
     APPLESAN_RE,
     BITNESS,
+    CZ_ENC,
     HTTPCODE,
     META_NOBOTS,
     UTC,
+    BwLim,
     Garda,
     MultipartParser,
     ODict,
@@ -56,6 +60,7 @@ from .util import (
     absreal,
     alltrace,
     atomic_move,
+    cz_pack,
     exclude_dotfiles,
     formatdate,
     fsenc,
@@ -83,6 +88,7 @@ from .util import (
     relchk,
     ren_open,
     runhook,
+    s3dec,
     s3enc,
     sanitize_fn,
     sanitize_vpath,
@@ -107,6 +113,8 @@ if True:  # pylint: disable=using-constant-test
     from typing import Any, Generator, Match, Optional, Pattern, Type, Union
 
 if TYPE_CHECKING:
+    import sqlite3
+
     from .httpconn import HttpConn
 
 _ = (argparse, threading)
@@ -688,7 +696,7 @@ class HttpCli(object):
         if not g.lim:
             return False
 
-        bonk, ip = g.bonk(self.ip, v + self.gctx)
+        bonk, ip = self.conn.hsrv.bonk(g, self.ip, v + self.gctx)
         if not bonk:
             return False
 
@@ -708,7 +716,7 @@ class HttpCli(object):
             reason,
         ):
             self.log("client banned: %s" % (descr,), 1)
-            self.conn.hsrv.bans[ip] = bonk
+            self.conn.hsrv.ban(ip, bonk)
             self.conn.hsrv.nban += 1
             return True
 
@@ -872,11 +880,21 @@ class HttpCli(object):
             except:
                 pass
 
-        self.send_headers(len(body), status, mime, headers)
+        zb = body
+        if self.mode != "HEAD" and status not in (204, 206, 304):
+            zs = (headers or {}).get("Content-Type") or mime
+            zs = zs or self.out_headers.get("Content-Type") or "text/html"
+            alg = self.conn.hsrv.cz.pick(self.headers, zs, len(body))
+            if alg:
+                zb = cz_pack(body, alg)
+                self.out_headers["Content-Encoding"] = CZ_ENC[alg]
+                self.out_headers["Vary"] += ", Accept-Encoding"
+
+        self.send_headers(len(zb), status, mime, headers)
 
         try:
             if self.mode != "HEAD":
-                self.s.sendall(body)
+                self.s.sendall(zb)
         except:
             raise Pebkac(400, "client d/c while replying body")
 
@@ -1692,6 +1710,9 @@ class HttpCli(object):
         reader, remains = self.get_body_reader()
         vfs, rem = self.asrv.vfs.get(self.vpath, self.uname, False, True)
         rnd, _, lifetime, xbu, xau = self.upload_flags(vfs)
+        bw = self.bw_lim(vfs, True)
+        if bw:
+            reader = bw.wrap(reader)
         lim = vfs.get_dbv(rem)[0].lim
         fdir = vfs.canonical(rem)
         if lim:
@@ -1986,6 +2007,27 @@ class HttpCli(object):
         else:
             self.log("bakflip ok", 2)
 
+    def conn_alive(self) -> bool:
+        """
+        false if the client has disconnected while waiting for a reply;
+        clients don't send anything else until then (no pipelining),
+        so the socket becoming readable means it was closed
+        """
+        try:
+            if not select.select([self.s], [], [], 0)[0]:
+                return True
+
+            if self.tls:
+                return False
+
+            return bool(self.s.recv(1, socket.MSG_PEEK))
+        except:
+            return False
+
+    def bw_lim(self, vn: VFS, up: bool) -> Optional[BwLim]:
+        """bandwidth limits (--bw-all, bwvol, bwusr) for a transfer in vn"""
+        return self.conn.hsrv.shaper.get(vn.flags, vn.vpath, self.uname, self.ip, up)
+
     def _spd(self, nbytes: int, add: bool = True) -> str:
         if add:
             self.conn.nbyte += nbytes
@@ -2089,13 +2131,96 @@ class HttpCli(object):
         if "delete" in self.uparam:
             return self.handle_rm(body)
 
+        if "batch" in body:
+            return self.handle_hs_batch(body["batch"])
+
+        self._hs_prep(body, self.vpath, {})
+
+        # not to protect u2fh, but to prevent handshakes while files are closing
+        with self.u2mutex:
+            x = self.conn.hsrv.broker.ask("up2k.handle_json", body, self.u2fh.aps)
+            ret = x.get()
+
+        if self.is_vproxied:
+            if "purl" in ret:
+                ret["purl"] = self.args.SR + ret["purl"]
+
+        ret = json.dumps(ret)
+        self.log(ret)
+        self.reply(ret.encode("utf-8"), mime="application/json")
+        return True
+
+    def handle_hs_batch(self, reqs: list[dict[str, Any]]) -> bool:
+        """
+        up2k handshake for many files in one request; each file can have
+        a subfolder (rd) relative to the url, and the reply is a list of
+        handshake replies, or {"err": http-status, "msg": reason}
+        """
+        if not isinstance(reqs, list) or len(reqs) > 4096:
+            raise Pebkac(400, "bad handshake batch")
+
+        # the entries which failed here are kept out of the batch
+        # (by index), so up2k never sees a client-supplied "err"
+        dirs: dict[str, Any] = {}
+        rets: list[dict[str, Any]] = []
+        oks: list[int] = []
+        for n, body in enumerate(reqs):
+            try:
+                if not isinstance(body, dict):
+                    raise Pebkac(400, "handshake is not an object")
+
+                rd = body.pop("rd", None) or ""
+                zs = body.get("name")
+                if not isinstance(rd, unicode) or not isinstance(zs, unicode):
+                    raise Pebkac(400, "handshake needs a name and an optional rd")
+
+                self._hs_prep(body, vjoin(self.vpath, undot(rd)), dirs)
+                oks.append(n)
+                rets.append({})
+            except Pebkac as ex:
+                rets.append({"err": ex.code, "msg": str(ex)})
+
+        if oks:
+            cjs = [reqs[n] for n in oks]
+            with self.u2mutex:
+                x = self.conn.hsrv.broker.ask(
+                    "up2k.handle_json_batch", cjs, self.u2fh.aps
+                )
+                for n, ret in zip(oks, x.get()):
+                    rets[n] = ret
+
+        if self.is_vproxied:
+            for ret in rets:
+                if "purl" in ret:
+                    ret["purl"] = self.args.SR + ret["purl"]
+
+        nerr = len([x for x in rets if "err" in x])
+        self.log("handshake batch; %d files, %d errors" % (len(rets), nerr))
+        ret = json.dumps({"batch": rets})
+        self.reply(ret.encode("utf-8"), mime="application/json")
+        return True
+
+    def _hs_prep(self, body: dict[str, Any], vpath: str, dirs: dict[str, Any]) -> None:
+        """
+        fill in the server-side info for an up2k handshake into vpath;
+        dirs caches the folder lookups (and their errors) for batches
+        """
         name = undot(body["name"])
         if "/" in name:
             raise Pebkac(400, "your client is old; press CTRL-SHIFT-R and try again")
 
-        vfs, rem = self.asrv.vfs.get(self.vpath, self.uname, False, True)
-        dbv, vrem = vfs.get_dbv(rem)
+        try:
+            zt = dirs[vpath]
+        except:
+            try:
+                zt = dirs[vpath] = self._hs_dir(vpath)
+            except Pebkac as ex:
+                zt = dirs[vpath] = ex
 
+        if isinstance(zt, Pebkac):
+            raise zt
+
+        dbv, vrem, can_delete = zt
         body["vtop"] = dbv.vpath
         body["ptop"] = dbv.realpath
         body["prel"] = vrem
@@ -2104,9 +2229,15 @@ class HttpCli(object):
         body["addr"] = self.ip
         body["vcfg"] = dbv.flags
 
-        if not self.can_delete:
+        if not can_delete:
             body.pop("replace", None)
 
+    def _hs_dir(self, vpath: str) -> tuple[VFS, str, bool]:
+        """the volume for uploads into vpath, and if they may replace files"""
+        vfs, rem = self.asrv.vfs.get(vpath, self.uname, False, True)
+        can_delete = self.asrv.vfs.can_access(vpath, self.uname)[3]
+        dbv, vrem = vfs.get_dbv(rem)
+
         if rem:
             dst = vfs.canonical(rem)
             try:
@@ -2125,19 +2256,7 @@ class HttpCli(object):
             except:
                 raise Pebkac(500, min_ex())
 
-        # not to protect u2fh, but to prevent handshakes while files are closing
-        with self.u2mutex:
-            x = self.conn.hsrv.broker.ask("up2k.handle_json", body, self.u2fh.aps)
-            ret = x.get()
-
-        if self.is_vproxied:
-            if "purl" in ret:
-                ret["purl"] = self.args.SR + ret["purl"]
-
-        ret = json.dumps(ret)
-        self.log(ret)
-        self.reply(ret.encode("utf-8"), mime="application/json")
-        return True
+        return dbv, vrem, can_delete
 
     def handle_search(self, body: dict[str, Any]) -> bool:
         idx = self.conn.get_u2idx()
@@ -2202,6 +2321,9 @@ class HttpCli(object):
         return True
 
     def handle_post_binary(self) -> bool:
+        if "x-up2k-pack" in self.headers:
+            return self.handle_post_pack()
+
         try:
             postsize = remains = int(self.headers["content-length"])
         except:
@@ -2247,6 +2369,7 @@ class HttpCli(object):
                         pass
 
             f = f or open(fsenc(path), "rb+", self.args.iobuf)
+            bw = self.bw_lim(vfs, True)
 
             try:
                 for chash, cstart in zip(chashes, cstarts):
@@ -2254,6 +2377,8 @@ class HttpCli(object):
                     reader = read_socket(
                         self.sr, self.args.s_rd_sz, min(remains, chunksize)
                     )
+                    if bw:
+                        reader = bw.wrap(reader)
                     post_sz, _, sha_b64 = hashcopy(reader, f, self.args.s_wr_slp)
 
                     if sha_b64 != chash:
@@ -2290,6 +2415,8 @@ class HttpCli(object):
                 if not fpool:
                     f.close()
                 else:
+                    # flush before up2k.jnl says the chunk is done
+                    f.flush()
                     with self.u2mutex:
                         self.u2fh.put(path, f)
             except:
@@ -2324,6 +2451,116 @@ class HttpCli(object):
         self.reply(b"thank")
         return True
 
+    def handle_post_pack(self) -> bool:
+        """
+        many small files in one POST; each is a header line
+        "wark chunkhash size\n" followed by the file contents,
+        and must fit in one chunk (the whole file)
+        """
+        try:
+            postsize = remains = int(self.headers["content-length"])
+        except:
+            raise Pebkac(400, "you must supply a content-length for binary POST")
+
+        vfs, _ = self.asrv.vfs.get(self.vpath, self.uname, False, True)
+        ptop = (vfs.dbv or vfs).realpath
+        bw = self.bw_lim(vfs, True)
+
+        done: list[tuple[str, str]] = []
+        errs: dict[str, str] = {}
+        while remains > 0:
+            buf = b""
+            while b"\n" not in buf:
+                if len(buf) >= min(256, remains):
+                    raise Pebkac(400, "bad up2k pack header")
+                try:
+                    buf += self.sr.recv(min(256, remains) - len(buf))
+                except:
+                    raise Pebkac(400, "client d/c during up2k pack header")
+
+            ofs = buf.index(b"\n") + 1
+            if ofs < len(buf):
+                self.sr.unrecv(buf[ofs:])
+
+            try:
+                wark, chash, zs = buf[: ofs - 1].decode("ascii").split(" ")
+                sz = int(zs)
+                remains -= ofs + sz
+                if sz < 0 or remains < 0:
+                    raise Exception()
+            except:
+                raise Pebkac(400, "bad up2k pack header")
+
+            reader = read_socket(self.sr, self.args.s_rd_sz, sz)
+            try:
+                zg = bw.wrap(reader) if bw else reader
+                err = self._pack_write(vfs, ptop, wark, chash, sz, zg)
+            finally:
+                for _ in reader:
+                    pass
+
+            if err:
+                errs[wark] = err
+            else:
+                done.append((wark, chash))
+
+        if done:
+            x = self.conn.hsrv.broker.ask(
+                "up2k.finish_pack", ptop, done, self.u2fh.aps
+            )
+            errs.update(x.get())
+
+        cinf = self.headers.get("x-up2k-stat", "")
+        spd = self._spd(postsize)
+        nfiles = len(set(x[0] for x in done) | set(errs))
+        t = "{:70} thank {} ({} files, {} failed)"
+        self.log(t.format(spd, cinf, nfiles, len(errs)))
+        self.reply(json.dumps({"err": errs}).encode("utf-8"), mime="application/json")
+        return True
+
+    def _pack_write(
+        self,
+        vfs: VFS,
+        ptop: str,
+        wark: str,
+        chash: str,
+        sz: int,
+        reader: Generator[bytes, None, None],
+    ) -> str:
+        """write one file from an up2k pack; returns an error message if it failed"""
+        try:
+            x = self.conn.hsrv.broker.ask("up2k.handle_chunks", ptop, wark, [chash])
+            chunksize, cstarts, path, _, _ = x.get()
+        except Exception as ex:
+            return str(ex) if isinstance(ex, Pebkac) else repr(ex)
+
+        try:
+            if sz > chunksize or len(cstarts[0]) > 1:
+                return "file does not fit in one chunk; cannot be packed"
+
+            if self.args.nw:
+                path = os.devnull
+
+            with open(fsenc(path), "rb+", self.args.iobuf) as f:
+                f.seek(cstarts[0][0])
+                post_sz, _, sha_b64 = hashcopy(reader, f, self.args.s_wr_slp)
+                if sha_b64 != chash:
+                    try:
+                        self.bakflip(f, cstarts[0][0], post_sz, sha_b64, vfs.flags)
+                    except:
+                        self.log("bakflip failed: " + min_ex())
+
+                    t = "your chunk got corrupted somehow (received {} bytes); expected vs received hash:\n{}\n{}"
+                    return t.format(post_sz, chash, sha_b64)
+
+            return ""
+        except Exception as ex:
+            self.log("pack: %s" % (min_ex(),), 3)
+            return str(ex) if isinstance(ex, Pebkac) else repr(ex)
+        finally:
+            x = self.conn.hsrv.broker.ask("up2k.release_chunks", ptop, wark, [chash])
+            x.get()
+
     def handle_login(self) -> bool:
         assert self.parser
         pwd = self.parser.require("cppwd", 64)
@@ -2499,6 +2736,7 @@ class HttpCli(object):
 
         upload_vpath = self.vpath
         lim = vfs.get_dbv(rem)[0].lim
+        bw = self.bw_lim(vfs, True)
         fdir_base = vfs.canonical(rem)
         if lim:
             fdir_base, rem = lim.all(
@@ -2599,6 +2837,9 @@ class HttpCli(object):
                         f, tnam = zfw["orz"]
                         tabspath = os.path.join(fdir, tnam)
                         self.log("writing to {}".format(tabspath))
+                        if bw:
+                            p_data = bw.wrap(p_data)
+
                         sz, sha_hex, sha_b64 = hashcopy(
                             p_data, f, self.args.s_wr_slp, max_sz
                         )
@@ -2976,6 +3217,67 @@ class HttpCli(object):
 
         return file_lastmod, True
 
+    def _chk_etag(self, etag: str, cli_etags: str, strong: bool) -> bool:
+        """true if one of the client's etags (if-none-match, if-range) is ours"""
+        if not etag:
+            return False
+
+        for zs in cli_etags.split(","):
+            zs = zs.strip()
+            if zs == "*" and not strong:
+                return True
+            if zs.startswith("W/"):
+                if strong:
+                    continue
+                zs = zs[2:]
+            if zs == etag:
+                return True
+
+        return False
+
+    def _parse_ranges(self, hrange: str, file_sz: int) -> list[tuple[int, int]]:
+        """
+        parse a range header into a sorted list of (lower, upper),
+        merging overlaps; empty list if unsatisfiable or malformed
+        """
+        ret: list[tuple[int, int]] = []
+        try:
+            unit, zs = hrange.split("=", 1)
+            if unit.strip().lower() != "bytes":
+                raise Exception()
+
+            for rng in zs.split(","):
+                a, b = [x.strip() for x in rng.split("-")]
+                if a:
+                    lower = int(a)
+                    upper = int(b) + 1 if b else file_sz
+                else:
+                    # suffix; the final N bytes
+                    lower = max(0, file_sz - int(b))
+                    upper = file_sz
+
+                upper = min(upper, file_sz)
+                if lower < 0 or lower >= upper:
+                    continue
+
+                ret.append((lower, upper))
+        except:
+            return []
+
+        ret.sort()
+        zl: list[tuple[int, int]] = []
+        for lower, upper in ret:
+            if zl and lower <= zl[-1][1]:
+                zl[-1] = (zl[-1][0], max(zl[-1][1], upper))
+            else:
+                zl.append((lower, upper))
+
+        if len(zl) > 64:
+            # too much hassle; send the whole range instead
+            zl = [(zl[0][0], zl[-1][1])]
+
+        return zl
+
     def _use_dirkey(self, vn: VFS, ap: str) -> bool:
         if self.can_read or not self.can_get:
             return False
@@ -3030,6 +3332,68 @@ class HttpCli(object):
         self.log(t % (zs, req, self.req, ap), 6)
         return False
 
+    def _ls_tags(
+        self,
+        icur: "sqlite3.Cursor",
+        mem_cur: "sqlite3.Cursor",
+        rd: str,
+        up_ip: bool,
+        up_at: bool,
+    ) -> dict[str, dict[str, Any]]:
+        """tags of all indexed files in a folder; fn => tags"""
+        ret: dict[str, dict[str, Any]] = {}
+        qs = [
+            "select up.fn, mt.k, mt.v from up inner join mt on mt.w = substr(up.w,1,16) where up.rd = ? and +mt.k != 'x'"
+        ]
+        if up_ip:
+            qs.append("select fn, ip, at from up where rd = ?")
+        elif up_at:
+            qs.append("select fn, '', at from up where rd = ?")
+
+        erd = rd
+        for n, q in enumerate(qs):
+            try:
+                try:
+                    r = icur.execute(q, (erd,))
+                except Exception as ex:
+                    if "database is locked" in str(ex) or erd != rd:
+                        raise
+
+                    erd = s3enc(mem_cur, rd, "")[0]
+                    r = icur.execute(q, (erd,))
+
+                if n:
+                    for fn, ip, at in r:
+                        if fn.startswith("//"):
+                            fn = s3dec("", fn)[1]
+
+                        tags = ret.setdefault(fn, {})
+                        if ip:
+                            tags["up_ip"] = ip
+                        if at:
+                            tags[".up_at"] = at
+                    continue
+
+                # rows arrive grouped by file
+                pfn = ""
+                tags = {}
+                for fn, k, v in r:
+                    if fn != pfn:
+                        pfn = fn
+                        if fn.startswith("//"):
+                            fn = s3dec("", fn)[1]
+
+                        tags = ret.setdefault(fn, {})
+
+                    tags[k] = v
+            except Exception as ex:
+                if "database is locked" not in str(ex):
+                    t = "tag read error, {}\n{}"
+                    self.log(t.format(rd, min_ex()))
+                break
+
+        return ret
+
     def _add_logues(
         self, vn: VFS, abspath: str, lnames: Optional[dict[str, str]]
     ) -> tuple[list[str], str]:
@@ -3120,6 +3484,7 @@ class HttpCli(object):
 
         file_ts = 0.0
         editions: dict[str, tuple[str, int]] = {}
+        etags: dict[str, str] = {}
         for ext in ("", ".gz"):
             if ptop is not None:
                 sz = job["size"]
@@ -3141,6 +3506,8 @@ class HttpCli(object):
                         os.close(fd)
                 else:
                     sz = st.st_size
+                    zt = (st.st_ino, sz, int(st.st_mtime * 1000000))
+                    etags[ext or "plain"] = '"%x-%x-%x' % zt
 
                 file_ts = max(file_ts, st.st_mtime)
                 editions[ext or "plain"] = (fs_path, sz)
@@ -3152,17 +3519,19 @@ class HttpCli(object):
         if not editions:
             return self.tx_404()
 
-        #
-        # if-modified
-
-        file_lastmod, do_send = self._chk_lastmod(int(file_ts))
-        self.out_headers["Last-Modified"] = file_lastmod
-        if not do_send:
-            status = 304
-
         if self.can_write:
             self.out_headers["X-Lastmod3"] = str(int(file_ts * 1000))
 
+        if "txt" in self.uparam:
+            mime = "text/plain; charset={}".format(self.uparam["txt"] or "utf-8")
+        elif "mime" in self.uparam:
+            mime = str(self.uparam.get("mime"))
+        else:
+            mime = guess_mime(req_path)
+
+        if "nohtml" in self.vn.flags and "html" in mime:
+            mime = "text/plain; charset=utf-8"
+
         #
         # Accept-Encoding and UA decides which edition to send
 
@@ -3188,41 +3557,65 @@ class HttpCli(object):
             selected_edition = "plain"
 
         fs_path, file_sz = editions[selected_edition]
-        logmsg += "{} ".format(selected_edition.lstrip("."))
 
-        #
-        # partial
+        # or compress on the fly (--cz), unless the client wants a range
+        zalg = ""
+        cz = self.conn.hsrv.cz
+        if (
+            not is_compressed
+            and ptop is None
+            and selected_edition in etags  # not a blockdev
+            and file_sz <= cz.fmax
+            and "range" not in self.headers
+        ):
+            zalg = cz.pick(self.headers, mime, file_sz)
+            if zalg:
+                self.out_headers["Content-Encoding"] = CZ_ENC[zalg]
+                self.out_headers["Vary"] += ", Accept-Encoding"
 
-        lower = 0
-        upper = file_sz
-        hrange = self.headers.get("range")
+        logmsg += "{} ".format(zalg or selected_edition.lstrip("."))
 
-        # let's not support 206 with compression
-        # and multirange / multipart is also not-impl (mostly because calculating contentlength is a pain)
-        if do_send and not is_compressed and hrange and file_sz and "," not in hrange:
-            try:
-                if not hrange.lower().startswith("bytes"):
-                    raise Exception()
+        #
+        # if-modified / if-none-match
 
-                a, b = hrange.split("=", 1)[1].split("-")
+        file_lastmod, do_send = self._chk_lastmod(int(file_ts))
+        self.out_headers["Last-Modified"] = file_lastmod
 
-                if a.strip():
-                    lower = int(a.strip())
-                else:
-                    lower = 0
+        etag = etags.get(selected_edition, "")
+        if etag:
+            if zalg:
+                etag += '-%s"' % (zalg,)
+            else:
+                etag += '-d"' if decompress else '"'
+            self.out_headers["ETag"] = etag
+            cli_etags = self.headers.get("if-none-match")
+            if cli_etags:
+                do_send = not self._chk_etag(etag, cli_etags, False)
 
-                if b.strip():
-                    upper = int(b.strip()) + 1
-                else:
-                    upper = file_sz
+        if not do_send:
+            status = 304
 
-                if upper > file_sz:
-                    upper = file_sz
+        #
+        # partial
 
-                if lower < 0 or lower >= upper:
-                    raise Exception()
+        lower = 0
+        upper = file_sz
+        ranges: list[tuple[int, int]] = []
+        hrange = self.headers.get("range")
+        if hrange and "if-range" in self.headers:
+            # only send the range if the client has the same edition
+            zs = self.headers["if-range"]
+            if zs.startswith('"') or zs.startswith("W/"):
+                use_range = self._chk_etag(etag, zs, True)
+            else:
+                use_range = zs == file_lastmod
+            if not use_range:
+                hrange = None
 
-            except:
+        # let's not support 206 with compression
+        if do_send and not is_compressed and hrange and file_sz:
+            ranges = self._parse_ranges(hrange, file_sz)
+            if not ranges:
                 err = "invalid range ({}), size={}".format(hrange, file_sz)
                 self.loud_reply(
                     err,
@@ -3231,12 +3624,23 @@ class HttpCli(object):
                 )
                 return True
 
+            if len(ranges) > 1 and ptop is not None:
+                ranges = ranges[:1]  # tx_pipe does one range only
+
             status = 206
-            self.out_headers["Content-Range"] = "bytes {}-{}/{}".format(
-                lower, upper - 1, file_sz
-            )
+            if len(ranges) == 1:
+                lower, upper = ranges[0]
+                ranges = []
+                self.out_headers["Content-Range"] = "bytes {}-{}/{}".format(
+                    lower, upper - 1, file_sz
+                )
 
-            logtail += " [\033[36m{}-{}\033[0m]".format(lower, upper)
+                logtail += " [\033[36m{}-{}\033[0m]".format(lower, upper)
+            else:
+                zs = ",".join("%d-%d" % (a, b) for a, b in ranges[:4])
+                if len(ranges) > 4:
+                    zs += ",...%d" % (len(ranges),)
+                logtail += " [\033[36m{}\033[0m]".format(zs)
 
         use_sendfile = False
         if decompress:
@@ -3263,19 +3667,28 @@ class HttpCli(object):
         else:
             self.permit_caching()
 
-        if "txt" in self.uparam:
-            mime = "text/plain; charset={}".format(self.uparam["txt"] or "utf-8")
-        elif "mime" in self.uparam:
-            mime = str(self.uparam.get("mime"))
-        else:
-            mime = guess_mime(req_path)
-
-        if "nohtml" in self.vn.flags and "html" in mime:
-            mime = "text/plain; charset=utf-8"
-
         self.out_headers["Accept-Ranges"] = "bytes"
         logmsg += unicode(status) + logtail
 
+        # multipart/byteranges; a header before each part and a trailer at the end
+        parts: list[tuple[bytes, int, int]] = []
+        if ranges:
+            bnd = "%016x" % (random.getrandbits(64),)
+            zs = "\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n"
+            for a, b in ranges:
+                zb = (zs % (bnd, mime, a, b - 1, file_sz)).encode("utf-8")
+                parts.append((zb, a, b))
+            parts.append((("\r\n--%s--\r\n" % (bnd,)).encode("utf-8"), 0, 0))
+            upper = sum(len(x[0]) + x[2] - x[1] for x in parts)
+            mime = "multipart/byteranges; boundary=" + bnd
+        else:
+            parts.append((b"", lower, upper))
+
+        zb = b""
+        if zalg and do_send:
+            zb = cz.get(fs_path, zalg, file_ts, file_sz)
+            upper = len(zb)
+
         if self.mode == "HEAD" or not do_send:
             if self.do_log:
                 self.log(logmsg)
@@ -3288,21 +3701,39 @@ class HttpCli(object):
                 ptop, req_path, ap_data, job, lower, upper, status, mime, logmsg
             )
 
+        if zalg:
+            return self.tx_zb(zb, status, mime, logmsg)
+
         ret = True
+        remains = 0
+        bw = self.bw_lim(self.vn, False)
         with open_func(*open_args) as f:
             self.send_headers(length=upper - lower, status=status, mime=mime)
 
             sendfun = sendfile_kern if use_sendfile else sendfile_py
-            remains = sendfun(
-                self.log,
-                lower,
-                upper,
-                f,
-                self.s,
-                self.args.s_wr_sz,
-                self.args.s_wr_slp,
-                not self.args.no_poll,
-            )
+            for hdr, a, b in parts:
+                if hdr:
+                    try:
+                        self.s.sendall(hdr)
+                    except:
+                        remains = 1
+                        break
+
+                if b > a:
+                    remains = sendfun(
+                        self.log,
+                        a,
+                        b,
+                        f,
+                        self.s,
+                        self.args.s_wr_sz,
+                        self.args.s_wr_slp,
+                        not self.args.no_poll,
+                        bw,
+                    )
+                    if remains > 0:
+                        remains += sum(x[2] - x[1] for x in parts if x[1] > a)
+                        break
 
         if remains > 0:
             logmsg += " \033[31m" + unicode(upper - remains) + "\033[0m"
@@ -3314,6 +3745,28 @@ class HttpCli(object):
 
         return ret
 
+    def tx_zb(self, zb: bytes, status: int, mime: str, logmsg: str) -> bool:
+        """send the compressed edition of a file from tx_file"""
+        self.send_headers(length=len(zb), status=status, mime=mime)
+        bw = self.bw_lim(self.vn, False)
+        bsz = bw.bufsz if bw else len(zb)
+        ofs = 0
+        try:
+            while ofs < len(zb):
+                buf = zb[ofs : ofs + bsz]
+                if bw:
+                    bw.take(len(buf))
+                self.s.sendall(buf)
+                ofs += len(buf)
+        except:
+            logmsg += " \033[31m" + unicode(ofs) + "\033[0m"
+
+        spd = self._spd(ofs)
+        if self.do_log:
+            self.log("{},  {}".format(logmsg, spd))
+
+        return ofs == len(zb)
+
     def tx_pipe(
         self,
         ptop: str,
@@ -3330,6 +3783,10 @@ class HttpCli(object):
         self.send_headers(length=upper - lower, status=status, mime=mime)
         wr_slp = self.args.s_wr_slp
         wr_sz = self.args.s_wr_sz
+        bw = self.bw_lim(self.vn, False)
+        if bw:
+            wr_sz = min(wr_sz, bw.bufsz)
+
         file_size = job["size"]
         chunk_size = up2k_chunksize(file_size)
         num_need = -1
@@ -3441,6 +3898,9 @@ class HttpCli(object):
                     broken = True
                     break
 
+                if bw:
+                    bw.take(zi)
+
         if lower < upper and not broken:
             with open(req_path, "rb") as f:
                 remains = sendfile_py(
@@ -3452,6 +3912,7 @@ class HttpCli(object):
                     wr_sz,
                     wr_slp,
                     not self.args.no_poll,
+                    bw,
                 )
 
         spd = self._spd((upper - lower) - remains)
@@ -3546,6 +4007,7 @@ class HttpCli(object):
             cmp=uarg if cancmp or uarg == "pax" else "",
         )
         bsent = 0
+        bw = self.bw_lim(vn, False)
         for buf in bgen.gen():
             if not buf:
                 break
@@ -3558,6 +4020,9 @@ class HttpCli(object):
                 bgen.stop()
                 break
 
+            if bw:
+                bw.take(len(buf))
+
         spd = self._spd(bsent)
         self.log("{},  {}".format(logmsg, spd))
         return True
@@ -3760,6 +4225,7 @@ class HttpCli(object):
                 "hashq": None,
                 "tagq": None,
                 "mtpq": None,
+                "e2vq": None,
                 "dbwt": None,
             }
 
@@ -3775,7 +4241,7 @@ class HttpCli(object):
 
             if vstate:
                 txt += "\nstatus:"
-                for k in ["scanning", "hashq", "tagq", "mtpq", "dbwt"]:
+                for k in ["scanning", "hashq", "tagq", "mtpq", "e2vq", "dbwt"]:
                     txt += " {}({})".format(k, vs[k])
 
             if rvol:
@@ -3804,6 +4270,7 @@ class HttpCli(object):
             hashq=vs["hashq"],
             tagq=vs["tagq"],
             mtpq=vs["mtpq"],
+            e2vq=vs["e2vq"],
             dbwt=vs["dbwt"],
             url_suf=suf,
             k304=self.k304(),
@@ -4339,7 +4806,9 @@ class HttpCli(object):
 
                 thp = None
                 if self.thumbcli and not nothumb:
-                    thp = self.thumbcli.get(dbv, vrem, int(st.st_mtime), th_fmt)
+                    thp = self.thumbcli.get(
+                        dbv, vrem, int(st.st_mtime), th_fmt, self.ip, self.conn_alive
+                    )
 
                 if thp:
                     return self.tx_file(thp)
@@ -4739,53 +5208,21 @@ class HttpCli(object):
         add_up_at = ".up_at" in mte
         is_admin = self.can_admin
         tagset: set[str] = set()
-        for fe in files:
-            fn = fe["name"]
-            rd = fe["rd"]
-            del fe["rd"]
-            if not icur:
-                continue
-
+        ftags: dict[str, dict[str, Any]] = {}
+        if icur and files:
+            # every file is in the same folder; one query for all of them
+            rd = files[0]["rd"]
             if vn != dbv:
                 _, rd = vn.get_dbv(rd)
 
-            erd_efn = (rd, fn)
-            q = "select mt.k, mt.v from up inner join mt on mt.w = substr(up.w,1,16) where up.rd = ? and up.fn = ? and +mt.k != 'x'"
-            try:
-                r = icur.execute(q, erd_efn)
-            except Exception as ex:
-                if "database is locked" in str(ex):
-                    break
-
-                try:
-                    erd_efn = s3enc(idx.mem_cur, rd, fn)
-                    r = icur.execute(q, erd_efn)
-                except:
-                    t = "tag read error, {}/{}\n{}"
-                    self.log(t.format(rd, fn, min_ex()))
-                    break
-
-            tags = {k: v for k, v in r}
+            ftags = self._ls_tags(icur, idx.mem_cur, rd, is_admin, add_up_at)
 
-            if is_admin:
-                q = "select ip, at from up where rd=? and fn=?"
-                try:
-                    zs1, zs2 = icur.execute(q, erd_efn).fetchone()
-                    if zs1:
-                        tags["up_ip"] = zs1
-                    if zs2:
-                        tags[".up_at"] = zs2
-                except:
-                    pass
-            elif add_up_at:
-                q = "select at from up where rd=? and fn=?"
-                try:
-                    (zs1,) = icur.execute(q, erd_efn).fetchone()
-                    if zs1:
-                        tags[".up_at"] = zs1
-                except:
-                    pass
+        for fe in files:
+            del fe["rd"]
+            if not icur:
+                continue
 
+            tags = ftags.get(fe["name"]) or {}
             _ = [tagset.add(k) for k in tags]
             fe["tags"] = tags
 
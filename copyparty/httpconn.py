@@ -71,6 +71,7 @@ class HttpConn(object):
         self.ico: Ico = Ico(self.args)  # mypy404
 
         self.t0: float = time.time()  # mypy404
+        self.ev_t: float = 0.0  # when it was parked in the event-loop
         self.freshen_pwd: float = 0.0
         self.stopping = False
         self.nreq: int = -1  # mypy404
@@ -146,7 +147,12 @@ class HttpConn(object):
 
         return not method or not bool(PTN_HTTP.match(method))
 
-    def run(self) -> None:
+    def run(self) -> bool:
+        """returns true if the connection should be parked in the event-loop"""
+        if self.sr:
+            # resuming a keep-alive connection from the event-loop
+            return self.run_reqs()
+
         self.s.settimeout(10)
 
         self.sr = None
@@ -161,7 +167,7 @@ class HttpConn(object):
         if is_https:
             if self.sr:
                 self.log("TODO: cannot do https in jython", c="1;31")
-                return
+                return False
 
             self.log_src = self.log_src.replace("[36m", "[35m")
             try:
@@ -210,17 +216,35 @@ class HttpConn(object):
                 else:
                     self.log("handshake\033[0m " + em, c=5)
 
-                return
+                return False
 
         if not self.sr:
             self.sr = Util.Unrecv(self.s, self.log)
 
+        return self.run_reqs()
+
+    def run_reqs(self) -> bool:
         while not self.stopping:
             self.nreq += 1
             self.cli = HttpCli(self)
             if not self.cli.run():
-                return
+                return False
 
             if self.u2idx:
                 self.hsrv.put_u2idx(str(self.addr), self.u2idx)
                 self.u2idx = None
+
+            if self.hsrv.ev_sel and self.can_park():
+                return True
+
+        return False
+
+    def can_park(self) -> bool:
+        """true if the next request header has not been received yet"""
+        assert self.sr
+        if b"\r\n\r\n" in self.sr.buf:
+            return False
+
+        # tls may have decrypted data that epoll won't tell us about
+        pending = getattr(self.s, "pending", None)
+        return not pending or not pending()
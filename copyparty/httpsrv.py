@@ -12,6 +12,22 @@ import time
 
 import queue
 
+try:
+    if os.environ.get("PRTY_NO_TLS"):
+        raise Exception()
+
+    HAVE_SSL = True
+    import ssl
+except:
+    HAVE_SSL = False
+
+try:
+    import selectors
+
+    HAVE_SELECTORS = True
+except:
+    HAVE_SELECTORS = False
+
 from .__init__ import ANYWIN, CORES, EXE, MACOS, PY2, TYPE_CHECKING, EnvParams, unicode
 
 try:
@@ -62,11 +78,13 @@ from .util import (
     E_SCK,
     FHC,
     CachedDict,
+    Cz,
     Daemon,
     Garda,
     Magician,
     Netdev,
     NetMap,
+    Shaper,
     absreal,
     build_netmap,
     ipnorm,
@@ -88,6 +106,10 @@ if PY2:
     range = xrange  # type: ignore
 
 
+# Garda instances in HttpSrv and SvcHub
+GARDAS = ("gpwd", "g404", "g403", "g422", "gmal", "gurl")
+
+
 class HttpSrv(object):
     """
     handles incoming connections using HttpConn to process http,
@@ -116,6 +138,8 @@ class HttpSrv(object):
         self.g422 = Garda(self.args.ban_422, False)
         self.gmal = Garda(self.args.ban_422)
         self.gurl = Garda(self.args.ban_url)
+        self.shaper = Shaper(self.args)
+        self.cz = Cz(self.args)
         self.bans: dict[str, int] = {}
         self.aclose: dict[str, int] = {}
 
@@ -143,6 +167,14 @@ class HttpSrv(object):
         self.ncli = 0  # exact
         self.clients: set[HttpConn] = set()  # laggy
         self.nclimax = 0
+
+        # event-loop for idle keep-alive connections (--evloop)
+        self.ev_sel: Optional["selectors.BaseSelector"] = None
+        self.ev_q: list[HttpConn] = []  # waiting to be registered
+        self.ev_n = 0  # num parked (included in ncli)
+        self.ev_tx: Optional[socket.socket] = None
+        self.ev_rx: Optional[socket.socket] = None
+        self.ev_again: tuple[type, ...] = ()
         self.cb_ts = 0.0
         self.cb_v = ""
 
@@ -179,6 +211,9 @@ class HttpSrv(object):
         if self.tp_q:
             self.start_threads(4)
 
+        if self.args.evloop:
+            self.ev_init()
+
         if nid:
             if self.args.stackmon:
                 start_stackmon(self.args.stackmon, nid)
@@ -204,6 +239,39 @@ class HttpSrv(object):
                 if ap.endswith(".gz"):
                     self.statics.add(ap[:-3])
 
+    def ev_init(self) -> None:
+        if not HAVE_SELECTORS:
+            self.log(self.name, "cannot --evloop; python too old", 3)
+            return
+
+        self.ev_rx, self.ev_tx = socket.socketpair()
+        self.ev_rx.setblocking(False)
+        self.ev_tx.setblocking(False)
+        self.ev_again = (BlockingIOError, InterruptedError)
+        if HAVE_SSL:
+            self.ev_again += (ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+        self.ev_sel = selectors.DefaultSelector()
+        self.ev_sel.register(self.ev_rx, selectors.EVENT_READ, None)
+        zs = type(self.ev_sel).__name__
+        self.log(self.name, "event-loop: " + zs, 6)
+        Daemon(self.thr_evloop, self.name + "-evloop")
+
+    def ban(self, ip: str, until: int) -> None:
+        """ban ip; with -j the hub also tells the other processes"""
+        self.bans[ip] = until
+        if self.nid:
+            self.broker.say("ban", ip, until)
+
+    def bonk(self, g: Garda, ip: str, prev: str) -> tuple[int, str]:
+        """Garda.bonk; with -j the counters are kept by the hub"""
+        if not self.nid:
+            return g.bonk(ip, prev)
+
+        gk = next(k for k in GARDAS if getattr(self, k) is g)
+        bonk, ip = self.broker.ask("garda_bonk", gk, ip, prev).get()
+        return bonk, ip
+
     def set_netdevs(self, netdevs: dict[str, Netdev]) -> None:
         ips = set()
         for ip, _ in self.bound:
@@ -234,7 +302,8 @@ class HttpSrv(object):
             with self.u2mutex, self.mutex:
                 self.u2fh.clean()
                 if self.tp_q:
-                    self.tp_ncli = max(self.ncli, self.tp_ncli - 2)
+                    nact = self.ncli - self.ev_n
+                    self.tp_ncli = max(nact, self.tp_ncli - 2)
                     if self.tp_nthr > self.tp_ncli + 8:
                         self.stop_threads(4)
 
@@ -331,7 +400,7 @@ class HttpSrv(object):
 
                 t = "slowloris (idle-conn): {} banned for {} min"
                 self.log(self.name, t.format(ip, self.args.loris, nclose), 1)
-                self.bans[ip] = int(time.time() + self.args.loris * 60)
+                self.ban(ip, int(time.time() + self.args.loris * 60))
 
             if self.args.log_conn:
                 self.log(self.name, "|%sC-acc1" % ("-" * 2,), c="90")
@@ -378,13 +447,33 @@ class HttpSrv(object):
 
                 self.t_periodic = Daemon(self.periodic, name)
 
+        if self.ev_sel:
+            # wait for the first bytes before spending a thread on it
+            cli = HttpConn(sck, addr, self)
+            with self.mutex:
+                self.clients.add(cli)
+
+            self.ev_park(cli)
+            return
+
+        self.dispatch(sck, addr, None)
+
+    def dispatch(
+        self, sck: socket.socket, addr: tuple[str, int], cli: Optional[HttpConn]
+    ) -> None:
+        """
+        hands a connection to a worker thread;
+        either a new one, or one returning from the event-loop
+        """
+        with self.mutex:
             if self.tp_q:
-                self.tp_time = self.tp_time or now
-                self.tp_ncli = max(self.tp_ncli, self.ncli)
-                if self.tp_nthr < self.ncli + 4:
+                nact = self.ncli - self.ev_n
+                self.tp_time = self.tp_time or time.time()
+                self.tp_ncli = max(self.tp_ncli, nact)
+                if self.tp_nthr < nact + 4:
                     self.start_threads(8)
 
-                self.tp_q.put((sck, addr))
+                self.tp_q.put((sck, addr, cli))
                 return
 
         if not self.args.no_htp:
@@ -394,7 +483,7 @@ class HttpSrv(object):
         Daemon(
             self.thr_client,
             "httpconn-%s-%d" % (addr[0].split(".", 2)[-1][-6:], addr[1]),
-            (sck, addr),
+            (sck, addr, cli),
         )
 
     def thr_poolw(self) -> None:
@@ -408,10 +497,10 @@ class HttpSrv(object):
                 self.tp_time = 0
 
             try:
-                sck, addr = task
+                sck, addr, cli = task
                 me = threading.current_thread()
                 me.name = "httpconn-%s-%d" % (addr[0].split(".", 2)[-1][-6:], addr[1])
-                self.thr_client(sck, addr)
+                self.thr_client(sck, addr, cli)
                 me.name = self.name + "-poolw"
             except Exception as ex:
                 if str(ex).startswith("client d/c "):
@@ -446,19 +535,23 @@ class HttpSrv(object):
 
         self.log(self.name, "ok bye")
 
-    def thr_client(self, sck: socket.socket, addr: tuple[str, int]) -> None:
+    def thr_client(
+        self, sck: socket.socket, addr: tuple[str, int], cli: Optional[HttpConn]
+    ) -> None:
         """thread managing one tcp client"""
-        cli = HttpConn(sck, addr, self)
-        with self.mutex:
-            self.clients.add(cli)
+        if not cli:
+            cli = HttpConn(sck, addr, self)
+            with self.mutex:
+                self.clients.add(cli)
 
         # print("{}\n".format(len(self.clients)), end="")
         fno = sck.fileno()
+        parked = False
         try:
             if self.args.log_conn:
                 self.log("%s %s" % addr, "|%sC-crun" % ("-" * 4,), c="90")
 
-            cli.run()
+            parked = cli.run()
 
         except (OSError, socket.error) as ex:
             if ex.errno not in E_SCK:
@@ -469,29 +562,144 @@ class HttpSrv(object):
                 )
 
         finally:
-            sck = cli.s
-            if self.args.log_conn:
-                self.log("%s %s" % addr, "|%sC-cdone" % ("-" * 5,), c="90")
+            if parked:
+                self.ev_park(cli)
+            else:
+                self.drop_client(cli)
 
-            try:
-                fno = sck.fileno()
-                shut_socket(cli.log, sck)
-            except (OSError, socket.error) as ex:
-                if not MACOS:
-                    self.log(
-                        "%s %s" % addr,
-                        "shut({}): {}".format(fno, ex),
-                        c="90",
-                    )
-                if ex.errno not in E_SCK:
-                    raise
-            finally:
-                with self.mutex:
-                    self.clients.remove(cli)
-                    self.ncli -= 1
+    def drop_client(self, cli: HttpConn) -> None:
+        addr = cli.addr
+        sck = cli.s
+        if self.args.log_conn:
+            self.log("%s %s" % addr, "|%sC-cdone" % ("-" * 5,), c="90")
 
-                if cli.u2idx:
-                    self.put_u2idx(str(addr), cli.u2idx)
+        try:
+            fno = sck.fileno()
+            shut_socket(cli.log, sck)
+        except (OSError, socket.error) as ex:
+            if not MACOS:
+                self.log(
+                    "%s %s" % addr,
+                    "shut({}): {}".format(fno, ex),
+                    c="90",
+                )
+            if ex.errno not in E_SCK:
+                raise
+        finally:
+            with self.mutex:
+                self.clients.remove(cli)
+                self.ncli -= 1
+
+            if cli.u2idx:
+                self.put_u2idx(str(addr), cli.u2idx)
+
+    def ev_park(self, cli: HttpConn) -> None:
+        """hands an idle keep-alive connection over to the event-loop"""
+        assert self.ev_tx
+        cli.ev_t = time.time()
+        with self.mutex:
+            self.ev_n += 1
+            self.ev_q.append(cli)
+
+        try:
+            self.ev_tx.send(b"x")
+        except:
+            pass  # wakeup already pending
+
+    def thr_evloop(self) -> None:
+        """
+        holds idle connections in a selector (epoll/kqueue/...) and
+        hands them to a worker thread once a request header has arrived
+        """
+        sel = self.ev_sel
+        rx = self.ev_rx
+        assert sel and rx
+        t_idle = self.args.s_thead
+        t_sweep = 0.0
+        while not self.stopping:
+            with self.mutex:
+                zl = self.ev_q
+                self.ev_q = []
+
+            for cli in zl:
+                try:
+                    cli.s.setblocking(False)
+                    sel.register(cli.s, selectors.EVENT_READ, cli)
+                except Exception as ex:
+                    cli.log("evloop-reg: %r" % (ex,), 3)
+                    self.ev_drop(cli, False)
+
+            for key, _ in sel.select(1):
+                cli = key.data
+                if not cli:
+                    try:
+                        rx.recv(4096)
+                    except:
+                        pass
+                    continue
+
+                st = self.ev_read(cli)
+                if not st:
+                    continue
+
+                sel.unregister(key.fileobj)
+                if st == 1:
+                    with self.mutex:
+                        self.ev_n -= 1
+
+                    self.dispatch(cli.s, cli.addr, cli)
+                else:
+                    self.ev_drop(cli, True)
+
+            now = time.time()
+            if now - t_sweep < 2:
+                continue
+
+            t_sweep = now
+            for key in list(sel.get_map().values()):
+                cli = key.data
+                if cli and (cli.stopping or now - cli.ev_t > t_idle):
+                    sel.unregister(key.fileobj)
+                    self.ev_drop(cli, False)
+
+        sel.close()
+
+    def ev_read(self, cli: HttpConn) -> int:
+        """
+        nonblocking read of a parked connection;
+        0=need more, 1=header is ready, 2=client is gone
+        """
+        sr = cli.sr
+        if not sr:
+            # brand new connection; let the worker peek for tls
+            return 1
+
+        try:
+            while True:
+                ofs = max(0, len(sr.buf) - 3)
+                buf = cli.s.recv(32768)
+                if not buf:
+                    return 2
+
+                sr.buf += buf
+                if b"\r\n\r\n" in sr.buf[ofs:] or len(sr.buf) > 1024 * 64:
+                    return 1
+        except self.ev_again:
+            return 0
+        except:
+            return 2
+
+    def ev_drop(self, cli: HttpConn, eof: bool) -> None:
+        with self.mutex:
+            self.ev_n -= 1
+
+        if self.args.log_conn and not eof:
+            self.log("%s %s" % cli.addr, "|%sC-evidle" % ("-" * 5,), c="90")
+
+        try:
+            self.drop_client(cli)
+        except Exception as ex:
+            self.log(self.name, "evloop-drop: %r" % (ex,), 6)
 
     def cachebuster(self) -> str:
         if time.time() - self.cb_ts < 1:
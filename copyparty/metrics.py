@@ -87,6 +87,16 @@ class Metrics(object):
         t = "number of IPs banned since last restart"
         addg("cpp_total_bans", str(self.hsrv.nban), t)
 
+        if args.log_q:
+            nq, _, ndrop, nwait = self.hsrv.broker.ask("log_stats").get()
+            addg("cpp_logq_msgs", str(nq), "number of log messages waiting in --log-q")
+
+            t = "number of log messages dropped because --log-q was full"
+            addc("cpp_logq_dropped", str(ndrop), t)
+
+            t = "number of times a thread had to wait for room in --log-q"
+            addc("cpp_logq_waits", str(nwait), t)
+
         if not args.nos_vst:
             x = self.hsrv.broker.ask("up2k.get_state")
             vs = json.loads(x.get())
@@ -118,6 +128,15 @@ class Metrics(object):
             t = "number of files queued for metadata scanning"
             addg("cpp_tagq_files", str(vs["tagq"]), t)
 
+            t = "number of files left to verify (-e2v)"
+            addg("cpp_e2vq_files", str(vs["e2vq"]), t)
+
+            t = "number of bytes left to verify (-e2v)"
+            addug("cpp_e2vq", "bytes", str(vs["e2vb"]), t)
+
+            t = "number of hash mismatches found by -e2v since startup"
+            addc("cpp_e2v_mismatches", str(vs["e2vbad"]), t)
+
             try:
                 t = "number of files queued for plugin-based analysis"
                 addg("cpp_mtpq_files", str(int(vs["mtpq"])), t)
@@ -8,16 +8,22 @@ import shutil
 import subprocess as sp
 import sys
 import tempfile
+import threading
+from queue import Empty, Queue
 
-from .__init__ import ANYWIN, EXE, PY2, WINDOWS, E, unicode
+from .__init__ import ANYWIN, EXE, MACOS, PY2, WINDOWS, E, unicode
 from .authsrv import VFS
 from .bos import bos
 from .util import (
     FFMPEG_URL,
+    NICEB,
     REKOBO_LKEY,
     VF_CAREFUL,
+    Daemon,
     fsenc,
+    killtree,
     min_ex,
+    mp,
     pybin,
     retchk,
     runcmd,
@@ -64,6 +70,7 @@ class MParser(object):
         self.audio = "y"
         self.pri = 0  # priority; higher = later
         self.ext = []
+        self.coproc = False  # keep running; one file at a time over stdin
 
         while True:
             try:
@@ -88,6 +95,10 @@ class MParser(object):
                 self.kill = arg[1:]  # [t]ree [m]ain [n]one
                 continue
 
+            if arg == "cp":
+                self.coproc = True
+                continue
+
             if arg.startswith("c"):
                 self.capture = int(arg[1:])  # 0=none 1=stdout 2=stderr 3=both
                 continue
@@ -111,6 +122,89 @@ class MParser(object):
             raise Exception()
 
 
+class MCoproc(object):
+    """
+    an mtp parser with the cp flag; started once (per tagging thread)
+    without a filename, then given one file at a time as a line of json
+    on stdin ({"path": abspath, "tags": {...}}), and replies with one line
+    on stdout -- the tag value, or json if it provides several tags
+    """
+
+    def __init__(
+        self, log: "NamedLogger", parser: MParser, env: dict[str, str], verbose: bool
+    ) -> None:
+        self.log = log
+        self.parser = parser
+        self.q: Queue[Optional[bytes]] = Queue()
+
+        argv = [sfsenc(parser.bin)]
+        if parser.bin.endswith(".py"):
+            argv = [sfsenc(pybin)] + argv
+
+        ka: dict[str, Any] = {}
+        if WINDOWS:
+            ka["creationflags"] = 0x4000
+        elif NICEB:
+            argv = [NICEB] + argv
+
+        serr = None if verbose else sp.DEVNULL
+        self.p = sp.Popen(
+            argv, stdin=sp.PIPE, stdout=sp.PIPE, stderr=serr, env=env, **ka
+        )
+        if not ANYWIN and not MACOS:
+            try:
+                with open("/proc/%d/oom_score_adj" % (self.p.pid,), "wb") as f:
+                    f.write(b"300\n")
+            except:
+                pass
+
+        Daemon(self._reader, "mtp-cp-%d" % (self.p.pid,))
+
+    def _reader(self) -> None:
+        assert self.p.stdout
+        for ln in iter(self.p.stdout.readline, b""):
+            self.q.put(ln)
+
+        self.q.put(None)
+
+    def run(self, abspath: str, tags: Optional[dict[str, Any]]) -> str:
+        """returns the reply to one file; throws if it timed out or crashed"""
+        assert self.p.stdin
+        zd: dict[str, Any] = {"path": abspath}
+        if tags is not None:
+            zd["tags"] = tags
+
+        self.p.stdin.write(json.dumps(zd).encode("utf-8", "replace") + b"\n")
+        self.p.stdin.flush()
+        try:
+            ln = self.q.get(timeout=self.parser.timeout)
+        except Empty:
+            self.kill()
+            raise Exception("timeout after %d sec" % (self.parser.timeout,))
+
+        if ln is None:
+            raise Exception("coprocess exited with %s" % (self.p.poll(),))
+
+        return ln.decode("utf-8", "replace")
+
+    def kill(self) -> None:
+        kill = self.parser.kill
+        if kill == "n":
+            pass  # leave it be; a new one is started for the next file
+        elif kill == "m":
+            self.p.kill()
+        else:
+            killtree(self.p.pid)
+
+    def stop(self) -> None:
+        try:
+            assert self.p.stdin
+            self.p.stdin.close()
+            self.p.wait(2)
+        except:
+            self.kill()
+
+
 def au_unpk(
     log: "NamedLogger", fmt_map: dict[str, str], abspath: str, vn: Optional[VFS] = None
 ) -> str:
@@ -325,6 +419,7 @@ class MTag(object):
     def __init__(self, log_func: "RootLogger", args: argparse.Namespace) -> None:
         self.log_func = log_func
         self.args = args
+        self.tls = threading.local()  # coprocesses of each tagging thread
         self.usable = True
         self.prefer_mt = not args.no_mtag_ff
         self.backend = (
@@ -643,14 +738,19 @@ class MTag(object):
                     "capture": parser.capture,
                 }
 
+                zd = None
                 if parser.pri:
                     zd = oth_tags.copy()
                     zd.update(ret)
                     args["sin"] = json.dumps(zd).encode("utf-8", "replace")
 
-                bcmd = [sfsenc(x) for x in cmd[:-1]] + [fsenc(cmd[-1])]
-                rc, v, err = runcmd(bcmd, **args)  # type: ignore
-                retchk(rc, bcmd, err, self.log, 5, self.args.mtag_v)
+                if parser.coproc:
+                    v = self._run_coproc(parser, env, ap, zd)
+                else:
+                    bcmd = [sfsenc(x) for x in cmd[:-1]] + [fsenc(cmd[-1])]
+                    rc, v, err = runcmd(bcmd, **args)  # type: ignore
+                    retchk(rc, bcmd, err, self.log, 5, self.args.mtag_v)
+
                 v = v.strip()
                 if not v:
                     continue
@@ -671,3 +771,101 @@ class MTag(object):
             wunlink(self.log, ap, VF_CAREFUL)
 
         return ret
+
+    def _run_coproc(
+        self,
+        parser: MParser,
+        env: dict[str, str],
+        abspath: str,
+        tags: Optional[dict[str, Any]],
+    ) -> str:
+        try:
+            cps = self.tls.cps
+        except:
+            cps = self.tls.cps = {}
+
+        k = parser.tag + "=" + parser.bin
+        cp = cps.get(k)
+        if not cp:
+            if self.args.mtag_v:
+                self.log("starting coprocess %s" % (k,))
+            cp = cps[k] = MCoproc(self.log, parser, env, self.args.mtag_v)
+
+        try:
+            return cp.run(abspath, tags)
+        except:
+            del cps[k]
+            cp.stop()
+            raise
+
+    def stop_coprocs(self) -> None:
+        """stop the coprocesses which were started by this thread"""
+        cps = getattr(self.tls, "cps", None) or {}
+        for cp in cps.values():
+            cp.stop()
+
+        self.tls.cps = {}
+
+
+def _mtag_proc(q_in: Any, q_out: Any, args: argparse.Namespace) -> None:
+    """subprocess main for MTagProc; logs are sent back to the parent"""
+    import signal
+
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, signal.SIG_IGN)
+
+    def log(src: str, msg: str, c: Union[int, str] = 0) -> None:
+        q_out.put((2, msg, c))
+
+    mtag = MTag(log, args)
+    while True:
+        abspath = q_in.get()
+        if abspath is None:
+            return
+
+        try:
+            q_out.put((0, mtag.get(abspath), None))
+        except Exception:
+            q_out.put((1, min_ex(), None))
+
+
+class MTagProc(object):
+    """
+    reads media tags (mutagen/ffprobe) in a subprocess (--mtag-mp),
+    one file at a time; mutagen is pure python so several threads
+    would mostly be waiting for the GIL, but processes scale
+    """
+
+    def __init__(self, log: "NamedLogger", args: argparse.Namespace) -> None:
+        self.log = log
+        try:
+            ctx = mp.get_context("spawn")  # forking a threaded parent is no good
+        except AttributeError:
+            ctx = mp
+
+        self.q_in = ctx.Queue(1)
+        self.q_out = ctx.Queue(64)
+        self.p = ctx.Process(target=_mtag_proc, args=(self.q_in, self.q_out, args))
+        self.p.daemon = True
+        self.p.start()
+
+    def get(self, abspath: str) -> dict[str, Union[str, float]]:
+        self.q_in.put(abspath)
+        while True:
+            try:
+                t, ret, c = self.q_out.get(timeout=5)
+            except Empty:
+                if not self.p.is_alive():
+                    raise Exception("tag-reader process died")
+                continue
+
+            if t == 2:
+                self.log(ret, c)
+            elif t == 1:
+                raise Exception(ret)
+            else:
+                return ret
+
+    def stop(self) -> None:
+        self.q_in.put(None)
+        self.p.join(2)
@@ -2,6 +2,7 @@
 from __future__ import print_function, unicode_literals
 
 import argparse
+import atexit
 import base64
 import calendar
 import errno
@@ -16,6 +17,7 @@ import string
 import sys
 import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
 
 # from inspect import currentframe
@@ -29,7 +31,7 @@ if True:  # pylint: disable=using-constant-test
     from typing import Any, Optional, Union
 
 from .__init__ import ANYWIN, EXE, MACOS, PY2, TYPE_CHECKING, E, EnvParams, unicode
-from .authsrv import BAD_CFG, AuthSrv
+from .authsrv import BAD_CFG, AuthSrv, Lim
 from .cert import ensure_cert
 from .mtag import HAVE_FFMPEG, HAVE_FFPROBE
 from .tcpsrv import TcpSrv
@@ -47,6 +49,7 @@ from .util import (
     HLog,
     HMaccas,
     ODict,
+    Pebkac,
     alltrace,
     ansi_re,
     build_netmap,
@@ -153,6 +156,17 @@ class SvcHub(object):
         if args.lo:
             self._setup_logfile(printed)
 
+        # --log-q: ring buffer drained by the logwriter thread
+        self.logq: deque[tuple[float, str, str, Union[int, str]]] = deque()
+        self.logq_cond = threading.Condition()
+        self.logq_busy = False
+        self.log_ndrop = 0
+        self.log_nwait = 0
+        if args.log_q > 0 and (self.logf or not args.q):
+            self.log = self._log_q
+            Daemon(self._log_writer, "logwriter")
+            atexit.register(self.log_flush)
+
         lg = logging.getLogger()
         lh = HLog(self.log)
         lg.handlers = [lh]
@@ -418,6 +432,45 @@ class SvcHub(object):
 
         self.after_httpsrv_up()
 
+    def ban(self, ip: str, until: int) -> None:
+        """ban ip for ftp/tftp and in all the http processes"""
+        self.bans[ip] = until
+        self.broker.say("ban", ip, until)
+
+    def garda_bonk(self, gk: str, ip: str, prev: str) -> tuple[int, str]:
+        """Garda.bonk on behalf of -j processes, so they share the counters"""
+        g: Garda = getattr(self, gk)
+        return g.bonk(ip, prev)
+
+    def _lim(self, vpath: str) -> Optional[Lim]:
+        vol = self.asrv.vfs.all_vols.get(vpath)
+        return vol.lim if vol else None
+
+    def lim_nup(self, vpath: str, ip: str) -> None:
+        """Lim.nup on behalf of -j processes"""
+        lim = self._lim(vpath)
+        if lim:
+            lim.nup(ip)
+
+    def lim_bup(self, vpath: str, ip: str, nbytes: int) -> None:
+        """Lim.bup on behalf of -j processes"""
+        lim = self._lim(vpath)
+        if lim:
+            lim.bup(ip, nbytes)
+
+    def lim_chk(self, vpath: str, ip: str, bup: bool) -> str:
+        """Lim.chk_bup / chk_nup on behalf of -j processes; returns the error"""
+        lim = self._lim(vpath)
+        try:
+            if lim and bup:
+                lim.chk_bup(ip)
+            elif lim:
+                lim.chk_nup(ip)
+        except Pebkac as ex:
+            return str(ex)
+
+        return ""
+
     def after_httpsrv_up(self) -> None:
         self.up2k.init_vols()
 
@@ -881,6 +934,7 @@ class SvcHub(object):
                 print("\033]0;\033\\", file=sys.stderr, end="")
                 sys.stderr.flush()
 
+            self.log_flush()
             self.pr("\033[0m", end="")
             if self.logf:
                 self.logf.close()
@@ -893,35 +947,38 @@ class SvcHub(object):
             return
 
         with self.log_mutex:
-            zd = datetime.now(UTC)
-            ts = self.log_dfmt % (
-                zd.year,
-                zd.month * 100 + zd.day,
-                (zd.hour * 100 + zd.minute) * 100 + zd.second,
-                zd.microsecond // self.log_div,
-            )
-
-            if c and not self.args.no_ansi:
-                if isinstance(c, int):
-                    msg = "\033[3%sm%s\033[0m" % (c, msg)
-                elif "\033" not in c:
-                    msg = "\033[%sm%s\033[0m" % (c, msg)
-                else:
-                    msg = "%s%s\033[0m" % (c, msg)
+            self._log_out(self._fmt_disabled(time.time(), src, msg, c), False)
+
+    def _fmt_disabled(
+        self, now: float, src: str, msg: str, c: Union[int, str] = 0
+    ) -> str:
+        """log_mutex me"""
+        zd = datetime.fromtimestamp(now, UTC)
+        ts = self.log_dfmt % (
+            zd.year,
+            zd.month * 100 + zd.day,
+            (zd.hour * 100 + zd.minute) * 100 + zd.second,
+            zd.microsecond // self.log_div,
+        )
+
+        if c and not self.args.no_ansi:
+            if isinstance(c, int):
+                msg = "\033[3%sm%s\033[0m" % (c, msg)
+            elif "\033" not in c:
+                msg = "\033[%sm%s\033[0m" % (c, msg)
+            else:
+                msg = "%s%s\033[0m" % (c, msg)
 
-            if "\033" in src:
-                src += "\033[0m"
+        if "\033" in src:
+            src += "\033[0m"
 
-            if "\033" in msg:
-                msg += "\033[0m"
+        if "\033" in msg:
+            msg += "\033[0m"
 
-            self.logf.write("@%s [%-21s] %s\n" % (ts, src, msg))
-            if not self.args.no_logflush:
-                self.logf.flush()
+        if int(now) >= self.next_day:
+            self._set_next_day()
 
-            now = time.time()
-            if int(now) >= self.next_day:
-                self._set_next_day()
+        return "@%s [%-21s] %s\n" % (ts, src, msg)
 
     def _set_next_day(self) -> None:
         if self.next_day and self.logf and self.logf_base_fn != self._logname():
@@ -947,39 +1004,46 @@ class SvcHub(object):
     def _log_enabled(self, src: str, msg: str, c: Union[int, str] = 0) -> None:
         """handles logging from all components"""
         with self.log_mutex:
-            now = time.time()
-            if int(now) >= self.next_day:
-                dt = datetime.fromtimestamp(now, UTC)
-                zs = "{}\n" if self.no_ansi else "\033[36m{}\033[0m\n"
-                zs = zs.format(dt.strftime("%Y-%m-%d"))
-                print(zs, end="")
-                self._set_next_day()
-                if self.logf:
-                    self.logf.write(zs)
-
-            fmt = "\033[36m%s \033[33m%-21s \033[0m%s\n"
-            if self.no_ansi:
-                fmt = "%s %-21s %s\n"
-                if "\033" in msg:
-                    msg = ansi_re.sub("", msg)
-                if "\033" in src:
-                    src = ansi_re.sub("", src)
-            elif c:
-                if isinstance(c, int):
-                    msg = "\033[3%sm%s\033[0m" % (c, msg)
-                elif "\033" not in c:
-                    msg = "\033[%sm%s\033[0m" % (c, msg)
-                else:
-                    msg = "%s%s\033[0m" % (c, msg)
-
-            zd = datetime.fromtimestamp(now, UTC)
-            ts = self.log_efmt % (
-                zd.hour,
-                zd.minute,
-                zd.second,
-                zd.microsecond // self.log_div,
-            )
-            msg = fmt % (ts, src, msg)
+            self._log_out(self._fmt_enabled(time.time(), src, msg, c), True)
+
+    def _fmt_enabled(
+        self, now: float, src: str, msg: str, c: Union[int, str] = 0
+    ) -> str:
+        """log_mutex me"""
+        ret = ""
+        if int(now) >= self.next_day:
+            dt = datetime.fromtimestamp(now, UTC)
+            zs = "{}\n" if self.no_ansi else "\033[36m{}\033[0m\n"
+            ret = zs.format(dt.strftime("%Y-%m-%d"))
+            self._set_next_day()
+
+        fmt = "\033[36m%s \033[33m%-21s \033[0m%s\n"
+        if self.no_ansi:
+            fmt = "%s %-21s %s\n"
+            if "\033" in msg:
+                msg = ansi_re.sub("", msg)
+            if "\033" in src:
+                src = ansi_re.sub("", src)
+        elif c:
+            if isinstance(c, int):
+                msg = "\033[3%sm%s\033[0m" % (c, msg)
+            elif "\033" not in c:
+                msg = "\033[%sm%s\033[0m" % (c, msg)
+            else:
+                msg = "%s%s\033[0m" % (c, msg)
+
+        zd = datetime.fromtimestamp(now, UTC)
+        ts = self.log_efmt % (
+            zd.hour,
+            zd.minute,
+            zd.second,
+            zd.microsecond // self.log_div,
+        )
+        return ret + fmt % (ts, src, msg)
+
+    def _log_out(self, msg: str, stdout: bool) -> None:
+        """log_mutex me; writes one or more formatted lines"""
+        if stdout:
             try:
                 print(msg, end="")
             except UnicodeEncodeError:
@@ -991,10 +1055,70 @@ class SvcHub(object):
                 if ex.errno != errno.EPIPE:
                     raise
 
-            if self.logf:
-                self.logf.write(msg)
-                if not self.args.no_logflush:
-                    self.logf.flush()
+        if self.logf:
+            self.logf.write(msg)
+            if not self.args.no_logflush:
+                self.logf.flush()
+
+    def _log_q(self, src: str, msg: str, c: Union[int, str] = 0) -> None:
+        """--log-q; hands the message to the logwriter thread"""
+        now = time.time()
+        with self.logq_cond:
+            if len(self.logq) >= self.args.log_q:
+                if self.args.log_drop:
+                    self.log_ndrop += 1
+                    return
+
+                self.log_nwait += 1
+                while len(self.logq) >= self.args.log_q:
+                    self.logq_cond.wait()
+
+            self.logq.append((now, src, msg, c))
+            if len(self.logq) == 1:
+                self.logq_cond.notify_all()
+
+    def _log_writer(self) -> None:
+        stdout = not self.args.q
+        fmt = self._fmt_enabled if stdout else self._fmt_disabled
+        ndrop = 0
+        while True:
+            with self.logq_cond:
+                self.logq_busy = False
+                self.logq_cond.notify_all()
+                while not self.logq:
+                    self.logq_cond.wait()
+
+                batch = list(self.logq)
+                self.logq.clear()
+                self.logq_busy = True
+                self.logq_cond.notify_all()
+                if ndrop != self.log_ndrop:
+                    t = "logq full; dropped %d messages" % (self.log_ndrop - ndrop,)
+                    batch.append((time.time(), "root", t, 3))
+                    ndrop = self.log_ndrop
+
+            try:
+                with self.log_mutex:
+                    zs = "".join([fmt(*x) for x in batch])
+                    self._log_out(zs, stdout)
+            except Exception as ex:
+                try:
+                    print("logwriter: %r" % (ex,))
+                except:
+                    pass
+
+    def log_flush(self, timeout: float = 2) -> None:
+        """waits until --log-q is drained"""
+        t0 = time.time()
+        with self.logq_cond:
+            while self.logq or self.logq_busy:
+                if time.time() - t0 > timeout:
+                    break
+                self.logq_cond.wait(0.1)
+
+    def log_stats(self) -> tuple[int, int, int, int]:
+        """logq depth, capacity, dropped, blocked"""
+        return len(self.logq), self.args.log_q, self.log_ndrop, self.log_nwait
 
     def pr(self, *a: Any, **ka: Any) -> None:
         try:
@@ -6,11 +6,11 @@ import os
 from .__init__ import TYPE_CHECKING
 from .authsrv import VFS
 from .bos import bos
-from .th_srv import HAVE_WEBP, thumb_path
+from .th_srv import HAVE_WEBP, TH_POLL, thumb_path
 from .util import Cooldown
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Optional, Union
+    from typing import Callable, Optional, Union
 
 if TYPE_CHECKING:
     from .httpsrv import HttpSrv
@@ -47,7 +47,19 @@ class ThumbCli(object):
     def log(self, msg: str, c: Union[int, str] = 0) -> None:
         self.log_func("thumbcli", msg, c)
 
-    def get(self, dbv: VFS, rem: str, mtime: float, fmt: str) -> Optional[str]:
+    def get(
+        self,
+        dbv: VFS,
+        rem: str,
+        mtime: float,
+        fmt: str,
+        uid: str = "",
+        alive: Optional[Callable[[], bool]] = None,
+    ) -> Optional[str]:
+        """
+        uid identifies the client, to take turns with other clients;
+        gives up waiting (and the conversion is cancelled) if alive() is false
+        """
         ptop = dbv.realpath
         ext = rem.rsplit(".")[-1].lower()
         if ext not in self.thumbable or "dthumb" in dbv.flags:
@@ -156,5 +168,11 @@ class ThumbCli(object):
         if not bos.path.getsize(os.path.join(ptop, rem)):
             return None
 
-        x = self.broker.ask("thumbsrv.get", ptop, rem, mtime, fmt)
-        return x.get()  # type: ignore
+        while True:
+            x = self.broker.ask("thumbsrv.get", ptop, rem, mtime, fmt, uid, TH_POLL)
+            ret = x.get()
+            if ret != "":
+                return ret  # type: ignore
+
+            if alive and not alive():
+                return None
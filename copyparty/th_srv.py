@@ -6,12 +6,11 @@ import hashlib
 import logging
 import os
 import shutil
+import stat
 import subprocess as sp
 import threading
 import time
 
-from queue import Queue
-
 from .__init__ import ANYWIN, PY2, TYPE_CHECKING
 from .authsrv import VFS
 from .bos import bos
@@ -19,6 +18,7 @@ from .mtag import HAVE_FFMPEG, HAVE_FFPROBE, au_unpk, ffprobe
 from .util import BytesIO  # type: ignore
 from .util import (
     FFMPEG_URL,
+    HAVE_SQLITE3,
     Cooldown,
     Daemon,
     Pebkac,
@@ -27,13 +27,14 @@ from .util import (
     min_ex,
     runcmd,
     statdir,
+    unhumanize,
     vsplit,
     wrename,
     wunlink,
 )
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Optional, Union
+    from typing import Any, Optional, Union
 
 if TYPE_CHECKING:
     from .svchub import SvcHub
@@ -41,6 +42,12 @@ if TYPE_CHECKING:
 if PY2:
     range = xrange  # type: ignore
 
+if HAVE_SQLITE3:
+    import sqlite3
+
+TH_POLL = 2.0  # ThumbCli asks again this often while waiting for a conversion
+TH_GONE = 10.0  # queued conversions nobody asked for in this long are cancelled
+
 HAVE_PIL = False
 HAVE_PILF = False
 HAVE_HEIF = False
@@ -141,6 +148,68 @@ def thumb_path(histpath: str, rem: str, mtime: float, fmt: str, ffa: set[str]) -
     return "%s/%s/%s/%s.%x.%s" % (histpath, cat, rd, fn, int(mtime), fmt)
 
 
+class ThumbIdx(object):
+    """
+    size and last use of each thumbnail folder (th) and each transcoded
+    file (ac) in a histpath, so the cache can be trimmed without walking it
+    """
+
+    def __init__(self, histpath: str) -> None:
+        self.mutex = threading.Lock()
+        db_path = os.path.join(histpath, "th.db")
+        self.conn = sqlite3.connect(db_path, timeout=15, check_same_thread=False)
+        self.cur = cur = self.conn.cursor()
+        cur.execute("create table if not exists ti (k text primary key, sz int, t int)")
+        cur.execute("create index if not exists ti_t on ti(t)")
+        self.conn.commit()
+
+        # if not, the cleaner walks the cache to add what was there before
+        self.built = cur.execute("pragma user_version").fetchone()[0] > 0
+        self.nbytes = 0
+        for (sz,) in cur.execute("select sz from ti"):
+            self.nbytes += sz
+
+    def set(self, rows: list[tuple[str, int, int]]) -> None:
+        """add or update entries; (key, size, last-use)"""
+        with self.mutex:
+            q = "select sz from ti where k = ?"
+            for k, sz, _ in rows:
+                zt = self.cur.execute(q, (k,)).fetchone()
+                self.nbytes += sz - (zt[0] if zt else 0)
+
+            self.cur.executemany("insert or replace into ti values (?,?,?)", rows)
+            self.conn.commit()
+
+    def set_built(self) -> None:
+        with self.mutex:
+            self.cur.execute("pragma user_version = 1")
+            self.conn.commit()
+            self.built = True
+
+    def touch(self, k: str, t: int) -> None:
+        with self.mutex:
+            self.cur.execute("update ti set t = ? where k = ?", (t, k))
+            self.conn.commit()
+
+    def pop(self, k: str) -> None:
+        with self.mutex:
+            zt = self.cur.execute("select sz from ti where k = ?", (k,)).fetchone()
+            if zt:
+                self.nbytes -= zt[0]
+                self.cur.execute("delete from ti where k = ?", (k,))
+                self.conn.commit()
+
+    def coldest(self, n: int) -> list[str]:
+        with self.mutex:
+            q = "select k from ti order by t limit ?"
+            return [x[0] for x in self.cur.execute(q, (n,))]
+
+    def older(self, cat: str, t: int) -> list[str]:
+        with self.mutex:
+            q = "select k from ti where t < ? and k like ?||'/%'"
+            return [x[0] for x in self.cur.execute(q, (t, cat))]
+
+
 class ThumbSrv(object):
     def __init__(self, hub: "SvcHub") -> None:
         self.hub = hub
@@ -149,6 +218,8 @@ class ThumbSrv(object):
         self.log_func = hub.log
 
         self.poke_cd = Cooldown(self.args.th_poke)
+        self.maxsz = unhumanize(self.args.th_maxsz or "0")
+        self.idxs: dict[str, ThumbIdx] = {}  # histpath: index
 
         self.mutex = threading.Lock()
         self.busy: dict[str, list[threading.Condition]] = {}
@@ -157,7 +228,12 @@ class ThumbSrv(object):
         self.stopping = False
         self.nthr = max(1, self.args.th_mt)
 
-        self.q: Queue[Optional[tuple[str, str, str, VFS]]] = Queue(self.nthr * 4)
+        # pending conversions; a stack per client (newest first),
+        # and the clients take turns (round-robin)
+        self.qcond = threading.Condition(self.mutex)
+        self.q: dict[str, list[tuple[str, str, str, VFS]]] = {}  # uid: tasks
+        self.q_uids: list[str] = []
+        self.want: dict[str, float] = {}  # tpath: last time a client asked for it
         for n in range(self.nthr):
             Daemon(self.worker, "thumb-{}-{}".format(n, self.nthr))
 
@@ -176,7 +252,10 @@ class ThumbSrv(object):
             if ANYWIN and self.args.no_acode:
                 self.log("download FFmpeg to fix it:\033[0m " + FFMPEG_URL, 3)
 
-        if self.args.th_clean:
+        if not HAVE_SQLITE3 and self.maxsz:
+            self.log("cannot limit the size of the thumbnail cache; need sqlite3", 3)
+
+        if self.args.th_clean or self.maxsz:
             Daemon(self.cleaner, "thumb.cln")
 
         self.fmt_pil, self.fmt_vips, self.fmt_ffi, self.fmt_ffv, self.fmt_ffa = [
@@ -214,9 +293,9 @@ class ThumbSrv(object):
         self.log_func("thumb", msg, c)
 
     def shutdown(self) -> None:
-        self.stopping = True
-        for _ in range(self.nthr):
-            self.q.put(None)
+        with self.mutex:
+            self.stopping = True
+            self.qcond.notify_all()
 
     def stopped(self) -> bool:
         with self.mutex:
@@ -227,7 +306,21 @@ class ThumbSrv(object):
         w, h = vn.flags["thsize"].split("x")
         return int(w) * mul, int(h) * mul
 
-    def get(self, ptop: str, rem: str, mtime: float, fmt: str) -> Optional[str]:
+    def get(
+        self,
+        ptop: str,
+        rem: str,
+        mtime: float,
+        fmt: str,
+        uid: str = "",
+        tmax: float = 0,
+    ) -> Optional[str]:
+        """
+        returns the thumbnail path, or None if it could not be created;
+        if tmax is set and the thumbnail is not ready after tmax seconds,
+        returns "" and the client should ask again to stay in line
+        (a conversion nobody asks for anymore is cancelled)
+        """
         histpath = self.asrv.vfs.histtab.get(ptop)
         if not histpath:
             self.log("no histpath for [{}]".format(ptop))
@@ -237,11 +330,22 @@ class ThumbSrv(object):
         abspath = os.path.join(ptop, rem)
         cond = threading.Condition(self.mutex)
         do_conv = False
+        t0 = time.time()
         with self.mutex:
+            self.want[tpath] = t0
             try:
                 self.busy[tpath].append(cond)
-                self.log("joined waiting room for %s" % (tpath,))
+                if not tmax:
+                    self.log("joined waiting room for %s" % (tpath,))
             except:
+                try:
+                    # finished since the client checked
+                    st = bos.stat(tpath)
+                    self.want.pop(tpath, None)
+                    return tpath if st.st_size else None
+                except:
+                    pass
+
                 thdir = os.path.dirname(tpath)
                 bos.makedirs(os.path.join(thdir, "w"))
 
@@ -260,7 +364,13 @@ class ThumbSrv(object):
                 self.log("ptop [{}] not in {}".format(ptop, allvols), 3)
                 vn = self.asrv.vfs.all_aps[0][1]
 
-            self.q.put((abspath, tpath, fmt, vn))
+            with self.mutex:
+                if uid not in self.q:
+                    self.q[uid] = []
+                    self.q_uids.append(uid)
+                self.q[uid].append((abspath, tpath, fmt, vn))
+                self.qcond.notify()
+
             self.log("conv {} :{} \033[0m{}".format(tpath, fmt, abspath), c=6)
 
         while not self.stopping:
@@ -268,8 +378,15 @@ class ThumbSrv(object):
                 if tpath not in self.busy:
                     break
 
+                now = time.time()
+                if tmax and now - t0 > tmax:
+                    self.busy[tpath].remove(cond)
+                    return ""
+
+                self.want[tpath] = now
+
             with cond:
-                cond.wait(3)
+                cond.wait(min(3, tmax) if tmax else 3)
 
         try:
             st = bos.stat(tpath)
@@ -308,9 +425,38 @@ class ThumbSrv(object):
                 # self.log("at RAM limit; used %.2f GiB, need %.2f more" % (used-need, need), 1)
                 self.memcond.wait(3)
 
+    def dequeue(self) -> Optional[tuple[str, str, str, VFS]]:
+        """
+        next conversion to do; the newest from the client whose turn it is,
+        skipping (cancelling) the ones which nobody is waiting for anymore
+        """
+        with self.mutex:
+            while not self.stopping:
+                if not self.q_uids:
+                    self.qcond.wait(3)
+                    continue
+
+                uid = self.q_uids.pop(0)
+                tasks = self.q[uid]
+                task = tasks.pop()
+                if tasks:
+                    self.q_uids.append(uid)
+                else:
+                    del self.q[uid]
+
+                tpath = task[1]
+                if self.want.pop(tpath, 0) > time.time() - TH_GONE:
+                    return task
+
+                self.log("cancel %s (client left)" % (tpath,), 6)
+                for x in self.busy.pop(tpath, []):
+                    x.notify_all()
+
+        return None
+
     def worker(self) -> None:
         while not self.stopping:
-            task = self.q.get()
+            task = self.dequeue()
             if not task:
                 break
 
@@ -389,9 +535,16 @@ class ThumbSrv(object):
             except:
                 pass
 
+            try:
+                if bos.path.exists(tpath):
+                    self.idx_add(tpath)
+            except:
+                self.log("could not index thumbnail: %s" % (min_ex(),), 3)
+
             with self.mutex:
                 subs = self.busy[tpath]
                 del self.busy[tpath]
+                self.want.pop(tpath, None)
                 self.ram.pop(ttpath, None)
 
             for x in subs:
@@ -843,6 +996,11 @@ class ThumbSrv(object):
             return
 
         ts = int(time.time())
+        histpath, k = self.idx_key(tdir)
+        idx = self.get_idx(histpath)
+        if idx:
+            idx.touch(k, ts)
+
         try:
             for _ in range(4):
                 bos.utime(tdir, (ts, ts))
@@ -850,9 +1008,163 @@ class ThumbSrv(object):
         except:
             pass
 
+    def idx_key(self, path: str) -> tuple[str, str]:
+        """
+        histpath and cache-index key of a thumbnail (or its folder);
+        thumbnails are tracked per folder, transcodes per file
+        """
+        zs = path.rsplit("/", 5)
+        if len(zs) == 6 and "." in zs[5]:
+            if zs[1] == "th":
+                return zs[0], "/".join(zs[1:5])
+            if zs[1] == "ac":
+                return zs[0], "/".join(zs[1:])
+        else:
+            zs = path.rsplit("/", 4)
+            if len(zs) == 5 and zs[1] == "th":
+                return zs[0], "/".join(zs[1:])
+
+        return "", ""
+
+    def get_idx(self, histpath: str) -> Optional[ThumbIdx]:
+        if not histpath or not HAVE_SQLITE3:
+            return None
+
+        try:
+            return self.idxs[histpath]
+        except:
+            pass
+
+        with self.mutex:
+            if histpath not in self.idxs:
+                try:
+                    self.idxs[histpath] = ThumbIdx(histpath)
+                except Exception as ex:
+                    t = "cannot open thumbnail index in [%s]: %r"
+                    self.log(t % (histpath, ex), 3)
+                    return None
+
+        return self.idxs[histpath]
+
+    def idx_add(self, tpath: str) -> None:
+        """index a new thumbnail; removes the one it replaced, trims the cache if too big"""
+        histpath, k = self.idx_key(tpath)
+        idx = self.get_idx(histpath)
+        if not idx:
+            return
+
+        if k.startswith("ac/"):
+            sz = bos.path.getsize(tpath)
+        else:
+            tdir, tfn = os.path.split(tpath)
+            pfx = tfn.split(".")[0] + "."
+            sz = 0
+            for fn, st in statdir(self.log_func, not self.args.no_scandir, False, tdir):
+                if fn.startswith(pfx) and fn != tfn:
+                    self.log("rm replaced [{}]".format(fn))
+                    wunlink(self.log, os.path.join(tdir, fn), {})
+                elif stat.S_ISREG(st.st_mode):
+                    sz += st.st_size
+
+        idx.set([(k, sz, int(time.time()))])
+        if self.maxsz and idx.built and idx.nbytes > self.maxsz:
+            self.evict(histpath, idx)
+
+    def evict(self, histpath: str, idx: ThumbIdx) -> None:
+        """forget the least recently used thumbnails until below 90% of --th-maxsz"""
+        goal = self.maxsz * 0.9
+        nbytes = idx.nbytes
+        n = 0
+        while idx.nbytes > goal:
+            ks = idx.coldest(64)
+            if not ks:
+                break
+
+            for k in ks:
+                if idx.nbytes <= goal:
+                    break
+
+                n += self.idx_rm(histpath, idx, k)
+
+        t = "cache in [%s] was too big; deleted %d least recently used (%d MiB)"
+        self.log(t % (histpath, n, (nbytes - idx.nbytes) // 1048576))
+
+    def idx_rm(self, histpath: str, idx: ThumbIdx, k: str) -> int:
+        """delete a thumbnail folder or transcode, unless it is being written to"""
+        ap = os.path.join(histpath, k)
+        cmp = ap.lower().replace("\\", "/")
+        pcmp = os.path.dirname(cmp) + "/"
+        with self.mutex:
+            busy = [x.lower().replace("\\", "/") for x in self.busy]
+
+        # the deleting happens without the mutex so ThumbSrv.get
+        # does not have to wait for it
+        if any(x.startswith(cmp) for x in busy):
+            idx.touch(k, int(time.time()))
+            return 0
+
+        if k.startswith("th/"):
+            shutil.rmtree(ap, ignore_errors=True)
+        else:
+            try:
+                bos.unlink(ap)
+                tdir = os.path.dirname(ap)
+                left = [x for x in bos.listdir(tdir) if x not in ("w", "dir.txt")]
+                if not left and not any(x.startswith(pcmp) for x in busy):
+                    shutil.rmtree(tdir, ignore_errors=True)
+            except:
+                pass
+
+        idx.pop(k)
+        return 1
+
+    def idx_build(self, histpath: str, idx: ThumbIdx) -> None:
+        """index a thumbnail cache which existed before the index did"""
+        rows: list[tuple[str, int, int]] = []
+        for cat in ["th", "ac"]:
+            if bos.path.isdir(os.path.join(histpath, cat)):
+                self._idx_walk(histpath, cat, 0, 0, rows)
+
+        idx.set(rows)
+        idx.set_built()
+        t = "indexed thumbnail cache in [%s]; %d entries, %d MiB"
+        self.log(t % (histpath, len(rows), idx.nbytes // 1048576))
+
+    def _idx_walk(
+        self, histpath: str, rel: str, depth: int, mt: float, rows: list[Any]
+    ) -> None:
+        try:
+            top = os.path.join(histpath, rel)
+            ents = list(statdir(self.log_func, not self.args.no_scandir, False, top))
+        except:
+            return
+
+        if depth < 3:
+            for fn, st in ents:
+                if stat.S_ISDIR(st.st_mode):
+                    sub = rel + "/" + fn
+                    self._idx_walk(histpath, sub, depth + 1, st.st_mtime, rows)
+            return
+
+        # thumbnail folder, or folder of transcodes
+        ents = [x for x in ents if stat.S_ISREG(x[1].st_mode) and x[0] != "dir.txt"]
+        if rel.startswith("th"):
+            rows.append((rel, sum([x[1].st_size for x in ents]), int(mt)))
+        else:
+            for fn, st in ents:
+                rows.append((rel + "/" + fn, st.st_size, int(st.st_mtime)))
+
     def cleaner(self) -> None:
+        for histpath in set(self.asrv.vfs.histtab.values()):
+            idx = self.get_idx(histpath)
+            if idx and not idx.built:
+                self.idx_build(histpath, idx)
+
+            if idx and self.maxsz and idx.nbytes > self.maxsz:
+                self.evict(histpath, idx)
+
         interval = self.args.th_clean
-        while True:
+        while interval:
             time.sleep(interval)
             ndirs = 0
             for vol, histpath in self.asrv.vfs.histtab.items():
@@ -869,6 +1181,20 @@ class ThumbSrv(object):
             self.log("\033[Jcln ok; rm {} dirs".format(ndirs))
 
     def clean(self, histpath: str) -> int:
+        idx = self.get_idx(histpath)
+        if idx and not idx.built:
+            self.idx_build(histpath, idx)
+
+        if idx:
+            ret = 0
+            now = int(time.time())
+            for cat in ["th", "ac"]:
+                maxage = getattr(self.args, cat + "_maxage")
+                for k in idx.older(cat, now - maxage):
+                    ret += self.idx_rm(histpath, idx, k)
+
+            return ret
+
         ret = 0
         for cat in ["th", "ac"]:
             top = os.path.join(histpath, cat)
@@ -139,6 +139,25 @@ class U2idx(object):
         self.cur[ptop] = cur
         return cur
 
+    def _has_fts(self, vols: list[VFS]) -> bool:
+        """true if every searchable volume has the volflag fts index"""
+        ret = False
+        for vol in vols:
+            cur = self.get_cur(vol)
+            if not cur:
+                continue
+
+            if "fts" not in vol.flags:
+                return False
+
+            try:
+                cur.execute("select rowid from fu limit 0").fetchall()
+                ret = True
+            except:
+                return False
+
+        return ret
+
     def search(
         self, uname: str, vols: list[VFS], uq: str, lim: int
     ) -> tuple[list[dict[str, Any]], list[str], bool]:
@@ -146,6 +165,11 @@ class U2idx(object):
         if not HAVE_SQLITE3:
             return [], [], False
 
+        fts = self._has_fts(vols)
+        fts_at = 0  # where the current field starts in q
+        fts_col = ""
+        fts_k = ""
+
         q = ""
         v: Union[str, int] = ""
         va: list[Union[str, int]] = []
@@ -189,6 +213,8 @@ class U2idx(object):
 
             if is_key:
                 is_key = False
+                fts_at = len(q)
+                fts_col = fts_k = ""
 
                 if v == "size":
                     v = "up.sz"
@@ -205,17 +231,21 @@ class U2idx(object):
                 elif v == "path":
                     v = "trim(?||up.rd,'/')"
                     va.append("\nrd")
+                    fts_col = "rd"
 
                 elif v == "name":
                     v = "up.fn"
+                    fts_col = "fn"
 
                 elif v == "tags" or ptn_mt.match(v):
                     have_mt = True
                     field_end = ") "
+                    fts_col = "v"
                     if v == "tags":
                         vq = "mt.v"
                     else:
                         vq = "+mt.k = '{}' and mt.v".format(v)
+                        fts_k = "+mt.k = '{}' and ".format(v)
 
                     v = "exists(select 1 from mt where mt.w = mtw and " + vq
 
@@ -258,6 +288,35 @@ class U2idx(object):
                     tail = "||'%'"
                     v = v[:-1]
 
+                # the fts index can only answer "like" with wildcards;
+                # path is vtop+rd but only rd is indexed, so a match may
+                # also be entirely within vtop (never across the slash)
+                if (
+                    fts
+                    and (head or tail)
+                    and q.endswith(" like ")
+                    and (fts_col != "rd" or (head and tail and "/" not in v))
+                ):
+                    ptn = "{}?{}".format(head, tail)
+                    q = q[:fts_at]
+                    if fts_col == "fn":
+                        zs = "up.rowid in (select rowid from fu where fu.fn like {}) "
+                        q += zs.format(ptn)
+                        va.append(v)
+                    elif fts_col == "rd":
+                        zs = "up.rowid in (select rowid from fu where fu.rd like {0} union all select rowid from up where ? like {0}) "
+                        q += zs.format(ptn)
+                        va.pop()  # the \nrd from trim(?||up.rd)
+                        va.extend([v, "\nvp", v])
+                    else:
+                        zs = "substr(up.w,1,16) in (select mt.w from mt where {}mt.rowid in (select rowid from fm where fm.v like {})) "
+                        q += zs.format(fts_k, ptn)
+                        va.append(v)
+                        field_end = ""
+
+                    is_key = True
+                    continue
+
             q += " {}?{} ".format(head, tail)
             va.append(v)
             is_key = True
@@ -354,10 +413,14 @@ class U2idx(object):
             for v in uv:
                 if v == "\nrd":
                     v = vtop + "/"
+                elif v == "\nvp":
+                    v = vtop
 
                 vuv.append(v)
 
             sret = []
+            pend: list[dict[str, Any]] = []
+            tcur = cur.connection.cursor()
             fk = flags.get("fk")
             dots = flags.get("dotsrch") and uname in vol.axs.udot
             fk_alg = 2 if "fka" in flags else 1
@@ -417,19 +480,18 @@ class U2idx(object):
                         )
 
                 seen_rps.add(rp)
-                sret.append({"ts": int(ts), "sz": sz, "rp": rp + suf, "w": w[:16]})
-
-            for hit in sret:
-                w = hit["w"]
-                del hit["w"]
-                tags = {}
-                q2 = "select k, v from mt where w = ? and +k != 'x'"
-                for k, v2 in cur.execute(q2, (w,)):
-                    taglist[k] = True
-                    tags[k] = v2
-
-                hit["tags"] = tags
-
+                hit = {"ts": int(ts), "sz": sz, "rp": rp + suf, "w": w[:16]}
+                sret.append(hit)
+                pend.append(hit)
+                if len(pend) >= 256:
+                    # tags for a batch of hits while the search keeps going
+                    self._add_tags(tcur, pend, taglist)
+                    pend = []
+
+            if pend:
+                self._add_tags(tcur, pend, taglist)
+
+            tcur.close()
             ret.extend(sret)
             # print("[{}] {}".format(ptop, sret))
 
@@ -444,6 +506,30 @@ class U2idx(object):
 
         return ret, list(taglist.keys()), lim < 0 and not clamped
 
+    def _add_tags(
+        self,
+        cur: "sqlite3.Cursor",
+        hits: list[dict[str, Any]],
+        taglist: dict[str, bool],
+    ) -> None:
+        """fetches tags for a batch of hits in one query; consumes hit["w"]"""
+        hws: dict[str, list[dict[str, Any]]] = {}
+        for hit in hits:
+            hit["tags"] = {}
+            w = hit.pop("w")
+            if w in hws:
+                hws[w].append(hit)
+            else:
+                hws[w] = [hit]
+
+        ws = list(hws)
+        q = "select w, k, v from mt where w in (%s) and +k != 'x'"
+        q = q % (",".join(["?"] * len(ws)),)
+        for w, k, v in cur.execute(q, ws):
+            taglist[k] = True
+            for hit in hws[w]:
+                hit["tags"][k] = v
+
     def terminator(self, identifier: str, done_flag: list[bool]) -> None:
         for _ in range(self.timeout):
             time.sleep(1)
@@ -25,15 +25,18 @@ from .authsrv import LEELOO_DALLAS, SSEELOG, VFS, AuthSrv
 from .bos import bos
 from .cfg import vf_bmap, vf_cmap, vf_vmap
 from .fsutil import Fstab
-from .mtag import MParser, MTag
+from .mtag import MParser, MTag, MTagProc
 from .util import (
     HAVE_SQLITE3,
     SYMTIME,
     VF_CAREFUL,
     Daemon,
     MTHash,
+    MTHashFiles,
     Pebkac,
+    VMutex,
     ProgressPrinter,
+    StatPool,
     absreal,
     alltrace,
     atomic_move,
@@ -46,6 +49,7 @@ from .util import (
     hidedir,
     humansize,
     min_ex,
+    mp,
     quotep,
     rand_name,
     ren_open,
@@ -79,9 +83,10 @@ if HAVE_SQLITE3:
 DB_VER = 5
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Any, Optional, Pattern, Union
+    from typing import Any, Callable, Generator, Optional, Pattern, Union
 
 if TYPE_CHECKING:
+    from .fswatch import FsWatch
     from .svchub import SvcHub
 
 zsg = "avif,avifs,bmp,gif,heic,heics,heif,heifs,ico,j2p,j2k,jp2,jpeg,jpg,jpx,png,tga,tif,tiff,webp"
@@ -129,14 +134,27 @@ class Up2k(object):
 
         self.gid = 0
         self.stop = False
-        self.mutex = threading.Lock()
+        self.mutex = VMutex()
         self.blocked: Optional[str] = None
         self.pp: Optional[ProgressPrinter] = None
+        self.spool: Optional[StatPool] = None
+        self.fsw: Optional["FsWatch"] = None
+        self.fsw_tops: set[str] = set()
+        self.fsw_new: Optional[list[tuple[str, str, str, int, str, int]]] = None
+        self.fsw_busy = False
+        self.fsw_bad = False
+        self.e2v_busy = False
+        self.e2v_q: dict[str, list[int]] = {}  # ptop: [files_left, bytes_left]
+        self.e2v_nbad = 0
+        self.e2v_rl = [0.0, 0]  # ratelimit; [t0, bytes since t0]
+        self.no_commit: set[str] = set()  # ptops with a batch of idx_wark going
         self.rescan_cond = threading.Condition()
         self.need_rescan: set[str] = set()
         self.db_act = 0.0
 
-        self.reg_mutex = threading.Lock()
+        self.reg_mutex = VMutex()
+        self.xvol_mutex = threading.Lock()  # short; state shared between volumes
+        self.any_xlink = False  # dedup across volumes; must lock everything
         self.registry: dict[str, dict[str, dict[str, Any]]] = {}
         self.flags: dict[str, dict[str, Any]] = {}
         self.droppable: dict[str, list[str]] = {}
@@ -147,6 +165,9 @@ class Up2k(object):
         self.busy_aps: dict[str, int] = {}
         self.dupesched: dict[str, list[tuple[str, str, float]]] = {}
         self.snap_prev: dict[str, Optional[tuple[int, float]]] = {}
+        self.snap_sz: dict[str, int] = {}
+        self.jnl_f: dict[str, Any] = {}  # ptop => up2k.jnl (None until 1st write)
+        self.jnl_sz: dict[str, int] = {}
 
         self.mtag: Optional[MTag] = None
         self.entags: dict[str, set[str]] = {}
@@ -188,8 +209,11 @@ class Up2k(object):
 
         if self.args.hash_mt < 2:
             self.mth: Optional[MTHash] = None
+            self.mthf: Optional[MTHashFiles] = None
         else:
             self.mth = MTHash(self.args.hash_mt)
+            zi = self.args.hash_mt
+            self.mthf = MTHashFiles(zi, self.args.iobuf, up2k_chunksize)
 
         if self.args.no_fastboot:
             self.deferred_init()
@@ -263,6 +287,18 @@ class Up2k(object):
             if not self.stop:
                 self.log("uploads are now possible", 2)
 
+    def _vlock(self, vm: VMutex, *ptops: str) -> Union[VMutex, VMutex.Vol]:
+        """
+        lock for an operation which only touches these volumes;
+        xlink means any volume may have dupes, so take all of them
+        """
+        return vm if self.any_xlink else vm.vol(*ptops)
+
+    def _s3enc(self, rd: str, fn: str) -> tuple[str, str]:
+        assert self.mem_cur
+        with self.xvol_mutex:
+            return s3enc(self.mem_cur, rd, fn)
+
     def get_state(self) -> str:
         mtpq: Union[int, str] = 0
         q = "select count(w) from mt where k = 't:mtp'"
@@ -283,6 +319,9 @@ class Up2k(object):
             "hashq": self.n_hashq,
             "tagq": self.n_tagq,
             "mtpq": mtpq,
+            "e2vq": sum(x[0] for x in list(self.e2v_q.values())),
+            "e2vb": sum(x[1] for x in list(self.e2v_q.values())),
+            "e2vbad": self.e2v_nbad,
             "dbwu": "{:.2f}".format(self.db_act),
             "dbwt": "{:.2f}".format(
                 min(1000 * 24 * 60 * 60 - 1, time.time() - self.db_act)
@@ -301,7 +340,8 @@ class Up2k(object):
                 tab2 = self.registry[ptop]
                 for job in tab2.values():
                     if job["prel"] == dn and job["name"] == fn:
-                        return json.dumps(job, separators=(",\n", ": "))
+                        zj = self._ser_job(job)
+                        return json.dumps(zj, separators=(",\n", ": "))
         except:
             pass
 
@@ -481,6 +521,9 @@ class Up2k(object):
 
                     timeout = min(timeout, deadline)
 
+            if self.fsw:
+                timeout = min(timeout, self._fsw_check(now))
+
             if self.db_act > now - self.args.db_act and self.need_rescan:
                 # recent db activity; defer volume rescan
                 act_timeout = self.db_act + self.args.db_act
@@ -510,6 +553,186 @@ class Up2k(object):
                 for v in vols:
                     volage[v] = now
 
+    def _fsw_init(self, ptop: str) -> None:
+        if not self.fsw:
+            if self.fsw_bad:
+                return
+            try:
+                from .fswatch import FsWatch
+
+                self.fsw = FsWatch(self.log_func, self._fsw_cb)
+            except Exception as ex:
+                self.fsw_bad = True
+                t = "inotify is not available; will not watch volumes for changes: %r"
+                self.log(t % (ex,), 3)
+                return
+
+        self.fsw_tops.add(ptop)
+
+    def _fsw_cb(self) -> None:
+        with self.rescan_cond:
+            self.rescan_cond.notify_all()
+
+    def _fsw_check(self, now: float) -> float:
+        """start rescanning the folders which inotify says have changed"""
+        fsw = self.fsw
+        assert fsw
+        if not fsw.dirty and not fsw.overflow:
+            return now + 9001
+
+        if self.fsw_busy or self.pp:
+            return now + 1
+
+        # wait until things have settled down a bit
+        zf = max(fsw.t_ev + 2, self.db_act + self.args.db_act)
+        if zf > now:
+            return zf
+
+        full, dirty = fsw.get_dirty(2)
+        if full:
+            with self.mutex:
+                for vp, vol in self.asrv.vfs.all_vols.items():
+                    if vol.realpath in full:
+                        self.log("inotify queue overflow; rescanning /" + vp, 3)
+                        self.need_rescan.add(vp)
+                        dirty.pop(vol.realpath, None)
+
+        if dirty:
+            self.fsw_busy = True
+            Daemon(self._fsw_scan, "up2k-fsw", (dirty,))
+
+        return now + 1
+
+    def _fsw_scan(self, dirty: dict[str, dict[str, bool]]) -> None:
+        try:
+            for ptop, aps in dirty.items():
+                if self.stop:
+                    return
+
+                self._fsw_scan_vol(ptop, aps)
+        except:
+            self.log("inotify rescan failed: %s" % (min_ex(),), 1)
+        finally:
+            self.fsw_busy = False
+
+    def _fsw_scan_vol(self, ptop: str, aps: dict[str, bool]) -> None:
+        """incremental _build_file_index; just the folders in aps"""
+        all_vols = self.asrv.vfs.all_vols
+        vol = next((x for x in all_vols.values() if x.realpath == ptop), None)
+        if not vol or ptop not in self.fsw_tops:
+            return
+
+        excl = self._vol_excl(vol, list(all_vols.values()))
+        sexcl = set(excl)
+        rei = vol.flags.get("noidx")
+        reh = vol.flags.get("nohash")
+        n4g = bool(vol.flags.get("noforget"))
+        ffat = "fat32" in vol.flags
+        xvol = bool(vol.flags.get("xvol"))
+        dev = bos.stat(ptop).st_dev if vol.flags.get("xdev") else 0
+
+        t0 = time.time()
+        n_add = n_rm = 0
+        with self.mutex:
+            cur = self.cur.get(ptop)
+            if not cur:
+                return
+
+            if self.pp:
+                # full rescan started just now; it'll probably find it
+                return
+
+            self.pp = ProgressPrinter(self.log, self.args)
+            self.pp.n = 0
+            self.fsw_new = []
+            db = Dbw(cur, 0, time.time())
+            try:
+                walked: list[str] = []
+                for ap in sorted(aps):
+                    if self.stop:
+                        return
+
+                    if not ap.startswith(ptop) or [
+                        x for x in walked if ap.startswith(x + "/")
+                    ]:
+                        continue
+
+                    rd = ap[len(ptop) :].strip("/")
+                    deep = aps[ap]
+                    if deep:
+                        walked.append(ap)
+                        if rd and not n4g:
+                            n_rm += self._drop_lost_sub(db.c, ptop, rd)
+
+                    if ap in sexcl or [x for x in excl if ap.startswith(x + "/")]:
+                        continue
+
+                    try:
+                        st = bos.stat(ap)
+                        if not stat.S_ISDIR(st.st_mode):
+                            continue
+                    except:
+                        continue
+
+                    n_add += self._build_dir(
+                        db,
+                        ptop,
+                        sexcl,
+                        ap,
+                        absreal(ap),
+                        rei,
+                        reh,
+                        n4g,
+                        ffat,
+                        [],
+                        st,
+                        dev,
+                        xvol,
+                        deep,
+                    )
+
+                db.c.connection.commit()
+            finally:
+                zl = self.fsw_new
+                self.fsw_new = None
+                self.pp.end = True
+                self.pp = None
+
+        if zl and "e2t" in vol.flags:
+            for wark, rd, fn, sz, ip, at in zl:
+                self.tagq.put((ptop, wark, rd, fn, sz, ip, at))
+
+            with self.xvol_mutex:
+                self.n_tagq += len(zl)
+
+        if n_add or n_rm:
+            t = "inotify: rescanned %d folders in /%s; %d changes, %d files forgotten, %.2f sec"
+            self.log(t % (len(aps), vol.vpath, n_add, n_rm, time.time() - t0))
+
+    def _drop_lost_sub(self, cur: "sqlite3.Cursor", top: str, rd: str) -> int:
+        """forget folder rd and its subfolders, if they no longer exist"""
+        n_rm = 0
+        q = "select distinct rd from up where rd = ? or rd like ?||'/%'"
+        qw = "select 1 from up where substr(w,1,16) = ? limit 1"
+        for (drd,) in cur.execute(q, (rd, rd)).fetchall():
+            zs = w8b64dec(drd[2:]) if drd.startswith("//") else drd
+            if os.path.isdir(djoin(top, zs)):
+                continue
+
+            rows = cur.execute("select w, sz from up where rd = ?", (drd,)).fetchall()
+            cur.execute("delete from up where rd = ?", (drd,))
+            cur.execute("delete from dh where d = ?", (drd,))
+            self.volsize[cur] -= sum([x[1] for x in rows])
+            self.volnfiles[cur] -= len(rows)
+            n_rm += len(rows)
+
+            # drop their tags too, unless a dupe elsewhere still has them
+            for w in set([x[0][:16] for x in rows]):
+                if not cur.execute(qw, (w,)).fetchone():
+                    cur.execute("delete from mt where w = ?", (w,))
+
+        return n_rm
+
     def _check_lifetimes(self) -> float:
         now = time.time()
         timeout = now + 9001
@@ -636,6 +859,28 @@ class Up2k(object):
             self.log("xiu: {}# {}".format(len(wrfs), cmd))
             runihook(self.log, cmd, vol, ups)
 
+    def _prep_job(self, job: dict[str, Any]) -> None:
+        """
+        need becomes an ordered set, and hidx maps each chash
+        to its chunk numbers; both are undone by _ser_job
+        """
+        job["need"] = dict.fromkeys(job["need"])
+        hidx: dict[str, list[int]] = {}
+        for n, chash in enumerate(job["hash"]):
+            try:
+                hidx[chash].append(n)
+            except:
+                hidx[chash] = [n]
+
+        job["hidx"] = hidx
+
+    def _ser_job(self, job: dict[str, Any]) -> dict[str, Any]:
+        """job as it looks in up2k.snap"""
+        ret = job.copy()
+        ret["need"] = list(job["need"])
+        ret.pop("hidx", None)
+        return ret
+
     def _vis_job_progress(self, job: dict[str, Any]) -> str:
         perc = 100 - (len(job["need"]) * 100.0 / (len(job["hash"]) or 1))
         path = djoin(job["ptop"], job["prel"], job["name"])
@@ -738,6 +983,8 @@ class Up2k(object):
             self.mtag = MTag(self.log_func, self.args)
             if not self.mtag.usable:
                 self.mtag = None
+            elif self.args.mtag_mp and not mp:
+                self.log("--mtag-mp: multiprocessing is not available", 3)
 
         # e2ds(a) volumes first
         if next((zv for zv in vols if "e2ds" in zv.flags), None):
@@ -764,9 +1011,7 @@ class Up2k(object):
                 if vac:
                     need_vac[vol] = True
 
-            if "e2v" in vol.flags:
-                t = "online (integrity-check pending)"
-            elif "e2ts" in vol.flags:
+            if "e2ts" in vol.flags:
                 t = "online (tags pending)"
             else:
                 t = "online, idle"
@@ -775,29 +1020,10 @@ class Up2k(object):
 
         self._unblock()
 
-        # file contents verification
-        for vol in vols:
-            if self.stop:
-                break
-
-            if "e2v" not in vol.flags:
-                continue
-
-            t = "online (verifying integrity)"
-            self.volstate[vol.vpath] = t
-            self.log("{} [{}]".format(t, vol.realpath))
-
-            nmod = self._verify_integrity(vol)
-            if nmod:
-                self.log("modified {} entries in the db".format(nmod), 3)
-                need_vac[vol] = True
-
-            if "e2ts" in vol.flags:
-                t = "online (tags pending)"
-            else:
-                t = "online, idle"
-
-            self.volstate[vol.vpath] = t
+        # file contents verification; runs in the background
+        if not self.e2v_busy and [x for x in vols if "e2v" in x.flags]:
+            self.e2v_busy = True
+            Daemon(self._e2v_loop, "up2k-e2v")
 
         # open the rest + do any e2ts(a)
         needed_mutagen = False
@@ -830,6 +1056,8 @@ class Up2k(object):
             with self.mutex:
                 cur.connection.commit()
                 cur.execute("vacuum")
+                if "fts" in vol.flags:
+                    self._fts_rebuild(cur)
 
         if self.stop:
             return False
@@ -945,6 +1173,7 @@ class Up2k(object):
             self.log("/{} {}".format(vpath + ("/" if vpath else ""), zs), "35")
 
         reg = {}
+        reg2 = {}
         drp = None
         snap = os.path.join(histpath, "up2k.snap")
         if bos.path.exists(snap):
@@ -958,12 +1187,21 @@ class Up2k(object):
             except:
                 pass
 
+        njnl = -1
+        jnl = os.path.join(histpath, "up2k.jnl")
+        if bos.path.exists(jnl):
+            jdrp, njnl = self._jnl_replay(jnl, reg2)
+            if drp is not None:
+                drp += [x for x in jdrp if x not in drp]
+
+        if reg2:
             for k, job in reg2.items():
                 fp = djoin(job["ptop"], job["prel"], job["name"])
                 if bos.path.exists(fp):
                     reg[k] = job
                     job["poke"] = time.time()
                     job["busy"] = {}
+                    self._prep_job(job)
                 else:
                     self.log("ign deleted file in snap: [{}]".format(fp))
 
@@ -972,15 +1210,27 @@ class Up2k(object):
             else:
                 drp = [x for x in drp if x in reg]
 
-            t = "loaded snap {} |{}| ({})".format(snap, len(reg.keys()), len(drp or []))
+            t = "loaded snap {} +{} |{}| ({})"
+            t = t.format(snap, max(0, njnl), len(reg.keys()), len(drp or []))
             ta = [t] + self._vis_reg_progress(reg)
             self.log("\n".join(ta))
 
+        if not self.args.nw and not self.args.no_snap and self.args.snap_jnl:
+            self.jnl_f[ptop] = None
+            self.jnl_sz[ptop] = 0
+
         self.flags[ptop] = flags
+        if "xlink" in flags:
+            self.any_xlink = True
+
         self.vol_act[ptop] = 0.0
         self.registry[ptop] = reg
         self.droppable[ptop] = drp or []
         self.regdrop(ptop, "")
+        if njnl >= 0 and not self.args.nw and not self.args.no_snap:
+            # compact now; appending after a torn record would hide the rest
+            self._snap_reg(ptop, reg, True)
+
         if not HAVE_SQLITE3 or "e2d" not in flags or "d2d" in flags:
             return None
 
@@ -1029,6 +1279,10 @@ class Up2k(object):
             cur.connection.commit()
 
             self._verify_db_cache(cur, vpath)
+            if "fts" in flags:
+                self._add_fts_tab(cur)
+            else:
+                self._drop_fts_tab(cur)
 
             self.cur[ptop] = cur
             self.volsize[cur] = 0
@@ -1063,6 +1317,23 @@ class Up2k(object):
             cur.execute("insert into kv values ('volcfg',?)", (vcfg,))
             cur.connection.commit()
 
+    def _vol_excl(self, vol: VFS, all_vols: list[VFS]) -> list[str]:
+        """abspaths which are not part of this volume"""
+        excl = [
+            vol.realpath + "/" + d.vpath[len(vol.vpath) :].lstrip("/")
+            for d in all_vols
+            if d != vol and (d.vpath.startswith(vol.vpath + "/") or not vol.vpath)
+        ]
+        excl += [absreal(x) for x in excl]
+        excl += list(self.asrv.vfs.histtab.values())
+        if WINDOWS:
+            excl = [x.replace("/", "\\") for x in excl]
+        else:
+            # ~/.wine/dosdevices/z:/ and such
+            excl.extend(("/dev", "/proc", "/run", "/sys"))
+
+        return excl
+
     def _build_file_index(self, vol: VFS, all_vols: list[VFS]) -> tuple[bool, bool]:
         do_vac = False
         top = vol.realpath
@@ -1083,21 +1354,22 @@ class Up2k(object):
             db = Dbw(cur, 0, time.time())
             self.pp.n = next(db.c.execute("select count(w) from up"))[0]
 
-            excl = [
-                vol.realpath + "/" + d.vpath[len(vol.vpath) :].lstrip("/")
-                for d in all_vols
-                if d != vol and (d.vpath.startswith(vol.vpath + "/") or not vol.vpath)
-            ]
-            excl += [absreal(x) for x in excl]
-            excl += list(self.asrv.vfs.histtab.values())
-            if WINDOWS:
-                excl = [x.replace("/", "\\") for x in excl]
-            else:
-                # ~/.wine/dosdevices/z:/ and such
-                excl.extend(("/dev", "/proc", "/run", "/sys"))
+            excl = self._vol_excl(vol, all_vols)
+            if "inotify" in vol.flags:
+                self._fsw_init(top)
+            elif top in self.fsw_tops:
+                self.fsw_tops.discard(top)
+                self.fsw.unwatch(top)  # type: ignore
 
             rtop = absreal(top)
             n_add = n_rm = 0
+            if self.args.idx_mt > 1:
+                self.spool = StatPool(
+                    self.log_func,
+                    not self.args.no_scandir,
+                    self.args.idx_mt,
+                    self.args.idx_dev,
+                )
             try:
                 if dir_is_empty(self.log_func, not self.args.no_scandir, rtop):
                     t = "volume /%s at [%s] is empty; will not be indexed as this could be due to an offline filesystem"
@@ -1126,6 +1398,10 @@ class Up2k(object):
                 self.log(t.format(top, min_ex()), c=1)
                 if db_ex_chk(self.log, ex, db_path):
                     self.hub.log_stacks()
+            finally:
+                if self.spool:
+                    self.spool.close()
+                    self.spool = None
 
             if db.n:
                 self.log("commit {} new files".format(db.n))
@@ -1178,6 +1454,7 @@ class Up2k(object):
         cst: os.stat_result,
         dev: int,
         xvol: bool,
+        deep: bool = True,
     ) -> int:
         if xvol and not rcdir.startswith(top):
             self.log("skip xvol: [{}] -> [{}]".format(cdir, rcdir), 6)
@@ -1201,12 +1478,32 @@ class Up2k(object):
         assert self.pp and self.mem_cur
         self.pp.msg = "a%d %s" % (self.pp.n, cdir)
 
+        if self.fsw and top in self.fsw_tops:
+            self.fsw.watch(top, cdir)
+
         rd = cdir[len(top) :].strip("/")
         if WINDOWS:
             rd = rd.replace("\\", "/").strip("/")
 
-        g = statdir(self.log_func, not self.args.no_scandir, True, cdir)
-        gl = sorted(g)
+        spool = self.spool if deep else None
+        if spool:
+            gl = sorted(spool.get(cdir))
+            # start listing the subfolders we'll be visiting next
+            subdirs = [
+                (os.path.join(cdir, x[0]), x[1].st_dev)
+                for x in gl
+                if stat.S_ISDIR(x[1].st_mode) and (not dev or x[1].st_dev == dev)
+            ]
+            subdirs = [
+                x
+                for x in subdirs
+                if x[0] not in excl and not (rei and rei.search(x[0]))
+            ]
+            spool.want(subdirs)
+        else:
+            g = statdir(self.log_func, not self.args.no_scandir, True, cdir)
+            gl = sorted(g)
+
         partials = set([x[0] for x in gl if "PARTIAL" in x[0]])
         for iname, inf in gl:
             if self.stop:
@@ -1231,6 +1528,8 @@ class Up2k(object):
                 fat32 = False
 
             if stat.S_ISDIR(inf.st_mode):
+                if not deep:
+                    continue
                 rap = absreal(abspath)
                 if (
                     dev
@@ -1301,6 +1600,9 @@ class Up2k(object):
                 ):
                     cv = iname
 
+        if spool:
+            spool.drop([x[0] for x in subdirs])  # type: ignore
+
         # folder of 1000 files = ~1 MiB RAM best-case (tiny filenames);
         # free up stuff we're done with before dhashing
         gl = []
@@ -1338,7 +1640,27 @@ class Up2k(object):
             except Exception as ex:
                 self.log("cover {}/{} failed: {}".format(rd, cv, ex), 6)
 
-        seen_files = set([x[2] for x in files])  # for dropcheck
+        # everything the db knows about this folder, in one query;
+        # fn: [(fn-as-stored-in-db, w, mt, sz, ip, at), ...]
+        q = "select fn, w, mt, sz, ip, at from up where rd = ?"
+        try:
+            c = db.c.execute(q, (rd,))
+            erd = rd
+        except:
+            erd = "//" + w8b64enc(rd)
+            c = db.c.execute(q, (erd,))
+
+        in_db: dict[str, list[tuple[str, str, int, int, str, int]]] = {}
+        for zt in c:
+            dfn = zt[0]
+            fn = w8b64dec(dfn[2:]) if dfn.startswith("//") else dfn
+            try:
+                in_db[fn].append(zt)
+            except:
+                in_db[fn] = [zt]
+
+        rm_files: list[tuple[str, int]] = []  # (fn-in-db, sz) of changed files
+        todo: list[tuple[int, int, str, str, Any, str, str, int]] = []
         for sz, lmod, fn in files:
             if self.stop:
                 return -1
@@ -1347,20 +1669,14 @@ class Up2k(object):
             abspath = os.path.join(cdir, fn)
             nohash = reh.search(abspath) if reh else False
 
-            sql = "select w, mt, sz, ip, at from up where rd = ? and fn = ?"
-            try:
-                c = db.c.execute(sql, (rd, fn))
-            except:
-                c = db.c.execute(sql, s3enc(self.mem_cur, rd, fn))
-
-            in_db = list(c.fetchall())
-            if in_db:
+            rows = in_db.pop(fn, None)
+            if rows:
                 self.pp.n -= 1
-                dw, dts, dsz, ip, at = in_db[0]
-                if len(in_db) > 1:
+                dfn, dw, dts, dsz, ip, at = rows[0]
+                if len(rows) > 1:
                     t = "WARN: multiple entries: [{}] => [{}] |{}|\n{}"
-                    rep_db = "\n".join([repr(x) for x in in_db])
-                    self.log(t.format(top, rp, len(in_db), rep_db))
+                    rep_db = "\n".join([repr(x[1:]) for x in rows])
+                    self.log(t.format(top, rp, len(rows), rep_db))
                     dts = -1
 
                 if fat32 and abs(dts - lmod) == 1:
@@ -1373,32 +1689,66 @@ class Up2k(object):
                     top, rp, dts, lmod, dsz, sz
                 )
                 self.log(t)
-                self.db_rm(db.c, rd, fn, 0)
+                rm_files.append((dfn, dsz))
                 ret += 1
                 db.n += 1
-                in_db = []
             else:
                 dw = ""
                 ip = ""
                 at = 0
 
+            todo.append((sz, lmod, fn, abspath, nohash, dw, ip, at))
+
+        # whatever is left in in_db is no longer on disk
+        n_rm = 0
+        if not n4g:
+            n_rm = len(in_db)
+            rm_files.extend([(x[0][0], x[0][3]) for x in in_db.values()])
+
+        if rm_files:
+            q = "delete from up where rd = ? and fn = ?"
+            c = db.c.executemany(q, [(erd, x[0]) for x in rm_files])
+            self.volnfiles[db.c] -= c.rowcount
+            self.volsize[db.c] -= sum([x[1] for x in rm_files])
+
+        in_db.clear()
+        rm_files = []
+        adds: list[tuple[str, int, int, str, str, str, int]] = []
+
+        # hash several files at once; the big ones are hashed below with mth
+        if self.mthf:
+            zgt = ((x, "" if x[4] or not x[0] else x[3], x[0]) for x in todo)
+            hgen: Any = self.mthf.imap(zgt, 1024 * 1024 * 16)
+        else:
+            hgen = ((x, None) for x in todo)
+
+        for (sz, lmod, fn, abspath, nohash, dw, ip, at), hashes in hgen:
+            if self.stop:
+                self._db_add_many(db.c, adds)
+                return -1
+
             self.pp.msg = "a%d %s" % (self.pp.n, abspath)
 
             if nohash or not sz:
                 wark = up2k_wark_from_metadata(self.salt, sz, lmod, rd, fn)
             else:
-                if sz > 1024 * 1024:
+                if sz > 1024 * 1024 and hashes is None:
                     self.log("file: {}".format(abspath))
 
                 try:
-                    hashes = self._hashlist_from_file(
-                        abspath, "a{}, ".format(self.pp.n)
-                    )
+                    if isinstance(hashes, Exception):
+                        raise hashes
+
+                    if hashes is None:
+                        hashes = self._hashlist_from_file(
+                            abspath, "a{}, ".format(self.pp.n)
+                        )
                 except Exception as ex:
                     self.log("hash: {} @ [{}]".format(repr(ex), abspath))
                     continue
 
                 if not hashes:
+                    self._db_add_many(db.c, adds)
                     return -1
 
                 wark = up2k_wark_from_hashlist(self.salt, sz, hashes)
@@ -1407,17 +1757,29 @@ class Up2k(object):
                 ip = ""
                 at = 0
 
-            # skip upload hooks by not providing vflags
-            self.db_add(db.c, {}, rd, fn, lmod, sz, "", "", wark, "", "", ip, at)
+            # the db rows were dropped above, so no need for db_add
+            # (which would also run upload hooks if we gave it vflags)
+            try:
+                fn.encode("utf-8")
+                efn = fn
+            except:
+                efn = "//" + w8b64enc(fn)
+
+            adds.append((wark, int(lmod), sz, erd, efn, ip, int(at or 0)))
             db.n += 1
+            if self.fsw_new is not None:
+                self.fsw_new.append((wark, rd, fn, sz, ip, at))
             ret += 1
             td = time.time() - db.t
             if db.n >= 4096 or td >= 60:
+                self._db_add_many(db.c, adds)
                 self.log("commit {} new files".format(db.n))
                 db.c.connection.commit()
                 db.n = 0
                 db.t = time.time()
 
+        self._db_add_many(db.c, adds)
+
         if not self.args.no_dhash:
             db.c.execute("delete from dh where d = ?", (drd,))  # type: ignore
             db.c.execute("insert into dh values (?,?)", (drd, dhash))  # type: ignore
@@ -1448,27 +1810,26 @@ class Up2k(object):
                 db.c.execute(q, (sh_erd, sh_erd + "/"))
                 ret += n
 
-        if n4g:
-            return ret
-
-        # drop missing files
-        q = "select fn from up where rd = ?"
-        try:
-            c = db.c.execute(q, (rd,))
-        except:
-            c = db.c.execute(q, ("//" + w8b64enc(rd),))
-
-        hits = [w8b64dec(x[2:]) if x.startswith("//") else x for (x,) in c]
-        rm_files = [x for x in hits if x not in seen_files]
-        n_rm = len(rm_files)
-        for fn in rm_files:
-            self.db_rm(db.c, rd, fn, 0)
-
         if n_rm:
             self.log("forgot {} deleted files".format(n_rm))
 
         return ret
 
+    def _db_add_many(
+        self, cur: "sqlite3.Cursor", rows: list[tuple[str, int, int, str, str, str, int]]
+    ) -> None:
+        """
+        mutex(main) me; like db_add but for many files at once,
+        which must not be in the db already; clears rows
+        """
+        if not rows:
+            return
+
+        cur.executemany("insert into up values (?,?,?,?,?,?,?)", rows)
+        self.volsize[cur] += sum([x[2] for x in rows])
+        self.volnfiles[cur] += len(rows)
+        del rows[:]
+
     def _drop_lost(self, cur: "sqlite3.Cursor", top: str, excl: list[str]) -> int:
         rm = []
         n_rm = 0
@@ -1557,12 +1918,75 @@ class Up2k(object):
         c2.close()
         return n_rm + n_rm2
 
-    def _verify_integrity(self, vol: VFS) -> int:
-        """expensive; blocks database access until finished"""
-        ptop = vol.realpath
-        assert self.pp
+    def _e2v_loop(self) -> None:
+        """-e2v in the background; keeps going forever if --e2v-age"""
+        try:
+            while not self.stop:
+                nxt = time.time() + self.args.e2v_age
+                for vol in list(self.asrv.vfs.all_vols.values()):
+                    if "e2v" not in vol.flags or vol.realpath not in self.cur:
+                        continue
 
+                    zf = self._verify_integrity(vol)
+                    if zf < 0:
+                        return
+
+                    nxt = min(nxt, zf)
+
+                if not self.args.e2v_age:
+                    return
+
+                time.sleep(max(60, nxt - time.time()))
+        except:
+            self.log("integrity-check failed: %s" % (min_ex(),), 1)
+        finally:
+            self.e2v_busy = False
+
+    def _e2v_throttle(self, nbytes: int) -> None:
+        """pause while busy (--e2v-idle), and stay within --e2v-bw"""
+        idle = self.args.e2v_idle
+        while idle and not self.stop:
+            zf = self.db_act + idle - time.time()
+            if zf <= 0 and not self.pp:
+                break
+
+            time.sleep(min(max(zf, 1), 5))
+
+        bps = self.args.e2v_bw * 1024 * 1024
+        if not bps or not nbytes:
+            return
+
+        rl = self.e2v_rl
+        now = time.time()
+        if rl[0] + rl[1] / bps < now - 1:
+            # been slow or paused; don't save up for a burst
+            rl[0] = now
+            rl[1] = 0
+
+        rl[1] += nbytes
+        zf = rl[0] + rl[1] / bps - now
+        if zf > 0:
+            time.sleep(zf)
+
+    def _e2v_flush(self, cur: "sqlite3.Cursor", done: list[tuple[str, str]]) -> None:
+        """remember which files were verified ok, so it can resume after a restart"""
+        now = int(time.time())
+        with self.mutex:
+            q = "insert or replace into vf values (?,?,?)"
+            cur.executemany(q, [(rd, fn, now) for rd, fn in done])
+            cur.connection.commit()
+
+        del done[:]
+
+    def _verify_integrity(self, vol: VFS) -> float:
+        """
+        rehash the files which were not verified since this pass started
+        (or in the past --e2v-age seconds); returns when to check again,
+        or -1 if shutting down
+        """
+        ptop = vol.realpath
         cur = self.cur[ptop]
+        age = self.args.e2v_age
         rei = vol.flags.get("noidx")
         reh = vol.flags.get("nohash")
         e2vu = "e2vu" in vol.flags
@@ -1579,27 +2003,51 @@ class Up2k(object):
             qexa.append("up.rd != ? and not up.rd like ?||'%'")
             pexa.extend([vpath, vpath])
 
-        pex: tuple[Any, ...] = tuple(pexa)
-        qex = " and ".join(qexa)
-        if qex:
-            qex = " where " + qex
+        qex = "".join(" and " + x for x in qexa)
+        qj = " from up left join vf on vf.rd = up.rd and vf.fn = up.fn"
+        qj += " where (vf.t is null or vf.t < ?)" + qex
 
         rewark: list[tuple[str, str, str, int, int]] = []
 
         with self.mutex:
+            self._add_vf_tab(cur)
+            q = "delete from vf where not exists (select 1 from up where up.rd = vf.rd and up.fn = vf.fn)"
+            cur.execute(q)
+            if age:
+                t_pass = int(time.time()) - age
+            else:
+                zr = cur.execute("select v from kv where k = 'e2v'").fetchone()
+                if zr:
+                    t_pass = zr[0]
+                    self.log("resuming the integrity-check of [%s]" % (ptop,))
+                else:
+                    t_pass = int(time.time())
+                    cur.execute("insert into kv values ('e2v', ?)", (t_pass,))
+
+            cur.connection.commit()
+            pex: tuple[Any, ...] = tuple([t_pass] + pexa)
+
             b_left = 0
             n_left = 0
-            q = "select sz from up" + qex
-            for (sz,) in cur.execute(q, pex):
+            for (sz,) in cur.execute("select up.sz" + qj, pex):
                 b_left += sz  # sum() can overflow according to docs
                 n_left += 1
 
-            tf, _ = self._spool_warks(cur, "select w, rd, fn from up" + qex, pex, 0)
+            tf, _ = self._spool_warks(cur, "select up.w, up.rd, up.fn" + qj, pex, 0)
 
-        with gzip.GzipFile(mode="rb", fileobj=tf) as gf:
+        if n_left:
+            t = "verifying integrity of %d files (%d MiB) in [%s]"
+            self.log(t % (n_left, b_left // 1048576, ptop))
+
+        left = self.e2v_q[ptop] = [n_left, b_left]
+        big = 1024 * 1024 * 16
+        throttle = self._e2v_throttle if self.args.e2v_bw else None
+
+        def vgen() -> Generator[tuple[Any, str, int], None, None]:
+            # reads the spooled warks; files to hash are yielded with their abspath
             for zb in gf:
                 if self.stop:
-                    return -1
+                    return
 
                 w, drd, dfn = zb[:-1].decode("utf-8").split("\x00")
                 with self.mutex:
@@ -1610,8 +2058,8 @@ class Up2k(object):
                         # file moved/deleted since spooling
                         continue
 
-                n_left -= 1
-                b_left -= sz
+                left[0] -= 1
+                left[1] -= sz
                 if drd.startswith("//") or dfn.startswith("//"):
                     rd, fn = s3dec(drd, dfn)
                 else:
@@ -1624,33 +2072,71 @@ class Up2k(object):
 
                 nohash = reh.search(abspath) if reh else False
 
-                pf = "v{}, {:.0f}+".format(n_left, b_left / 1024 / 1024)
-                self.pp.msg = pf + abspath
+                pf = "v{}, {:.0f}+".format(left[0], left[1] / 1024 / 1024)
 
                 # throws on broken symlinks (always did)
                 stl = bos.lstat(abspath)
                 st = bos.stat(abspath) if stat.S_ISLNK(stl.st_mode) else stl
+                sz2 = st.st_size
+
+                # bigger files are throttled while hashing them
+                hashed = not nohash and sz2 and (sz2 < big or not throttle)
+                self._e2v_throttle(sz2 if hashed else 0)
+
+                zt = (w, drd, dfn, rd, fn, mt, sz, abspath, nohash, pf, stl, st)
+                yield zt, "" if nohash or not sz2 else abspath, sz2
+
+        done: list[tuple[str, str]] = []
+        t_flush = t_log = time.time()
+        with gzip.GzipFile(mode="rb", fileobj=tf) as gf:
+            if self.mthf:
+                hgen: Any = self.mthf.imap(vgen(), big)
+            else:
+                hgen = ((x[0], None) for x in vgen())
+
+            for zt, hashes in hgen:
+                if self.stop:
+                    break
+
+                now = time.time()
+                if now - t_flush > 5 or len(done) > 4096:
+                    self._e2v_flush(cur, done)
+                    t_flush = now
+
+                if now - t_log > 60:
+                    t = "integrity-check of [%s]: %d files (%d MiB) left"
+                    self.log(t % (ptop, left[0], left[1] // 1048576))
+                    t_log = now
+
+                w, drd, dfn, rd, fn, mt, sz, abspath, nohash, pf, stl, st = zt
                 mt2 = int(stl.st_mtime)
                 sz2 = st.st_size
 
                 if nohash or not sz2:
                     w2 = up2k_wark_from_metadata(self.salt, sz2, mt2, rd, fn)
                 else:
-                    if sz2 > 1024 * 1024 * 32:
+                    if sz2 > 1024 * 1024 * 32 and hashes is None:
                         self.log("file: {}".format(abspath))
 
                     try:
-                        hashes = self._hashlist_from_file(abspath, pf)
+                        if isinstance(hashes, Exception):
+                            raise hashes
+
+                        if hashes is None:
+                            hashes = self._hashlist_from_file(
+                                abspath, pf, throttle, True
+                            )
                     except Exception as ex:
                         self.log("hash: {} @ [{}]".format(repr(ex), abspath))
                         continue
 
                     if not hashes:
-                        return -1
+                        break
 
                     w2 = up2k_wark_from_hashlist(self.salt, sz2, hashes)
 
                 if w == w2:
+                    done.append((drd, dfn))
                     continue
 
                 # symlink mtime was inconsistent before v1.9.4; check if that's it
@@ -1658,30 +2144,57 @@ class Up2k(object):
                     mt2b = int(st.st_mtime)
                     w2b = up2k_wark_from_metadata(self.salt, sz2, mt2b, rd, fn)
                     if w == w2b:
+                        done.append((drd, dfn))
                         continue
 
                 rewark.append((drd, dfn, w2, sz2, mt2))
+                self.e2v_nbad += 1
 
                 t = "hash mismatch: {}\n  db: {} ({} byte, {})\n  fs: {} ({} byte, {})"
                 t = t.format(abspath, w, sz, mt, w2, sz2, mt2)
                 self.log(t, 1)
 
+        self._unspool(tf)
+        self._e2v_flush(cur, done)
+        self.e2v_q.pop(ptop, None)
+        if self.stop:
+            return -1
+
         if e2vp and rewark:
             self.hub.retcode = 1
             Daemon(self.hub.sigterm)
             raise Exception("{} files have incorrect hashes".format(len(rewark)))
 
-        if not e2vu or not rewark:
-            return 0
-
         with self.mutex:
-            for rd, fn, w, sz, mt in rewark:
-                q = "update up set w = ?, sz = ?, mt = ? where rd = ? and fn = ? limit 1"
-                cur.execute(q, (w, sz, int(mt), rd, fn))
+            if e2vu and rewark:
+                for rd, fn, w, sz, mt in rewark:
+                    q = "update up set w = ?, sz = ?, mt = ? where rd = ? and fn = ? limit 1"
+                    cur.execute(q, (w, sz, int(mt), rd, fn))
+
+                t = "modified {} entries in the db"
+                self.log(t.format(len(rewark)), 3)
+                done = [(x[0], x[1]) for x in rewark]
+
+            if not age:
+                cur.execute("delete from kv where k = 'e2v'")
 
             cur.connection.commit()
+            zr = cur.execute("select min(t) from vf").fetchone()
 
-        return len(rewark)
+        if done:
+            self._e2v_flush(cur, done)
+
+        if e2vu and rewark:
+            # rows were rewritten; same as need_vac in init_indexes
+            with self.mutex:
+                cur.execute("vacuum")
+                if "fts" in vol.flags:
+                    self._fts_rebuild(cur)
+
+        if n_left:
+            self.log("integrity-check of [%s] finished" % (ptop,))
+
+        return ((zr and zr[0]) or time.time()) + age
 
     def _build_tags_index(self, vol: VFS) -> tuple[int, int, bool]:
         ptop = vol.realpath
@@ -2089,6 +2602,8 @@ class Up2k(object):
             if n_done:
                 self.log("mtp: scanned {} files in {}".format(n_done, ptop), c=6)
                 cur.execute("vacuum")
+                if "fts" in self.flags[ptop]:
+                    self._fts_rebuild(cur)
 
             wcur.close()
             cur.close()
@@ -2146,7 +2661,8 @@ class Up2k(object):
         assert self.mtag
         if not self.mpool_used:
             self.mpool_used = True
-            self.log("using {}x {}".format(nw, self.mtag.backend))
+            zs = " processes" if self._mtag_mp() else ""
+            self.log("using {}x {}{}".format(nw, self.mtag.backend, zs))
 
         mpool: Queue[Mpqe] = Queue(nw)
         for _ in range(nw):
@@ -2163,11 +2679,22 @@ class Up2k(object):
 
         mpool.join()
 
+    def _mtag_mp(self) -> bool:
+        # ffprobe is a subprocess regardless; only mutagen needs this
+        return bool(
+            self.args.mtag_mp and mp and self.mtag and self.mtag.backend == "mutagen"
+        )
+
     def _tag_thr(self, q: Queue[Mpqe]) -> None:
         assert self.mtag
+        use_mp = self._mtag_mp()
+        mproc: Optional[MTagProc] = None
         while True:
             qe = q.get()
             if not qe.w:
+                if mproc:
+                    mproc.stop()
+                self.mtag.stop_coprocs()
                 q.task_done()
                 return
 
@@ -2178,7 +2705,14 @@ class Up2k(object):
                         t = "tag-thr: {}({})"
                         self.log(t.format(self.mtag.backend, qe.abspath), "90")
 
-                    tags = self.mtag.get(qe.abspath) if st.st_size else {}
+                    if not st.st_size:
+                        tags = {}
+                    elif use_mp:
+                        if not mproc:
+                            mproc = MTagProc(self.mtag.log, self.args)
+                        tags = mproc.get(qe.abspath)
+                    else:
+                        tags = self.mtag.get(qe.abspath)
                 else:
                     if self.args.mtag_vv:
                         t = "tag-thr: {}({})"
@@ -2196,6 +2730,8 @@ class Up2k(object):
             except:
                 ex = traceback.format_exc()
                 self._log_tag_err(qe.mtp or self.mtag.backend, qe.abspath, ex)
+                if mproc and not mproc.p.is_alive():
+                    mproc = None
             finally:
                 if qe.mtp:
                     with self.tag_event:
@@ -2478,6 +3014,77 @@ class Up2k(object):
 
         cur.connection.commit()
 
+    def _add_fts_tab(self, cur: "sqlite3.Cursor") -> None:
+        # optional trigram index for substring searches (volflag fts);
+        # triggers keep it in sync with up/mt, so db_add, db_rm and the
+        # tag scanner need not know about it
+        try:
+            cur.execute("select rowid from fu limit 1").fetchone()
+            return
+        except:
+            pass
+
+        zs = "insert into {0}({0}, rowid, {1}) values ('delete', old.rowid, old.{2})"
+        fu_rm = zs.format("fu", "rd, fn", "rd, old.fn")
+        fm_rm = zs.format("fm", "v", "v")
+        fu_add = "insert into fu(rowid, rd, fn) values (new.rowid, new.rd, new.fn)"
+        fm_add = "insert into fm(rowid, v) values (new.rowid, new.v)"
+        t0 = time.time()
+        try:
+            for cmd in [
+                r"create virtual table fu using fts5(rd, fn, content='up', content_rowid='rowid', tokenize='trigram')",
+                r"create virtual table fm using fts5(v, content='mt', content_rowid='rowid', tokenize='trigram')",
+                r"create trigger fu_a after insert on up begin %s; end" % (fu_add,),
+                r"create trigger fu_d after delete on up begin %s; end" % (fu_rm,),
+                r"create trigger fu_u after update of rd, fn on up begin %s; %s; end"
+                % (fu_rm, fu_add),
+                r"create trigger fm_a after insert on mt begin %s; end" % (fm_add,),
+                r"create trigger fm_d after delete on mt begin %s; end" % (fm_rm,),
+                r"create trigger fm_u after update of v on mt begin %s; %s; end"
+                % (fm_rm, fm_add),
+            ]:
+                cur.execute(cmd)
+
+            self._fts_rebuild(cur)
+        except Exception as ex:
+            t = "cannot enable volflag fts (needs sqlite 3.34+ with fts5): %r"
+            self.log(t % (ex,), 3)
+            cur.connection.rollback()
+            self._drop_fts_tab(cur)
+            return
+
+        t = "built fts index in %.2f sec" % (time.time() - t0,)
+        self.log(t, 6)
+
+    def _drop_fts_tab(self, cur: "sqlite3.Cursor") -> None:
+        for cmd in [
+            "drop trigger if exists fu_a",
+            "drop trigger if exists fu_d",
+            "drop trigger if exists fu_u",
+            "drop trigger if exists fm_a",
+            "drop trigger if exists fm_d",
+            "drop trigger if exists fm_u",
+            "drop table if exists fu",
+            "drop table if exists fm",
+        ]:
+            try:
+                cur.execute(cmd)
+            except:
+                pass
+
+        cur.connection.commit()
+
+    def _fts_rebuild(self, cur: "sqlite3.Cursor") -> None:
+        # the fts tables refer to rowids, which vacuum can renumber
+        try:
+            cur.execute("select rowid from fu limit 1").fetchone()
+        except:
+            return
+
+        cur.execute("insert into fu(fu) values ('rebuild')")
+        cur.execute("insert into fm(fm) values ('rebuild')")
+        cur.connection.commit()
+
     def _add_dhash_tab(self, cur: "sqlite3.Cursor") -> None:
         # v5 -> v5a
         for cmd in [
@@ -2533,29 +3140,86 @@ class Up2k(object):
 
         cur.connection.commit()
 
+    def _add_vf_tab(self, cur: "sqlite3.Cursor") -> None:
+        # when each file was last verified by -e2v
+        try:
+            cur.execute("select rd, fn, t from vf limit 1").fetchone()
+            return
+        except:
+            pass
+
+        for cmd in [
+            r"create table vf (rd text, fn text, t int)",
+            r"create unique index vf_i on vf(rd, fn)",
+        ]:
+            cur.execute(cmd)
+
+        cur.connection.commit()
+
     def handle_json(
         self, cj: dict[str, Any], busy_aps: dict[str, int]
     ) -> dict[str, Any]:
         # busy_aps is u2fh (always undefined if -j0) so this is safe
         self.busy_aps = busy_aps
-        got_lock = False
+        ptop = cj["ptop"]
+        if ptop in self.registry:
+            # volume is initialized; only need that one
+            mutex = self._vlock(self.mutex, ptop)
+            reg_mutex = self._vlock(self.reg_mutex, ptop)
+        else:
+            mutex = self.mutex
+            reg_mutex = self.reg_mutex
+
+        # bit expensive; 3.9=10x 3.11=2x
+        if not mutex.acquire(timeout=10):
+            t = "cannot receive uploads right now;\nserver busy with {}.\nPlease wait; the client will retry..."
+            raise Pebkac(503, t.format(self.blocked or "[unknown]"))
+
         try:
-            # bit expensive; 3.9=10x 3.11=2x
-            if self.mutex.acquire(timeout=10):
-                got_lock = True
-                with self.reg_mutex:
-                    return self._handle_json(cj)
-            else:
-                t = "cannot receive uploads right now;\nserver busy with {}.\nPlease wait; the client will retry..."
-                raise Pebkac(503, t.format(self.blocked or "[unknown]"))
-        except TypeError:
-            if not PY2:
-                raise
-            with self.mutex, self.reg_mutex:
+            with reg_mutex:
                 return self._handle_json(cj)
         finally:
-            if got_lock:
-                self.mutex.release()
+            mutex.release()
+
+    def handle_json_batch(
+        self, cjs: list[dict[str, Any]], busy_aps: dict[str, int]
+    ) -> list[dict[str, Any]]:
+        """handle_json for many files; taking the mutex once per volume"""
+        self.busy_aps = busy_aps
+        ret: list[dict[str, Any]] = [{} for _ in cjs]
+        vols: dict[str, list[int]] = {}
+        for n, cj in enumerate(cjs):
+            vols.setdefault(cj["ptop"], []).append(n)
+
+        for ptop, ns in vols.items():
+            if ptop in self.registry:
+                mutex = self._vlock(self.mutex, ptop)
+                reg_mutex = self._vlock(self.reg_mutex, ptop)
+            else:
+                mutex = self.mutex
+                reg_mutex = self.reg_mutex
+
+            if not mutex.acquire(timeout=10):
+                t = "cannot receive uploads right now;\nserver busy with {}.\nPlease wait; the client will retry..."
+                zd = {"err": 503, "msg": t.format(self.blocked or "[unknown]")}
+                for n in ns:
+                    ret[n] = zd
+                continue
+
+            try:
+                with reg_mutex:
+                    for n in ns:
+                        try:
+                            ret[n] = self._handle_json(cjs[n])
+                        except Pebkac as ex:
+                            ret[n] = {"err": ex.code, "msg": str(ex)}
+                        except Exception as ex:
+                            self.log("handshake failed: %s" % (min_ex(),), 1)
+                            ret[n] = {"err": 500, "msg": repr(ex)}
+            finally:
+                mutex.release()
+
+        return ret
 
     def _handle_json(self, cj: dict[str, Any]) -> dict[str, Any]:
         ptop = cj["ptop"]
@@ -2636,7 +3300,7 @@ class Up2k(object):
                         "addr": ip,
                         "at": at,
                         "hash": [],
-                        "need": [],
+                        "need": {},
                         "busy": {},
                     }
                     for k in ["life"]:
@@ -2659,6 +3323,7 @@ class Up2k(object):
             if job and wark in reg:
                 # self.log("pop " + wark + "  " + job["name"] + " handle_json db", 4)
                 del reg[wark]
+                self._jnl(cj["ptop"], {"a": "d", "w": wark})
 
             if lost:
                 c2 = None
@@ -2693,6 +3358,7 @@ class Up2k(object):
                             t = "forgetting deleted partial upload at {}"
                             self.log(t.format(path))
                             del reg[wark]
+                            self._jnl(cj["ptop"], {"a": "d", "w": wark})
                         break
 
             if job or wark in reg:
@@ -2716,10 +3382,11 @@ class Up2k(object):
                         # let want_recheck trigger symlink (if still in reg) or reupload
                         if cur:
                             dupe = (cj["prel"], cj["name"], cj["lmod"])
-                            try:
-                                self.dupesched[src].append(dupe)
-                            except:
-                                self.dupesched[src] = [dupe]
+                            with self.xvol_mutex:
+                                try:
+                                    self.dupesched[src].append(dupe)
+                                except:
+                                    self.dupesched[src] = [dupe]
 
                         raise Pebkac(422, err)
 
@@ -2826,7 +3493,7 @@ class Up2k(object):
                     "t0": now,
                     "sprs": sprs,
                     "hash": deepcopy(cj["hash"]),
-                    "need": [],
+                    "need": cj["hash"],
                     "busy": {},
                 }
                 # client-provided, sanitized by _get_wark: name, size, lmod
@@ -2851,11 +3518,7 @@ class Up2k(object):
                 # one chunk may occur multiple times in a file;
                 # filter to unique values for the list of missing chunks
                 # (preserve order to reduce disk thrashing)
-                lut = {}
-                for k in cj["hash"]:
-                    if k not in lut:
-                        job["need"].append(k)
-                        lut[k] = 1
+                self._prep_job(job)
 
                 try:
                     self._new_upload(job)
@@ -2863,6 +3526,9 @@ class Up2k(object):
                     self.registry[job["ptop"]].pop(job["wark"], None)
                     raise
 
+                if reg.get(wark) is job:
+                    self._jnl(job["ptop"], {"a": "j", "j": self._ser_job(job)})
+
             purl = "{}/{}".format(job["vtop"], job["prel"]).strip("/")
             purl = "/{}/".format(purl) if purl else "/"
 
@@ -2872,7 +3538,7 @@ class Up2k(object):
                 "size": job["size"],
                 "lmod": job["lmod"],
                 "sprs": job.get("sprs", sprs),
-                "hash": job["need"],
+                "hash": list(job["need"]),
                 "wark": wark,
             }
 
@@ -3016,7 +3682,7 @@ class Up2k(object):
     def handle_chunks(
         self, ptop: str, wark: str, chashes: list[str]
     ) -> tuple[int, list[list[int]], str, float, bool]:
-        with self.mutex, self.reg_mutex:
+        with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
             self.db_act = self.vol_act[ptop] = time.time()
             job = self.registry[ptop].get(wark)
             if not job:
@@ -3024,16 +3690,18 @@ class Up2k(object):
                 self.log("unknown wark [{}], known: {}".format(wark, known))
                 raise Pebkac(400, "unknown wark" + SSEELOG)
 
+            need = job["need"]
+            hidx = job["hidx"]
             for chash in chashes:
-                if chash not in job["need"]:
+                if chash not in need:
                     msg = "chash = {} , need:\n".format(chash)
-                    msg += "\n".join(job["need"])
+                    msg += "\n".join(need)
                     self.log(msg)
                     raise Pebkac(400, "already got that (%s) but thanks??" % (chash,))
 
                 if chash in job["busy"]:
                     nh = len(job["hash"])
-                    idx = job["hash"].index(chash)
+                    idx = hidx[chash][0]
                     t = "that chunk is already being written to:\n  {}\n  {} {}/{}\n  {}"
                     raise Pebkac(400, t.format(wark, chash, idx, nh, job["name"]))
 
@@ -3043,7 +3711,7 @@ class Up2k(object):
             coffsets = []
             nchunks = []
             for chash in chashes:
-                nchunk = [n for n, v in enumerate(job["hash"]) if v == chash]
+                nchunk = hidx.get(chash)
                 if not nchunk:
                     raise Pebkac(400, "unknown chunk %s" % (chash))
 
@@ -3073,7 +3741,7 @@ class Up2k(object):
         return chunksize, coffsets, path, job["lmod"], job["sprs"]
 
     def release_chunks(self, ptop: str, wark: str, chashes: list[str]) -> bool:
-        with self.reg_mutex:
+        with self._vlock(self.reg_mutex, ptop):
             job = self.registry[ptop].get(wark)
             if job:
                 for chash in chashes:
@@ -3084,37 +3752,75 @@ class Up2k(object):
     def confirm_chunks(
         self, ptop: str, wark: str, chashes: list[str]
     ) -> tuple[int, str]:
-        with self.mutex, self.reg_mutex:
-            self.db_act = self.vol_act[ptop] = time.time()
-            try:
-                job = self.registry[ptop][wark]
-                pdir = djoin(job["ptop"], job["prel"])
-                src = djoin(pdir, job["tnam"])
-                dst = djoin(pdir, job["name"])
-            except Exception as ex:
-                return "confirm_chunk, wark(%r)" % (ex,)  # type: ignore
+        with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
+            return self._confirm_chunks(ptop, wark, chashes)
 
-            for chash in chashes:
-                job["busy"].pop(chash, None)
+    def _confirm_chunks(
+        self, ptop: str, wark: str, chashes: list[str]
+    ) -> tuple[int, str]:
+        """mutex(main,reg) me"""
+        self.db_act = self.vol_act[ptop] = time.time()
+        try:
+            job = self.registry[ptop][wark]
+            pdir = djoin(job["ptop"], job["prel"])
+            src = djoin(pdir, job["tnam"])
+            dst = djoin(pdir, job["name"])
+        except Exception as ex:
+            return "confirm_chunk, wark(%r)" % (ex,)  # type: ignore
 
-            try:
-                for chash in chashes:
-                    job["need"].remove(chash)
-            except Exception as ex:
-                return "confirm_chunk, chash(%s) %r" % (chash, ex)  # type: ignore
+        for chash in chashes:
+            job["busy"].pop(chash, None)
 
-            ret = len(job["need"])
-            if ret > 0:
-                return ret, src
+        try:
+            for chash in chashes:
+                del job["need"][chash]
+        except Exception as ex:
+            return "confirm_chunk, chash(%s) %r" % (chash, ex)  # type: ignore
 
-            if self.args.nw:
-                self.regdrop(ptop, wark)
+        self._jnl(ptop, {"a": "c", "w": wark, "h": chashes})
+        ret = len(job["need"])
+        if ret > 0:
+            return ret, src
+
+        if self.args.nw:
+            self.regdrop(ptop, wark)
 
         return ret, dst
 
+    def finish_pack(
+        self, ptop: str, items: list[tuple[str, str]], busy_aps: dict[str, int]
+    ) -> dict[str, str]:
+        """
+        confirm the chunks of a packed upload (one chunk per file) and
+        finish the completed files, taking the mutex once and committing
+        to the db once; returns {wark: error}
+        """
+        self.busy_aps = busy_aps
+        errs: dict[str, str] = {}
+        with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
+            self.no_commit.add(ptop)
+            try:
+                for wark, chash in items:
+                    try:
+                        ztis = self._confirm_chunks(ptop, wark, [chash])
+                        if isinstance(ztis, str):
+                            errs[wark] = ztis
+                        elif not ztis[0] and not self.args.nw:
+                            self._finish_upload(ptop, wark)
+                    except Exception as ex:
+                        self.log("finish_pack: %s" % (min_ex(),), 1)
+                        errs[wark] = str(ex) if isinstance(ex, Pebkac) else repr(ex)
+            finally:
+                self.no_commit.discard(ptop)
+                cur = self.cur.get(ptop)
+                if cur:
+                    cur.connection.commit()
+
+        return errs
+
     def finish_upload(self, ptop: str, wark: str, busy_aps: dict[str, int]) -> None:
         self.busy_aps = busy_aps
-        with self.mutex, self.reg_mutex:
+        with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
             self._finish_upload(ptop, wark)
 
     def _finish_upload(self, ptop: str, wark: str) -> None:
@@ -3129,7 +3835,7 @@ class Up2k(object):
 
         if job["need"]:
             t = "finish_upload {} with remaining chunks {}"
-            raise Pebkac(500, t.format(wark, job["need"]))
+            raise Pebkac(500, t.format(wark, list(job["need"])))
 
         upt = job.get("at") or time.time()
         vflags = self.flags[ptop]
@@ -3165,15 +3871,19 @@ class Up2k(object):
         z2.append(upt)
         if self.idx_wark(vflags, *z2):
             del self.registry[ptop][wark]
+            self._jnl(ptop, {"a": "d", "w": wark})
         else:
             self.registry[ptop][wark]["done"] = 1
             self.regdrop(ptop, wark)
+            self._jnl(ptop, {"a": "f", "w": wark})
 
         if wake_sr:
             with self.rescan_cond:
                 self.rescan_cond.notify_all()
 
-        dupes = self.dupesched.pop(dst, [])
+        with self.xvol_mutex:
+            dupes = self.dupesched.pop(dst, [])
+
         if not dupes:
             return
 
@@ -3244,7 +3954,8 @@ class Up2k(object):
                 at,
                 skip_xau,
             )
-            cur.connection.commit()
+            if ptop not in self.no_commit:
+                cur.connection.commit()
         except Exception as ex:
             x = self.register_vpath(ptop, {})
             assert x
@@ -3253,7 +3964,8 @@ class Up2k(object):
 
         if "e2t" in self.flags[ptop]:
             self.tagq.put((ptop, wark, rd, fn, sz, ip, at))
-            self.n_tagq += 1
+            with self.xvol_mutex:
+                self.n_tagq += 1
 
         return True
 
@@ -3262,8 +3974,7 @@ class Up2k(object):
         try:
             r = db.execute(sql, (rd, fn))
         except:
-            assert self.mem_cur
-            r = db.execute(sql, s3enc(self.mem_cur, rd, fn))
+            r = db.execute(sql, self._s3enc(rd, fn))
 
         if r.rowcount:
             self.volsize[db] -= sz
@@ -3300,8 +4011,7 @@ class Up2k(object):
         try:
             db.execute(sql, v)
         except:
-            assert self.mem_cur
-            rd, fn = s3enc(self.mem_cur, rd, fn)
+            rd, fn = self._s3enc(rd, fn)
             v = (wark, int(ts), sz, rd, fn, db_ip, int(at or 0))
             db.execute(sql, v)
 
@@ -3328,6 +4038,7 @@ class Up2k(object):
             self.log(t, 1)
             wunlink(self.log, dst, vflags)
             self.registry[ptop].pop(wark, None)
+            self._jnl(ptop, {"a": "d", "w": wark})
             raise Pebkac(403, t)
 
         xiu = vflags.get("xiu")
@@ -3343,8 +4054,7 @@ class Up2k(object):
                 try:
                     db.execute(q, (cd, wark[:16], rd, fn))
                 except:
-                    assert self.mem_cur
-                    rd, fn = s3enc(self.mem_cur, rd, fn)
+                    rd, fn = self._s3enc(rd, fn)
                     db.execute(q, (cd, wark[:16], rd, fn))
 
             if self.xiu_asleep:
@@ -3421,7 +4131,7 @@ class Up2k(object):
             vn, rem = self.asrv.vfs.get(vpath, uname, *permsets[0])
             vn, rem = vn.get_dbv(rem)
             ptop = vn.realpath
-            with self.mutex, self.reg_mutex:
+            with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
                 abrt_cfg = self.flags.get(ptop, {}).get("u2abort", 1)
                 addr = (ip or "\n") if abrt_cfg in (1, 2) else ""
                 user = (uname or "\n") if abrt_cfg in (1, 3) else ""
@@ -3529,10 +4239,10 @@ class Up2k(object):
                         continue
 
                 n_files += 1
-                with self.mutex, self.reg_mutex:
+                ptop = dbv.realpath
+                with self._vlock(self.mutex, ptop), self._vlock(self.reg_mutex, ptop):
                     cur = None
                     try:
-                        ptop = dbv.realpath
                         cur, wark, _, _, _, _ = self._find_from_vpath(ptop, volpath)
                         self._forget_file(ptop, volpath, cur, wark, True, st.st_size)
                     finally:
@@ -3584,9 +4294,12 @@ class Up2k(object):
         if not srem:
             raise Pebkac(400, "mv: cannot move a mountpoint")
 
+        dvn, drem = self.asrv.vfs.get(dvp, uname, False, True)
+        dvn, drem = dvn.get_dbv(drem)
+
         st = bos.lstat(sabs)
         if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
-            with self.mutex:
+            with self._vlock(self.mutex, svn.realpath, dvn.realpath):
                 try:
                     ret = self._mv_file(uname, svp, dvp, curs)
                 finally:
@@ -3612,7 +4325,12 @@ class Up2k(object):
                 # the actual check (avoid toctou)
                 raise Pebkac(400, "mv: source folder contains other volumes")
 
-            with self.mutex:
+            # destination may be a different volume for each subfolder
+            zs = "/".join(x for x in [dbv.vpath, vrem] if x)
+            dvn, drem = self.asrv.vfs.get(dvp + zs[len(svp) :], uname, False, True)
+            dvn, drem = dvn.get_dbv(drem)
+
+            with self._vlock(self.mutex, dbv.realpath, dvn.realpath):
                 try:
                     for fn in files:
                         self.db_act = self.vol_act[dbv.realpath] = time.time()
@@ -3648,7 +4366,7 @@ class Up2k(object):
     def _mv_file(
         self, uname: str, svp: str, dvp: str, curs: set["sqlite3.Cursor"]
     ) -> str:
-        """mutex(main) me;  will mutex(reg)"""
+        """mutex(main) me (or both vols);  will mutex(reg)"""
         svn, srem = self.asrv.vfs.get(svp, uname, True, False, True)
         svn, srem = svn.get_dbv(srem)
 
@@ -3753,7 +4471,7 @@ class Up2k(object):
             if c2 and c2 != c1:
                 self._copy_tags(c1, c2, w)
 
-            with self.reg_mutex:
+            with self._vlock(self.reg_mutex, svn.realpath, dvn.realpath):
                 has_dupes = self._forget_file(svn.realpath, srem, c1, w, is_xvol, fsize)
 
             if not is_xvol:
@@ -3880,8 +4598,7 @@ class Up2k(object):
         try:
             c = cur.execute(q, (rd, fn))
         except:
-            assert self.mem_cur
-            c = cur.execute(q, s3enc(self.mem_cur, rd, fn))
+            c = cur.execute(q, self._s3enc(rd, fn))
 
         hit = c.fetchone()
         if hit:
@@ -3937,6 +4654,7 @@ class Up2k(object):
                     self.log(t.format(wark, p))
                 assert wark
                 del reg[wark]
+                self._jnl(ptop, {"a": "d", "w": wark})
 
         return has_dupes
 
@@ -3955,8 +4673,11 @@ class Up2k(object):
             q = r"select rd, fn from up where substr(w,1,16)=? and +w=?"
             argv = (wark[:16], wark)
 
-        for ptop, cur in self.cur.items():
-            for rd, fn in cur.execute(q, argv):
+        for ptop, cur in list(self.cur.items()):
+            # other volumes can be busy with their own cursors; use a new one
+            # (dupes in other volumes are from xlink, or moving symlinks)
+            c = cur if ptop == sptop else cur.connection.cursor()
+            for rd, fn in c.execute(q, argv):
                 if rd.startswith("//") or fn.startswith("//"):
                     rd, fn = s3dec(rd, fn)
 
@@ -3968,6 +4689,25 @@ class Up2k(object):
         if not dupes:
             return 0
 
+        xvols = set([x[0] for x in dupes if x[0] != sptop])
+        if not xvols or self.any_xlink:
+            # caller has all the volumes it needs (xlink takes everything)
+            return self._relink2(dupes, sabs, dabs)
+
+        # caller has the volume of sptop (and maybe dabs); also lock the
+        # volumes with dupes so nothing else is moving them around
+        vmut = self.mutex.vol_more(xvols, 10)
+        if not vmut:
+            t = "relinking dupes in %s without locking them; server busy"
+            self.log(t % (sorted(xvols),), 3)
+            return self._relink2(dupes, sabs, dabs)
+
+        try:
+            return self._relink2(dupes, sabs, dabs)
+        finally:
+            vmut.release()
+
+    def _relink2(self, dupes: list[list[str]], sabs: str, dabs: str) -> int:
         full: dict[str, tuple[str, str]] = {}
         links: dict[str, tuple[str, str]] = {}
         for ptop, vp in dupes:
@@ -4071,14 +4811,22 @@ class Up2k(object):
 
         return wark
 
-    def _hashlist_from_file(self, path: str, prefix: str = "") -> list[str]:
+    def _hashlist_from_file(
+        self,
+        path: str,
+        prefix: str = "",
+        throttle: Optional[Callable[[int], None]] = None,
+        quiet: bool = False,
+    ) -> list[str]:
+        """quiet: not part of a rescan, so leave its progress-printer alone"""
         fsz = bos.path.getsize(path)
         csz = up2k_chunksize(fsz)
         ret = []
         suffix = " MB, {}".format(path)
+        pp = None if quiet else self.pp
         with open(fsenc(path), "rb", self.args.iobuf) as f:
-            if self.mth and fsz >= 1024 * 512:
-                tlt = self.mth.hash(f, fsz, csz, self.pp, prefix, suffix)
+            if self.mth and fsz >= 1024 * 512 and not throttle:
+                tlt = self.mth.hash(f, fsz, csz, pp, prefix, suffix)
                 ret = [x[0] for x in tlt]
                 fsz = 0
 
@@ -4087,9 +4835,9 @@ class Up2k(object):
                 if self.stop:
                     return []
 
-                if self.pp:
+                if pp:
                     mb = fsz // (1024 * 1024)
-                    self.pp.msg = prefix + str(mb) + suffix
+                    pp.msg = prefix + str(mb) + suffix
 
                 hashobj = hashlib.sha512()
                 rem = min(csz, fsz)
@@ -4101,6 +4849,8 @@ class Up2k(object):
 
                     hashobj.update(buf)
                     rem -= len(buf)
+                    if throttle:
+                        throttle(len(buf))
 
                 digest = hashobj.digest()[:33]
                 digest = base64.urlsafe_b64encode(digest)
@@ -4226,12 +4976,102 @@ class Up2k(object):
                 slp = self.args.snap_wri
                 self.do_snapshot()
 
-    def do_snapshot(self) -> None:
+    def do_snapshot(self, full: bool = False) -> None:
         with self.mutex, self.reg_mutex:
             for k, reg in self.registry.items():
-                self._snap_reg(k, reg)
+                self._snap_reg(k, reg, full)
+
+    def _jnl(self, ptop: str, rec: dict[str, Any]) -> None:
+        """
+        mutex(reg) me
+        appends a registry change to up2k.jnl, which is
+        replayed on top of up2k.snap by register_vpath
+        """
+        if ptop not in self.jnl_f:
+            return
+
+        f = self.jnl_f[ptop]
+        try:
+            if not f:
+                histpath = self.asrv.vfs.histtab[ptop]
+                if bos.makedirs(histpath):
+                    hidedir(histpath)
+
+                path = os.path.join(histpath, "up2k.jnl")
+                f = self.jnl_f[ptop] = open(path, "ab", 0)
+
+            buf = json.dumps(rec, separators=(",", ":")).encode("utf-8") + b"\n"
+            f.write(buf)
+            self.jnl_sz[ptop] += len(buf)
+        except Exception as ex:
+            t = "failed to write up2k.jnl for [%s]; will snapshot instead: %r"
+            self.log(t % (ptop, ex), 3)
+            self.jnl_f.pop(ptop)
+            self.snap_prev.pop(ptop, None)
+            try:
+                f.close()
+            except:
+                pass
 
-    def _snap_reg(self, ptop: str, reg: dict[str, dict[str, Any]]) -> None:
+    def _jnl_replay(
+        self, path: str, reg: dict[str, dict[str, Any]]
+    ) -> tuple[list[str], int]:
+        """applies up2k.jnl to a registry loaded from up2k.snap"""
+        drp = []
+        n = 0
+        with open(path, "rb") as f:
+            for ln in f:
+                try:
+                    rec = json.loads(ln.decode("utf-8"))
+                    act = rec["a"]
+                except:
+                    # only the final write can be torn
+                    self.log("ignoring damaged record in %s" % (path,), 3)
+                    break
+
+                n += 1
+                if act == "j":
+                    job = rec["j"]
+                    job["need"] = dict.fromkeys(job["need"])
+                    reg[job["wark"]] = job
+                    continue
+
+                job = reg.get(rec["w"])
+                if not job:
+                    continue
+
+                if act == "c":
+                    need = job["need"]
+                    if isinstance(need, list):
+                        need = job["need"] = dict.fromkeys(need)
+
+                    for chash in rec["h"]:
+                        need.pop(chash, None)
+                elif act == "f":
+                    job["done"] = 1
+                    drp.append(rec["w"])
+                elif act == "d":
+                    del reg[rec["w"]]
+
+        return drp, n
+
+    def _jnl_reset(self, ptop: str, histpath: str) -> None:
+        """mutex(main,reg) me; up2k.snap is current, drop the journal"""
+        f = self.jnl_f.get(ptop)
+        if f:
+            f.close()
+
+        if ptop in self.jnl_f:
+            self.jnl_f[ptop] = None
+            self.jnl_sz[ptop] = 0
+
+        path = os.path.join(histpath, "up2k.jnl")
+        if bos.path.exists(path):
+            bos.unlink(path)
+
+    def _snap_reg(
+        self, ptop: str, reg: dict[str, dict[str, Any]], full: bool = False
+    ) -> None:
         now = time.time()
         histpath = self.asrv.vfs.histtab.get(ptop)
         if not histpath:
@@ -4258,6 +5098,7 @@ class Up2k(object):
             self.log("\n".join([t] + vis))
             for job in rm:
                 del reg[job["wark"]]
+                self._jnl(ptop, {"a": "d", "w": job["wark"]})
                 try:
                     # remove the filename reservation
                     path = djoin(job["ptop"], job["prel"], job["name"])
@@ -4283,26 +5124,40 @@ class Up2k(object):
                 self.snap_prev[ptop] = None
                 if bos.path.exists(path):
                     bos.unlink(path)
+                self._jnl_reset(ptop, histpath)
+            elif self.jnl_sz.get(ptop):
+                self._jnl_reset(ptop, histpath)
             return
 
+        njnl = self.jnl_sz.get(ptop, 0)
+        if ptop in self.jnl_f and not full:
+            # the journal has everything; only compact it once it's
+            # bigger than both the snap and --snap-jnl MiB (whichever is larger)
+            cap = max(self.args.snap_jnl * 1024 * 1024, self.snap_sz.get(ptop, 0))
+            if njnl <= cap:
+                return
+
         newest = float(max(x["poke"] for _, x in reg.items()) if reg else 0)
         etag = (len(reg), newest)
-        if etag == self.snap_prev.get(ptop):
+        if etag == self.snap_prev.get(ptop) and not njnl:
             return
 
         if bos.makedirs(histpath):
             hidedir(histpath)
 
         path2 = "{}.{}".format(path, os.getpid())
-        body = {"droppable": self.droppable[ptop], "registry": reg}
+        zd = {k: self._ser_job(v) for k, v in reg.items()}
+        body = {"droppable": self.droppable[ptop], "registry": zd}
         j = json.dumps(body, sort_keys=True, separators=(",\n", ": ")).encode("utf-8")
         with gzip.GzipFile(path2, "wb") as f:
             f.write(j)
 
         atomic_move(self.log, path2, path, VF_CAREFUL)
+        self._jnl_reset(ptop, histpath)
 
         self.log("snap: {} |{}|".format(path, len(reg.keys())))
         self.snap_prev[ptop] = etag
+        self.snap_sz[ptop] = len(j)
 
     def _tagger(self) -> None:
         with self.mutex:
@@ -4454,13 +5309,16 @@ class Up2k(object):
         if self.mth:
             self.mth.stop = True
 
+        if self.mthf:
+            self.mthf.stop = True
+
         # in case we're killed early
         for x in list(self.spools):
             self._unspool(x)
 
         if not self.args.no_snap:
             self.log("writing snapshot")
-            self.do_snapshot()
+            self.do_snapshot(True)
 
         t0 = time.time()
         while self.pp:
@@ -25,7 +25,8 @@ import sys
 import threading
 import time
 import traceback
-from collections import Counter
+import zlib
+from collections import Counter, deque
 
 from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
 from queue import Queue
@@ -121,6 +122,29 @@ try:
 except:
     HAVE_PSUTIL = False
 
+try:
+    if os.environ.get("PRTY_NO_BROTLI"):
+        raise Exception()
+
+    import brotli
+
+    HAVE_BROTLI = True
+except:
+    HAVE_BROTLI = False
+
+try:
+    if os.environ.get("PRTY_NO_ZSTD"):
+        raise Exception()
+
+    try:
+        from compression import zstd  # py3.14+
+    except ImportError:
+        import zstandard as zstd
+
+    HAVE_ZSTD = True
+except:
+    HAVE_ZSTD = False
+
 if True:  # pylint: disable=using-constant-test
     import types
     from collections.abc import Callable, Iterable
@@ -216,6 +240,8 @@ else:
 
 SYMTIME = sys.version_info > (3, 6) and os.utime in os.supports_follow_symlinks
 
+FADV_SEQ = getattr(os, "POSIX_FADV_SEQUENTIAL", 0)
+
 META_NOBOTS = '<meta name="robots" content="noindex, nofollow">\n'
 
 FFMPEG_URL = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-git-full.7z"
@@ -900,6 +926,149 @@ class FHC(object):
         ce.ts = time.time()
 
 
+class VMutex(object):
+    """
+    lock-striping keyed by volume (ptop);
+    the regular acquire/release/with takes the whole thing,
+    vol(*ptops) only excludes holders of the same volume(s)
+    and anyone holding the whole thing
+    """
+
+    def __init__(self) -> None:
+        self.glock = threading.Lock()  # fair-ish among full takers
+        self.cond = threading.Condition()
+        self.held: set[str] = set()  # volumes currently taken
+        self.busy = False  # fully taken
+        self.nwait = 0  # num threads waiting to take it fully
+        self.tls = threading.local()  # volumes taken by the current thread
+
+    def _wait(self, chk: Callable[[], bool], blocking: bool, timeout: float) -> bool:
+        """cond(me)"""
+        t0 = time.time()
+        while not chk():
+            if not blocking:
+                return False
+
+            if timeout < 0:
+                self.cond.wait()
+                continue
+
+            rem = t0 + timeout - time.time()
+            if rem <= 0:
+                return False
+
+            self.cond.wait(rem)
+
+        return True
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        t0 = time.time()
+        if PY2 or timeout < 0:
+            ok = self.glock.acquire(blocking)
+        else:
+            ok = self.glock.acquire(blocking, timeout)
+
+        if not ok:
+            return False
+
+        if timeout >= 0:
+            timeout = max(0, t0 + timeout - time.time())
+
+        with self.cond:
+            self.nwait += 1
+            try:
+                ok = self._wait(lambda: not self.held, blocking, timeout)
+            finally:
+                self.nwait -= 1
+
+            if ok:
+                self.busy = True
+            else:
+                # volume-waiters were held back by us; let them in
+                self.cond.notify_all()
+
+        if not ok:
+            self.glock.release()
+
+        return ok
+
+    def release(self) -> None:
+        with self.cond:
+            self.busy = False
+            self.cond.notify_all()
+
+        self.glock.release()
+
+    def __enter__(self) -> None:
+        self.acquire()
+
+    def __exit__(self, *a: Any) -> None:
+        self.release()
+
+    def vol(self, *ptops: str) -> "VMutex.Vol":
+        return VMutex.Vol(self, set(ptops))
+
+    def vol_more(self, ptops: set[str], timeout: float) -> Optional["VMutex.Vol"]:
+        """
+        for someone already holding a vol() which turns out to need more
+        volumes; skips the queue of full-takers since they are waiting for
+        the caller anyways, and gives up after timeout (returns None) in
+        case the other holder is doing the same thing in reverse
+        """
+        ptops = ptops - self.mine()
+        with self.cond:
+            ok = self._wait(
+                lambda: not self.busy and self.held.isdisjoint(ptops), True, timeout
+            )
+            if not ok:
+                return None
+
+            self.held.update(ptops)
+
+        self.tls.ptops = self.mine() | ptops
+        return VMutex.Vol(self, ptops)
+
+    def mine(self) -> set[str]:
+        """volumes held by the current thread"""
+        return getattr(self.tls, "ptops", None) or set()
+
+    class Vol(object):
+        def __init__(self, vm: "VMutex", ptops: set[str]) -> None:
+            self.vm = vm
+            self.ptops = ptops
+
+        def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+            vm = self.vm
+            with vm.cond:
+                ok = vm._wait(
+                    lambda: not vm.busy
+                    and not vm.nwait
+                    and vm.held.isdisjoint(self.ptops),
+                    blocking,
+                    timeout,
+                )
+                if ok:
+                    vm.held.update(self.ptops)
+
+            if ok:
+                vm.tls.ptops = vm.mine() | self.ptops
+
+            return ok
+
+        def release(self) -> None:
+            vm = self.vm
+            vm.tls.ptops = vm.mine() - self.ptops
+            with vm.cond:
+                vm.held.difference_update(self.ptops)
+                vm.cond.notify_all()
+
+        def __enter__(self) -> None:
+            self.acquire()
+
+        def __exit__(self, *a: Any) -> None:
+            self.release()
+
+
 class ProgressPrinter(threading.Thread):
     """
     periodically print progress info without linefeeds
@@ -1046,6 +1215,198 @@ class MTHash(object):
         return nch, udig, ofs0, chunk_sz
 
 
+class MTHashFiles(object):
+    """
+    hashes whole files on a threadpool, keeping several files in flight;
+    MTHash is better for big files since it splits them into chunks
+    """
+
+    def __init__(self, cores: int, bufsz: int, csz_fun: Any) -> None:
+        self.bufsz = bufsz
+        self.csz_fun = csz_fun
+        self.nahead = cores * 4
+        self.stop = False
+        self.work_q: Queue[tuple[Queue[Any], int, str]] = Queue()
+        for n in range(cores):
+            Daemon(self.worker, "mthf-%d" % (n,))
+
+    def imap(
+        self, items: Iterable[tuple[Any, str, int]], big: int
+    ) -> Generator[tuple[Any, Union[None, list[str], Exception]], None, None]:
+        """
+        takes (tag, abspath, filesize) and yields (tag, hashlist) in the same order;
+        hashlist is None if there was no abspath or the file is too big
+        (caller should hash those itself) or an Exception if the hashing failed;
+        items are fetched as needed, so it is fine to make it a generator
+        """
+        done_q: Queue[tuple[int, Union[list[str], Exception]]] = Queue()
+        tags: deque[Any] = deque()
+        res: dict[int, Union[None, list[str], Exception]] = {}
+        n_in = n_out = 0
+        it = iter(items)
+        eof = False
+        while True:
+            while not eof and n_in - n_out < self.nahead:
+                try:
+                    tag, ap, sz = next(it)
+                except StopIteration:
+                    eof = True
+                    break
+
+                tags.append(tag)
+                if ap and sz < big:
+                    self.work_q.put((done_q, n_in, ap))
+                else:
+                    res[n_in] = None
+                n_in += 1
+
+            if n_out == n_in:
+                return
+
+            while n_out not in res:
+                n, ret = done_q.get()
+                res[n] = ret
+
+            yield tags.popleft(), res.pop(n_out)
+            n_out += 1
+
+    def worker(self) -> None:
+        while True:
+            done_q, n, ap = self.work_q.get()
+            try:
+                ret: Union[list[str], Exception] = [] if self.stop else self.hash(ap)
+            except Exception as ex:
+                ret = ex
+
+            done_q.put((n, ret))
+
+    def hash(self, ap: str) -> list[str]:
+        ret = []
+        with open(fsenc(ap), "rb", self.bufsz) as f:
+            fsz = os.fstat(f.fileno()).st_size
+            csz = self.csz_fun(fsz)
+            if FADV_SEQ:
+                try:
+                    os.posix_fadvise(f.fileno(), 0, 0, FADV_SEQ)  # type: ignore
+                except:
+                    pass
+
+            while fsz > 0:
+                hashobj = hashlib.sha512()
+                rem = min(csz, fsz)
+                fsz -= rem
+                while rem > 0:
+                    buf = f.read(min(rem, 1024 * 1024))
+                    if not buf:
+                        raise Exception("EOF at " + str(f.tell()))
+
+                    hashobj.update(buf)
+                    rem -= len(buf)
+
+                digest = hashobj.digest()[:33]
+                ret.append(base64.urlsafe_b64encode(digest).decode("utf-8"))
+
+        return ret
+
+
+class StatPool(object):
+    """
+    lists folders ahead of a depth-first walk (the up2k indexer);
+    at most ndev threads are listing folders on each device
+    """
+
+    def __init__(self, log: "RootLogger", scandir: bool, nthr: int, ndev: int) -> None:
+        self.log = log
+        self.scandir = scandir
+        self.ndev = max(1, ndev)
+        self.stop = False
+        self.cond = threading.Condition()
+        self.todo: dict[int, list[str]] = {}  # per-device stack; next one last
+        self.wanted: set[str] = set()  # queued/busy/done and not consumed yet
+        self.busy: dict[int, int] = {}
+        self.busy_ap: set[str] = set()
+        self.done: dict[str, list[tuple[str, os.stat_result]]] = {}
+        self.nent = 0  # number of entries in self.done
+        for n in range(nthr):
+            Daemon(self.worker, "statpool-%d" % (n,))
+
+    def close(self) -> None:
+        with self.cond:
+            self.stop = True
+            self.todo.clear()
+            self.wanted.clear()
+            self.done.clear()
+            self.cond.notify_all()
+
+    def want(self, aps: list[tuple[str, int]]) -> None:
+        """queue folders (abspath, st_dev) in the order they will be walked"""
+        with self.cond:
+            for ap, dev in reversed(aps):
+                self.todo.setdefault(dev, []).append(ap)
+                self.wanted.add(ap)
+
+            self.cond.notify_all()
+
+    def drop(self, aps: list[str]) -> None:
+        """the walker won't be needing these after all"""
+        with self.cond:
+            for ap in aps:
+                self.wanted.discard(ap)
+                zl = self.done.pop(ap, None)
+                if zl is not None:
+                    self.nent -= len(zl)
+
+            self.cond.notify_all()
+
+    def get(self, ap: str) -> list[tuple[str, os.stat_result]]:
+        with self.cond:
+            while ap in self.busy_ap:
+                self.cond.wait()
+
+            self.wanted.discard(ap)
+            ret = self.done.pop(ap, None)
+            if ret is not None:
+                self.nent -= len(ret)
+                self.cond.notify_all()
+                return ret
+
+        # not started yet (or never queued); no point waiting
+        return list(statdir(self.log, self.scandir, True, ap))
+
+    def worker(self) -> None:
+        while True:
+            with self.cond:
+                while True:
+                    if self.stop:
+                        return
+
+                    ap = ""
+                    if len(self.done) + len(self.busy_ap) < 256 and self.nent < 262144:
+                        for dev, aps in self.todo.items():
+                            if aps and self.busy.get(dev, 0) < self.ndev:
+                                ap = aps.pop()
+                                break
+
+                    if not ap:
+                        self.cond.wait()
+                    elif ap in self.wanted:
+                        break
+
+                self.busy[dev] = self.busy.get(dev, 0) + 1
+                self.busy_ap.add(ap)
+
+            ret = list(statdir(self.log, self.scandir, True, ap))
+
+            with self.cond:
+                self.busy[dev] -= 1
+                self.busy_ap.discard(ap)
+                if ap in self.wanted:
+                    self.done[ap] = ret
+                    self.nent += len(ret)
+
+                self.cond.notify_all()
+
+
 class HMaccas(object):
     def __init__(self, keypath: str, retlen: int) -> None:
         self.retlen = retlen
@@ -1195,6 +1556,236 @@ class Garda(object):
             return 0, ip
 
 
+class TokenBucket(object):
+    """bandwidth limit; spends bytes, refills at rate bytes/sec"""
+
+    def __init__(self, rate: int) -> None:
+        self.rate = rate
+        self.cap = max(rate, 65536)  # burst; about one second worth
+        self.level = float(self.cap)
+        self.t = time.time()
+        self.mutex = threading.Lock()
+
+    def take(self, nbytes: int, now: float) -> float:
+        """spend nbytes (can go into debt); returns seconds until debt-free"""
+        with self.mutex:
+            zf = self.level + (now - self.t) * self.rate
+            self.level = min(zf, self.cap) - nbytes
+            self.t = now
+            return -self.level / self.rate if self.level < 0 else 0.0
+
+
+class BwLim(object):
+    """the token buckets which one transfer has to get through"""
+
+    def __init__(
+        self, shared: list[TokenBucket], own: list[TokenBucket], grace: int
+    ) -> None:
+        self.shared = shared  # server / volume total
+        self.own = own  # user or ip
+        self.grace = grace
+        self.nbytes = 0
+
+        # several sends per sec at the lowest rate, to smooth it out
+        rate = min(x.rate for x in shared + own)
+        self.bufsz = max(4096, rate // 8)
+
+    def take(self, nbytes: int) -> None:
+        """account for nbytes transferred; sleeps if over the limit"""
+        wait = self.delay(nbytes, time.time())
+        if wait > 0:
+            time.sleep(wait)
+
+    def delay(self, nbytes: int, now: float) -> float:
+        """account for nbytes transferred; returns seconds to sleep"""
+        wait = 0.0
+        for bkt in self.own:
+            wait = max(wait, bkt.take(nbytes, now))
+
+        # the first --bw-grace bytes of each transfer are spent from the
+        # shared buckets without waiting for them, so small interactive
+        # requests (listings, thumbnails) skip the queue behind big downloads
+        grace = self.nbytes < self.grace
+        for bkt in self.shared:
+            zf = bkt.take(nbytes, now)
+            if not grace:
+                wait = max(wait, zf)
+
+        self.nbytes += nbytes
+        return wait
+
+    def wrap(
+        self, gen: Generator[bytes, None, None]
+    ) -> Generator[bytes, None, None]:
+        for buf in gen:
+            self.take(len(buf))
+            yield buf
+
+
+class Shaper(object):
+    """
+    hierarchical token-bucket bandwidth limits; --bw-all for the whole
+    server, then volflag bwvol for each volume, then bwusr for each user
+    (or ip if not logged in) in each volume; uploads and downloads are
+    limited separately
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.rate_all = unhumanize(args.bw_all or "0")
+        self.grace = unhumanize(args.bw_grace or "0")
+        self.acct: dict[str, int] = {}  # bwusr override per account
+        for zs in args.bw_acct or []:
+            try:
+                k, v = zs.split("=", 1)
+                self.acct[k.strip()] = unhumanize(v.strip())
+            except:
+                raise Exception("invalid --bw-acct [%s]; need USER=RATE" % (zs,))
+
+        self.mutex = threading.Lock()
+        self.buckets: dict[str, TokenBucket] = {}
+        self.t_cln = time.time()
+
+    def _get(self, key: str, rate: int) -> TokenBucket:
+        """mutex me"""
+        try:
+            return self.buckets[key]
+        except KeyError:
+            ret = self.buckets[key] = TokenBucket(rate)
+            return ret
+
+    def get(
+        self, flags: dict[str, Any], vkey: str, uname: str, ip: str, up: bool
+    ) -> Optional[BwLim]:
+        """the limits which apply to a transfer, or None if unlimited"""
+        rate_vol = flags.get("bwvol") or 0
+        rate_usr = self.acct.get(uname, flags.get("bwusr") or 0)
+        if not self.rate_all and not rate_vol and not rate_usr:
+            return None
+
+        d = "u" if up else "d"
+        shared: list[TokenBucket] = []
+        own: list[TokenBucket] = []
+        with self.mutex:
+            now = time.time()
+            if now - self.t_cln > 300:
+                # forget idle buckets; they'd be full by now anyways
+                zd = self.buckets
+                self.buckets = {k: v for k, v in zd.items() if now - v.t < 60}
+                self.t_cln = now
+
+            # rate is part of the key so a config reload starts fresh
+            if self.rate_all:
+                shared.append(self._get(d, self.rate_all))
+
+            if rate_vol:
+                shared.append(self._get("%s%d/%s" % (d, rate_vol, vkey), rate_vol))
+
+            if rate_usr:
+                # bwusr is a volflag, so each user gets one bucket per volume
+                ukey = ip if uname == "*" else uname
+                zs = "%s%d:%s/%s" % (d, rate_usr, ukey, vkey)
+                own.append(self._get(zs, rate_usr))
+
+        return BwLim(shared, own, self.grace)
+
+
+CZ_ENC = {"gz": "gzip", "br": "br", "zstd": "zstd"}
+CZ_LV = {"gz": 6, "br": 4, "zstd": 3}  # fast enough to do on the fly
+
+
+def cz_pack(buf: bytes, alg: str) -> bytes:
+    """compress buf with alg (one of CZ_ENC)"""
+    lv = CZ_LV[alg]
+    if alg == "zstd":
+        return zstd.compress(buf, lv)
+
+    if alg == "br":
+        return brotli.compress(buf, quality=lv)
+
+    zo = zlib.compressobj(lv, zlib.DEFLATED, 31)  # 31 = gzip header
+    return zo.compress(buf) + zo.flush()
+
+
+class Cz(object):
+    """
+    on-the-fly compression of http responses (--cz); picks an encoding
+    which the client accepts, and keeps a small cache of compressed
+    editions of static files, keyed by abspath + encoding
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        have = {"gz": True, "br": HAVE_BROTLI, "zstd": HAVE_ZSTD}
+        zsl = [x.strip() for x in (args.cz or "").split(",")]
+        self.algs = [x for x in zsl if have.get(x)]
+        if args.no_cz:
+            self.algs = []
+
+        self.min = args.cz_min
+        self.fmax = min(args.cz_fmax * 1048576, args.cz_cache * 1048576 // 4)
+        self.cap = args.cz_cache * 1048576
+        self.mutex = threading.Lock()
+        self.cache: dict[tuple[str, str], tuple[float, int, bytes]] = {}
+        self.csz = 0
+
+    def pick(self, hdrs: dict[str, str], mime: str, sz: int) -> str:
+        """the alg to use for a reply of sz bytes, or blank if none"""
+        if not self.algs or sz < self.min or not cz_mime(mime):
+            return ""
+
+        accepted: dict[str, float] = {}
+        for zs in hdrs.get("accept-encoding", "").lower().split(","):
+            enc, _, q = zs.partition(";")
+            try:
+                qv = float(q.strip()[2:]) if q else 1.0  # q=0.5
+            except:
+                qv = 0.0
+            accepted[enc.strip()] = qv
+
+        for alg in self.algs:
+            qv = accepted.get(CZ_ENC[alg], accepted.get("*", 0.0))
+            if qv > 0:
+                return alg
+
+        return ""
+
+    def get(self, ap: str, alg: str, mt: float, sz: int) -> bytes:
+        """compressed edition of file ap, from cache if still fresh"""
+        key = (ap, alg)
+        with self.mutex:
+            zt = self.cache.pop(key, None)
+            if zt:
+                if zt[0] == mt and zt[1] == sz:
+                    self.cache[key] = zt  # most recently used goes last
+                    return zt[2]
+
+                self.csz -= len(zt[2])
+
+        with open(fsenc(ap), "rb") as f:
+            ret = cz_pack(f.read(), alg)
+
+        with self.mutex:
+            zt = self.cache.pop(key, None)
+            if zt:
+                self.csz -= len(zt[2])
+
+            self.cache[key] = (mt, sz, ret)
+            self.csz += len(ret)
+            while self.csz > self.cap and self.cache:
+                zt = self.cache.pop(next(iter(self.cache)))
+                self.csz -= len(zt[2])
+
+        return ret
+
+
+def cz_mime(mime: str) -> bool:
+    """true if mime is worth compressing"""
+    mime = mime.split(";")[0].strip().lower()
+    if mime.startswith("text/"):
+        return True
+
+    return mime.endswith(("json", "javascript", "xml")) or mime == "application/wasm"
+
+
 if WINDOWS and sys.version_info < (3, 8):
     _popen = sp.Popen
 
@@ -2565,8 +3156,12 @@ def sendfile_py(
     bufsz: int,
     slp: float,
     use_poll: bool,
+    bw: Optional[BwLim] = None,
 ) -> int:
     remains = upper - lower
+    if bw:
+        bufsz = min(bufsz, bw.bufsz)
+
     f.seek(lower)
     while remains > 0:
         if slp:
@@ -2582,6 +3177,9 @@ def sendfile_py(
         except:
             return remains
 
+        if bw:
+            bw.take(len(buf))
+
     return 0
 
 
@@ -2594,11 +3192,13 @@ def sendfile_kern(
     bufsz: int,
     slp: float,
     use_poll: bool,
+    bw: Optional[BwLim] = None,
 ) -> int:
     out_fd = s.fileno()
     in_fd = f.fileno()
     ofs = lower
     stuck = 0.0
+    maxreq = bw.bufsz if bw else 2 ** 30
     if use_poll:
         poll = select.poll()
         poll.register(out_fd, select.POLLOUT)
@@ -2606,7 +3206,7 @@ def sendfile_kern(
     while ofs < upper:
         stuck = stuck or time.time()
         try:
-            req = min(2 ** 30, upper - ofs)
+            req = min(maxreq, upper - ofs)
             if use_poll:
                 poll.poll(10000)
             else:
@@ -2630,6 +3230,9 @@ def sendfile_kern(
             return upper - ofs
 
         ofs += n
+        if bw:
+            bw.take(n)
+
         # print("sendfile: ok, sent {} now, {} total, {} remains".format(n, ofs - lower, upper - ofs))
 
     return 0
@@ -3014,13 +3617,20 @@ def retchk(
         raise Exception(t)
 
 
+HOOK_QLEN = 256
+HOOK_MUTEX = threading.Lock()
+HOOK_MODS = {}  # type: dict[str, tuple[Any, float]]
+HOOK_QS = {}  # type: dict[str, Queue[tuple[Any, Any]]]
+
+
 def _parsehook(
     log: Optional["NamedLogger"], cmd: str
-) -> tuple[str, bool, bool, bool, float, dict[str, Any], list[str]]:
+) -> tuple[str, bool, bool, bool, bool, float, dict[str, Any], list[str]]:
     areq = ""
     chk = False
     fork = False
     jtxt = False
+    imp = False
     wait = 0.0
     tout = 0.0
     kill = "t"
@@ -3034,6 +3644,8 @@ def _parsehook(
             fork = True
         elif arg == "j":
             jtxt = True
+        elif arg == "I":
+            imp = True
         elif arg.startswith("w"):
             wait = float(arg[1:])
         elif arg.startswith("t"):
@@ -3052,9 +3664,9 @@ def _parsehook(
             t = "hook: invalid flag {} in {}"
             (log or print)(t.format(arg, ocmd))
 
-    env = os.environ.copy()
+    env = {} if imp else os.environ.copy()
     try:
-        if EXE:
+        if EXE or imp:
             raise Exception()
 
         pypath = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
@@ -3062,7 +3674,7 @@ def _parsehook(
         pypath = str(os.pathsep.join(zsl))
         env["PYTHONPATH"] = pypath
     except:
-        if not EXE:
+        if not EXE and not imp:
             raise
 
     sp_ka = {
@@ -3078,7 +3690,58 @@ def _parsehook(
 
     argv[0] = os.path.expandvars(os.path.expanduser(argv[0]))
 
-    return areq, chk, fork, jtxt, wait, sp_ka, argv
+    return areq, chk, fork, jtxt, imp, wait, sp_ka, argv
+
+
+def _loadhook(ap: str) -> Any:
+    ap = os.path.expandvars(os.path.expanduser(ap))
+    with HOOK_MUTEX:
+        mt = os.stat(fsenc(ap)).st_mtime
+        try:
+            mod, mt0 = HOOK_MODS[ap]
+            if mt0 == mt:
+                return mod
+            hot = True
+        except KeyError:
+            hot = False
+
+        mod = loadpy(ap, hot)
+        if not hasattr(mod, "main"):
+            raise Exception("hook %s has no main() function" % (ap,))
+
+        HOOK_MODS[ap] = (mod, mt)
+        return mod
+
+
+def _imphook(
+    log: Optional["NamedLogger"], ap: str, ka: Any, fork: bool
+) -> int:
+    """
+    run an I-flagged hook in-process; the return value
+    of its main() is used as the exitcode
+    """
+    mod = _loadhook(ap)
+    if not fork:
+        return int(mod.main(ka) or 0)
+
+    with HOOK_MUTEX:
+        q = HOOK_QS.get(ap)
+        if not q:
+            q = HOOK_QS[ap] = Queue(HOOK_QLEN)
+            Daemon(_imphook_w, "ihook", (log, q))
+
+    q.put((mod, ka))  # blocks while the hook is HOOK_QLEN events behind
+    return 0
+
+
+def _imphook_w(log: Optional["NamedLogger"], q: Queue[tuple[Any, Any]]) -> None:
+    # runs the forked events of one I-hook, in order
+    while True:
+        mod, ka = q.get()
+        try:
+            mod.main(ka)
+        except:
+            (log or print)("hook: %s" % (min_ex(),))
 
 
 def runihook(
@@ -3087,14 +3750,14 @@ def runihook(
     vol: "VFS",
     ups: list[tuple[str, int, int, str, str, str, int]],
 ) -> bool:
-    _, chk, fork, jtxt, wait, sp_ka, acmd = _parsehook(log, cmd)
+    _, chk, fork, jtxt, imp, wait, sp_ka, acmd = _parsehook(log, cmd)
     bcmd = [sfsenc(x) for x in acmd]
     if acmd[0].endswith(".py"):
         bcmd = [sfsenc(pybin)] + bcmd
 
     vps = [vjoin(*list(s3dec(x[3], x[4]))) for x in ups]
     aps = [djoin(vol.realpath, x) for x in vps]
-    if jtxt:
+    if jtxt or imp:
         # 0w 1mt 2sz 3rd 4fn 5ip 6at
         ja = [
             {
@@ -3108,12 +3771,20 @@ def runihook(
             }
             for x, vp, ap in zip(ups, vps, aps)
         ]
-        sp_ka["sin"] = json.dumps(ja).encode("utf-8", "replace")
+        if imp:
+            ja = {"ups": ja, "log": log}  # type: ignore
+        else:
+            sp_ka["sin"] = json.dumps(ja).encode("utf-8", "replace")
     else:
         sp_ka["sin"] = b"\n".join(fsenc(x) for x in aps)
 
     t0 = time.time()
-    if fork:
+    if imp:
+        rc = _imphook(log, acmd[0], ja, fork)
+        if chk and rc:
+            retchk(rc, acmd, "", log, 5)
+            return False
+    elif fork:
         Daemon(runcmd, cmd, bcmd, ka=sp_ka)
     else:
         rc, v, err = runcmd(bcmd, **sp_ka)  # type: ignore
@@ -3142,14 +3813,14 @@ def _runhook(
     at: float,
     txt: str,
 ) -> bool:
-    areq, chk, fork, jtxt, wait, sp_ka, acmd = _parsehook(log, cmd)
+    areq, chk, fork, jtxt, imp, wait, sp_ka, acmd = _parsehook(log, cmd)
     if areq:
         for ch in areq:
             if ch not in perms:
                 t = "user %s not allowed to run hook %s; need perms %s, have %s"
                 log(t % (uname, cmd, areq, perms))
                 return True  # fallthrough to next hook
-    if jtxt:
+    if jtxt or imp:
         ja = {
             "ap": ap,
             "vp": vp,
@@ -3162,6 +3833,20 @@ def _runhook(
             "perms": perms,
             "txt": txt,
         }
+        if imp:
+            ja["log"] = log
+            t0 = time.time()
+            rc = _imphook(log, acmd[0], ja, fork)
+            if chk and rc:
+                retchk(rc, acmd, "", log, 5)
+                return False
+
+            wait -= time.time() - t0
+            if wait > 0:
+                time.sleep(wait)
+
+            return True
+
         arg = json.dumps(ja)
     else:
         arg = txt or ap
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+"""
+hash-files: hashing lots of small files during e2dsa / e2v
+
+creates a folder of small files and hashes all of them,
+first one at a time (like _hashlist_from_file without MTHash)
+and then with MTHashFiles keeping several files in flight;
+checks that both produce the same warks
+
+usage: python3 scripts/bench/hash-files.py [nfiles] [KiB] [cores]
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from copyparty.up2k import up2k_chunksize, up2k_wark_from_hashlist  # noqa: E402
+from copyparty.util import MTHashFiles  # noqa: E402
+
+
+def main():
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    fsz = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 256 * 1024
+    cores = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    td = tempfile.mkdtemp()
+    aps = []
+    for n in range(nfiles):
+        ap = os.path.join(td, "%06d.jpg" % (n,))
+        with open(ap, "wb") as f:
+            f.write(os.urandom(fsz))
+        aps.append(ap)
+
+    mthf = MTHashFiles(cores, 512 * 1024, up2k_chunksize)
+    t0 = time.time()
+    w1 = [up2k_wark_from_hashlist("", fsz, mthf.hash(ap)) for ap in aps]
+    t1 = time.time()
+    zg = mthf.imap([(ap, ap, fsz) for ap in aps], 1024 * 1024 * 16)
+    w2 = [up2k_wark_from_hashlist("", fsz, hs) for _, hs in zg]  # type: ignore
+    t2 = time.time()
+
+    assert w1 == w2
+    mb = nfiles * fsz / 1024 / 1024
+    print("%d files, %d KiB each" % (nfiles, fsz // 1024))
+    print("one at a time  %7.3f sec, %6.1f MiB/s" % (t1 - t0, mb / (t1 - t0)))
+    print("%2d cores       %7.3f sec, %6.1f MiB/s" % (cores, t2 - t1, mb / (t2 - t1)))
+    shutil.rmtree(td)
+
+
+if __name__ == "__main__":
+    main()
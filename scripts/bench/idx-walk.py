@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+"""
+idx-walk: listing folders during an e2ds filesystem scan
+
+builds a tree of folders, then walks it depth-first the way
+Up2k._build_dir does, first listing one folder at a time and then
+with a StatPool listing folders ahead of the walk (--idx-mt);
+each listing is delayed by LAT msec to pretend it's a network-disk
+
+usage: python3 scripts/bench/idx-walk.py [LAT] [nthreads]
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from copyparty import util  # noqa: E402
+
+LAT = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.002
+statdir = util.statdir
+
+
+def slow_statdir(*a):
+    time.sleep(LAT)
+    return statdir(*a)
+
+
+def walk(spool, cdir):
+    if spool:
+        gl = sorted(spool.get(cdir))
+        subdirs = [
+            (os.path.join(cdir, x[0]), x[1].st_dev)
+            for x in gl
+            if stat.S_ISDIR(x[1].st_mode)
+        ]
+        spool.want(subdirs)
+    else:
+        gl = sorted(util.statdir(None, True, True, cdir))
+
+    n = 0
+    for fn, st in gl:
+        if stat.S_ISDIR(st.st_mode):
+            n += walk(spool, os.path.join(cdir, fn))
+        else:
+            n += 1
+
+    return n
+
+
+def main():
+    nthr = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    td = tempfile.mkdtemp()
+    for a in range(20):
+        for b in range(20):
+            d = os.path.join(td, "a%d" % (a,), "b%d" % (b,))
+            os.makedirs(d)
+            for c in range(10):
+                open(os.path.join(d, "f%d" % (c,)), "wb").close()
+
+    util.statdir = slow_statdir
+    t0 = time.time()
+    n1 = walk(None, td)
+    t1 = time.time()
+    spool = util.StatPool(None, True, nthr, nthr)  # type: ignore
+    n2 = walk(spool, td)
+    spool.close()
+    t2 = time.time()
+
+    assert n1 == n2
+    print("%d files in 421 folders, %.1f ms per listing" % (n1, LAT * 1000))
+    print("serial       %7.3f sec" % (t1 - t0,))
+    print("%2d threads   %7.3f sec" % (nthr, t2 - t1))
+    shutil.rmtree(td)
+
+
+if __name__ == "__main__":
+    main()
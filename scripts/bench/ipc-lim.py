@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import threading
+import time
+from argparse import Namespace
+
+"""
+ipc-lim: cost of the upload-limits and bans shared through the hub (-j)
+
+starts one worker process which talks to the hub through the same
+queues and message loops as BrokerMp / MpWorker, and measures
+  * the ban-check done on every request (local dict; unaffected by -j)
+  * Lim.chk_nup / chk_bup, which ask the hub (one roundtrip each)
+  * Lim.nup / bup, which are fire-and-forget messages to the hub
+  * the same Lim calls in a single process, for comparison
+
+usage: python3 scripts/bench/ipc-lim.py [iterations]
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from copyparty.authsrv import Lim  # noqa: E402
+from copyparty.broker_mp import BrokerMp  # noqa: E402
+from copyparty.broker_mpw import MpWorker  # noqa: E402
+from copyparty.svchub import SvcHub  # noqa: E402
+from copyparty.util import Daemon, mp  # noqa: E402
+
+IP = "10.1.2.3"
+
+
+class Vol(object):
+    def __init__(self, lim):
+        self.lim = lim
+
+
+class Hub(object):
+    # just enough of a SvcHub to answer the Lim calls
+    _lim = SvcHub._lim
+    lim_nup = SvcHub.lim_nup
+    lim_bup = SvcHub.lim_bup
+    lim_chk = SvcHub.lim_chk
+
+    def __init__(self):
+        vfs = Namespace(all_vols={"": Vol(mk_lim())})
+        self.asrv = Namespace(vfs=vfs)
+
+
+def mk_lim():
+    lim = Lim(None)
+    lim.nmax, lim.nwin = 1 << 30, 600
+    lim.bmax, lim.bwin = 1 << 60, 600
+    return lim
+
+
+def timeit(n, fun, *a):
+    t0 = time.time()
+    for _ in range(n):
+        fun(*a)
+    return (time.time() - t0) * 1e6 / n
+
+
+def worker(q_pend, q_yield, n, q_ret):
+    w = MpWorker.__new__(MpWorker)
+    w.q_pend = q_pend
+    w.q_yield = q_yield
+    w.retpend = {}
+    w.retpend_mutex = threading.Lock()
+    Daemon(w.main, "mpw-main")
+
+    lim = mk_lim()
+    lim.ipc = w
+    bans = {"10.9.9.9": 1}
+
+    ret = [
+        ("ban-check (every request)", timeit(n, bans.__contains__, IP)),
+        ("chk_nup  (ask hub)", timeit(n, lim.chk_nup, IP)),
+        ("chk_bup  (ask hub)", timeit(n, lim.chk_bup, IP)),
+        ("nup      (tell hub)", timeit(n, lim.nup, IP)),
+        ("bup      (tell hub)", timeit(n, lim.bup, IP, 4096)),
+    ]
+    w.ask("lim_chk", "", IP, False).get()  # flush
+    q_ret.put(ret)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ctx = mp.get_context("spawn")
+    q_pend = ctx.Queue(1)
+    q_yield = ctx.Queue(64)
+    q_ret = ctx.Queue(1)
+
+    proc = ctx.Process(target=worker, args=(q_pend, q_yield, n, q_ret))
+    proc.q_pend = q_pend
+    proc.q_yield = q_yield
+    bmp = BrokerMp.__new__(BrokerMp)
+    bmp.hub = Hub()
+    bmp.log = print
+    Daemon(bmp.collector, "mp-sink", (proc,))
+    proc.start()
+    rows = q_ret.get()
+    proc.join()
+
+    lim = mk_lim()
+    rows += [
+        ("chk_nup  (local)", timeit(n, lim.chk_nup, IP)),
+        ("nup      (local)", timeit(n, lim.nup, IP)),
+    ]
+    for k, v in rows:
+        print("%-28s %8.2f usec" % (k, v))
+
+    hl = bmp.hub.asrv.vfs.all_vols[""].lim
+    print("hub counted %d uploads from the worker" % (len(hl.nups[IP]),))
+
+
+if __name__ == "__main__":
+    main()
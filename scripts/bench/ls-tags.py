@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+"""
+ls-tags: collecting tags for a directory listing
+
+builds an up2k.db with one folder of 50k files (6 tags each), then
+fetches the tags and uploader-info of every file in that folder, first
+like tx_browser used to (two queries per file) and then with
+HttpCli._ls_tags (two queries per folder)
+
+usage: python3 scripts/bench/ls-tags.py [nfiles]
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from copyparty.httpcli import HttpCli  # noqa: E402
+
+
+class Cli(object):
+    def log(self, msg, c=0):
+        print(msg)
+
+
+def mk_db(path, rd, nfiles):
+    db = sqlite3.connect(path)
+    cur = db.cursor()
+    for cmd in [
+        r"create table up (w text, mt int, sz int, rd text, fn text, ip text, at int)",
+        r"create index up_rd on up(rd)",
+        r"create index up_fn on up(fn)",
+        r"create index up_ip on up(ip)",
+        r"create index up_w on up(substr(w,1,16))",
+        r"create table mt (w text, k text, v int)",
+        r"create index mt_w on mt(w)",
+        r"create index mt_k on mt(k)",
+        r"create index mt_v on mt(v)",
+    ]:
+        cur.execute(cmd)
+
+    for n in range(nfiles):
+        fn = "%06d - track.flac" % (n,)
+        w = hashlib.sha512(fn.encode("utf-8")).hexdigest()[:44]
+        zt = (w, 1700000000, 31337, rd, fn, "127.0.0.1", 1700000000 + n)
+        cur.execute("insert into up values (?,?,?,?,?,?,?)", zt)
+        for k, v in [
+            ("title", "song %d" % (n,)),
+            ("artist", "someone"),
+            ("album", "something"),
+            (".dur", 240),
+            (".bpm", 120),
+            ("x", 1),
+        ]:
+            cur.execute("insert into mt values (?,?,?)", (w[:16], k, v))
+
+    db.commit()
+    return cur
+
+
+def per_file(cur, rd, fns):
+    ret = {}
+    q1 = "select mt.k, mt.v from up inner join mt on mt.w = substr(up.w,1,16) where up.rd = ? and up.fn = ? and +mt.k != 'x'"
+    q2 = "select ip, at from up where rd=? and fn=?"
+    for fn in fns:
+        tags = {k: v for k, v in cur.execute(q1, (rd, fn))}
+        zs1, zs2 = cur.execute(q2, (rd, fn)).fetchone()
+        if zs1:
+            tags["up_ip"] = zs1
+        if zs2:
+            tags[".up_at"] = zs2
+        ret[fn] = tags
+
+    return ret
+
+
+def main():
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rd = "music/huge"
+    td = tempfile.mkdtemp()
+    cur = mk_db(os.path.join(td, "up2k.db"), rd, nfiles)
+    mem_cur = sqlite3.connect(":memory:").cursor()
+    mem_cur.execute(r"create table a (b text)")
+    fns = [x[0] for x in cur.execute("select fn from up where rd = ?", (rd,))]
+
+    t0 = time.time()
+    r1 = per_file(cur, rd, fns)
+    t1 = time.time()
+    r2 = HttpCli._ls_tags(Cli(), cur, mem_cur, rd, True, False)  # type: ignore
+    t2 = time.time()
+
+    assert r1 == r2
+    print("%d files in one folder" % (nfiles,))
+    print("per-file   %7.3f sec" % (t1 - t0,))
+    print("per-folder %7.3f sec" % (t2 - t1,))
+
+    cur.connection.close()
+    os.unlink(os.path.join(td, "up2k.db"))
+    os.rmdir(td)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import threading
+import time
+
+"""
+up2k-locks: lock contention in the up2k chunk bookkeeping
+
+runs handle_chunks / release_chunks / confirm_chunks from several
+threads, each uploading into its own volume, while another thread
+keeps a volume busy like a big move would (handle_mv holds the lock
+for one folder at a time), first with one global lock
+(same as before per-volume locking, or when xlink is enabled)
+and then with per-volume locks
+
+usage: python3 scripts/bench/up2k-locks.py [nthreads] [seconds]
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from copyparty.up2k import Up2k  # noqa: E402
+from copyparty.util import VMutex  # noqa: E402
+
+
+class Args(object):
+    nw = False
+
+
+def mk_up2k(xlink, ptops, nchunks):
+    # just enough of an Up2k to run the chunk bookkeeping
+    u = Up2k.__new__(Up2k)
+    u.args = Args()
+    u.log = lambda *a, **ka: None
+    u.mutex = VMutex()
+    u.reg_mutex = VMutex()
+    u.xvol_mutex = threading.Lock()
+    u.any_xlink = xlink
+    u.db_act = 0.0
+    u.vol_act = {}
+    u.registry = {}
+    u.jnl_f = {}  # no journal (same as --snap-jnl 0)
+    u.jnl_sz = {}
+    for ptop in ptops:
+        hashes = ["%s-%d" % (ptop, n) for n in range(nchunks)]
+        job = {
+            "ptop": ptop,
+            "prel": "",
+            "name": "f",
+            "tnam": "f.PARTIAL",
+            "size": nchunks * 1024 * 1024,
+            "lmod": 0,
+            "sprs": True,
+            "hash": hashes,
+            "need": list(hashes),
+            "busy": {},
+        }
+        u._prep_job(job)
+        u.registry[ptop] = {"w": job}
+
+    return u
+
+
+def uploader(u, ptop, t_end, lats):
+    job = u.registry[ptop]["w"]
+    hashes = list(job["hash"])
+    n = 0
+    while time.time() < t_end:
+        if not job["need"]:
+            job["need"] = dict.fromkeys(hashes)
+
+        chash = next(iter(job["need"]))
+        t0 = time.time()
+        u.handle_chunks(ptop, "w", [chash])
+        u.release_chunks(ptop, "w", [chash])
+        u.confirm_chunks(ptop, "w", [chash])
+        lats.append(time.time() - t0)
+        n += 1
+
+
+def mover(u, t_end):
+    # like handle_mv, holding /archive for each folder being moved
+    while time.time() < t_end:
+        with u._vlock(u.mutex, "/archive"):
+            time.sleep(0.05)
+
+        time.sleep(0.001)
+
+
+def run(xlink, nthr, nsec):
+    ptops = ["/vol%d" % (n,) for n in range(nthr)] + ["/archive"]
+    u = mk_up2k(xlink, ptops, 4096)
+    t_end = time.time() + nsec
+    lats = []
+    thrs = [threading.Thread(target=mover, args=(u, t_end))]
+    for ptop in ptops[:-1]:
+        zt = threading.Thread(target=uploader, args=(u, ptop, t_end, lats))
+        thrs.append(zt)
+
+    for zt in thrs:
+        zt.start()
+
+    for zt in thrs:
+        zt.join()
+
+    lats.sort()
+    n = len(lats)
+    p50 = lats[n // 2] * 1000
+    p99 = lats[int(n * 0.99)] * 1000
+    zs = "%-10s %9.0f chunks/s   p50 %7.3f ms   p99 %7.3f ms"
+    print(zs % ("global" if xlink else "per-vol", n / nsec, p50, p99))
+
+
+def main():
+    nthr = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    nsec = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print("%d uploading volumes + 1 volume busy moving files" % (nthr,))
+    run(True, nthr, nsec)
+    run(False, nthr, nsec)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import unittest
+
+from copyparty.util import BwLim, Shaper, TokenBucket
+from tests.util import Cfg
+
+
+class TestBw(unittest.TestCase):
+    def bkt(self, rate, t=1000.0):
+        ret = TokenBucket(rate)
+        ret.t = t
+        return ret
+
+    def test_bucket(self):
+        bkt = self.bkt(100000)
+        self.assertEqual(bkt.cap, 100000)
+
+        # a full bucket takes one second worth before waiting,
+        # then the debt is paid back at the rate
+        self.assertEqual(bkt.take(100000, 1000), 0)
+        self.assertAlmostEqual(bkt.take(50000, 1000), 0.5)
+        self.assertAlmostEqual(bkt.take(0, 1000.25), 0.25)
+        self.assertEqual(bkt.take(0, 1000.5), 0)
+
+        # and refills, but only up to the cap
+        self.assertEqual(bkt.take(0, 1100), 0)
+        self.assertEqual(bkt.level, 100000)
+
+        # slow buckets still get a 64k burst
+        bkt = self.bkt(1000)
+        self.assertEqual(bkt.take(65536, 1000), 0)
+        self.assertAlmostEqual(bkt.take(500, 1000), 0.5)
+
+    def test_grace(self):
+        shared = self.bkt(1000)
+        own = self.bkt(1000)
+        bw = BwLim([shared], [], 100000)
+        self.assertEqual(bw.bufsz, 4096)
+
+        # the first 100k skip the shared queue but are still counted
+        self.assertEqual(bw.delay(100000, 1000), 0)
+        self.assertLess(shared.level, 0)
+        self.assertAlmostEqual(bw.delay(1000, 1000), 35.464)
+
+        # own buckets are never skipped
+        bw = BwLim([], [own], 100000)
+        self.assertAlmostEqual(bw.delay(66536, 1000), 1)
+
+    def test_shaper(self):
+        ka = {"bw_all": "1m", "bw_grace": "64k", "bw_acct": ["ed=0", "*=2k"]}
+        sh = Shaper(Cfg(**ka))
+        flags = {"bwvol": 100000, "bwusr": 5000}
+
+        bw = sh.get({}, "/v1", "u1", "1.1.1.1", False)
+        self.assertEqual([x.rate for x in bw.shared], [1048576])
+        self.assertEqual(bw.own, [])
+        self.assertEqual(bw.grace, 65536)
+
+        a1 = sh.get(flags, "/v1", "u1", "1.1.1.1", False)
+        a2 = sh.get(flags, "/v1", "u1", "2.2.2.2", False)
+        b1 = sh.get(flags, "/v1", "u2", "1.1.1.1", False)
+        c1 = sh.get(flags, "/v2", "u1", "1.1.1.1", False)
+        u1 = sh.get(flags, "/v1", "u1", "1.1.1.1", True)
+        zl = [x.rate for x in a1.shared + a1.own]
+        self.assertEqual(zl, [1048576, 100000, 5000])
+
+        # everyone shares the server bucket
+        self.assertTrue(a1.shared[0] is b1.shared[0] is c1.shared[0])
+
+        # users share the volume bucket; each volume has its own
+        self.assertTrue(a1.shared[1] is b1.shared[1])
+        self.assertFalse(a1.shared[1] is c1.shared[1])
+
+        # a user has one bucket per volume, no matter the ip
+        self.assertTrue(a1.own[0] is a2.own[0])
+        self.assertFalse(a1.own[0] is b1.own[0])
+        self.assertFalse(a1.own[0] is c1.own[0])
+
+        # uploads and downloads are separate
+        self.assertFalse(a1.shared[0] is u1.shared[0])
+        self.assertFalse(a1.own[0] is u1.own[0])
+
+        # anonymous clients get a bucket per ip, at the --bw-acct rate
+        n1 = sh.get(flags, "/v1", "*", "1.1.1.1", False)
+        n2 = sh.get(flags, "/v1", "*", "2.2.2.2", False)
+        self.assertEqual(n1.own[0].rate, 2048)
+        self.assertFalse(n1.own[0] is n2.own[0])
+        self.assertFalse(n1.own[0] is a1.own[0])
+
+        # and 0 means unlimited
+        ed = sh.get(flags, "/v1", "ed", "1.1.1.1", False)
+        self.assertEqual(ed.own, [])
+
+        # idle buckets are forgotten (full again anyways)
+        a1.own[0].t -= 61
+        sh.t_cln -= 301
+        a3 = sh.get(flags, "/v1", "u1", "1.1.1.1", False)
+        self.assertFalse(a1.own[0] is a3.own[0])
+        self.assertTrue(a1.shared[0] is a3.shared[0])
+
+    def test_unlimited(self):
+        sh = Shaper(Cfg(bw_acct=["ed=0"]))
+        self.assertIsNone(sh.get({}, "/v1", "u1", "1.1.1.1", False))
+        self.assertIsNone(sh.get({"bwusr": 5000}, "/v1", "ed", "1.1.1.1", False))
+        self.assertIsNotNone(sh.get({"bwusr": 5000}, "/v1", "u1", "1.1.1.1", False))
+
+
+if __name__ == "__main__":
+    unittest.main()
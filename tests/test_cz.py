@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from copyparty.authsrv import AuthSrv
+from copyparty.httpcli import HttpCli
+from tests import util as tu
+from tests.util import Cfg
+
+
+class TestCz(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        self.data = "".join("line %d\n" % (x,) for x in range(5000))
+        self.data = self.data.encode("utf-8")
+        with open("f.txt", "wb") as f:
+            f.write(self.data)
+
+        for n in range(100):
+            with open("%03d.bin" % (n,), "wb") as f:
+                pass
+
+        ka = {"cz": "gz", "cz_min": 2048, "cz_fmax": 4, "cz_cache": 32}
+        self.args = Cfg(v=[".::r"], a=[], **ka)
+        self.asrv = AuthSrv(self.args, self.log)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def log(self, src, msg, c=0):
+        pass
+
+    def get(self, url, *hdrs):
+        buf = "GET %s HTTP/1.1\r\nConnection: close\r\n%s\r\n" % (
+            url,
+            "".join(x + "\r\n" for x in hdrs),
+        )
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, buf.encode("utf-8"))
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        h = h.decode("utf-8")
+        return int(h.split(" ")[1]), h, b
+
+    def test_file(self):
+        st, h, b = self.get("/f.txt")
+        self.assertEqual((st, b), (200, self.data))
+        self.assertNotIn("Content-Encoding", h)
+
+        st, h, b = self.get("/f.txt", "Accept-Encoding: br, gzip;q=0.5")
+        self.assertEqual(st, 200)
+        self.assertIn("Content-Encoding: gzip", h)
+        self.assertIn("Content-Length: %d\r\n" % (len(b),), h)
+        self.assertLess(len(b), len(self.data) // 4)
+        self.assertEqual(gzip.decompress(b), self.data)
+        etag = re.search(r"\nETag: (.*)", h).group(1).strip()
+        self.assertTrue(etag.endswith('-gz"'))
+
+        st, h, b = self.get("/f.txt", "Accept-Encoding: gzip;q=0")
+        self.assertEqual((st, b), (200, self.data))
+
+        st, h, b = self.get("/f.txt", "Accept-Encoding: gzip", "Range: bytes=5-9")
+        self.assertEqual((st, b), (206, self.data[5:10]))
+        self.assertNotIn("Content-Encoding", h)
+
+        st, h, b = self.get("/f.txt", "Accept-Encoding: gzip", "If-None-Match: " + etag)
+        self.assertEqual(st, 304)
+
+    def test_ls(self):
+        st, h, b = self.get("/?ls", "Accept-Encoding: gzip")
+        self.assertEqual(st, 200)
+        self.assertIn("Content-Encoding: gzip", h)
+        self.assertIn("Accept-Encoding", re.search(r"\nVary: (.*)", h).group(1))
+        ls = json.loads(gzip.decompress(b).decode("utf-8"))
+        self.assertEqual(len(ls["files"]), 101)
+
+        self.args.no_cz = True
+        self.asrv = AuthSrv(self.args, self.log)
+        st, h, b = self.get("/?ls", "Accept-Encoding: gzip")
+        self.assertNotIn("Content-Encoding", h)
+        self.assertEqual(len(json.loads(b.decode("utf-8"))["files"]), 101)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from copyparty.util import runhook
+from tests import util as tu
+
+HOOK = """
+seen = []
+
+def main(ka):
+    seen.append(ka["vp"])
+    return %d if ka["sz"] > 9 else 0
+"""
+
+
+def hook(cmd, vp, sz):
+    return runhook(None, [cmd], "/x/" + vp, vp, "h", "ed", "rw", 0, sz, "::1", 1, "")
+
+
+class TestHooks(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def mkhook(self, rc):
+        ap = os.path.join(self.td, "cpp_test_ihook.py")
+        with open(ap, "w") as f:
+            f.write(HOOK % (rc,))
+
+        return ap
+
+    def test_import(self):
+        ap = self.mkhook(1)
+        self.assertTrue(hook("I,c," + ap, "a", 3))
+        self.assertFalse(hook("I,c," + ap, "b", 30))
+        self.assertTrue(hook("I," + ap, "c", 30))
+
+        # edited hooks are reloaded
+        ap = self.mkhook(0)
+        os.utime(ap, (1, 1))
+        self.assertTrue(hook("I,c," + ap, "d", 30))
+
+        # forked events run in order on a background thread
+        for n in range(100):
+            self.assertTrue(hook("I,f," + ap, str(n), 1))
+
+        from cpp_test_ihook import seen
+
+        t0 = time.time()
+        while len(seen) < 101 and time.time() - t0 < 5:
+            time.sleep(0.01)
+
+        self.assertEqual(seen, ["d"] + [str(n) for n in range(100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import threading
+import time
+import unittest
+
+from copyparty.util import VMutex
+
+
+class TestVMutex(unittest.TestCase):
+    def test_stripes(self):
+        vm = VMutex()
+        a = vm.vol("/a")
+        b = vm.vol("/b")
+        ab = vm.vol("/a", "/b")
+
+        self.assertTrue(a.acquire())
+        self.assertTrue(b.acquire(timeout=0.1))
+        self.assertFalse(ab.acquire(timeout=0.1))
+        self.assertFalse(vm.acquire(timeout=0.1))
+        a.release()
+        self.assertFalse(ab.acquire(timeout=0.1))
+        b.release()
+        self.assertTrue(ab.acquire(timeout=0.1))
+        ab.release()
+
+        # the whole thing excludes every volume
+        self.assertTrue(vm.acquire(timeout=0.1))
+        self.assertFalse(a.acquire(timeout=0.1))
+        self.assertFalse(vm.acquire(timeout=0.1))
+        vm.release()
+        with a:
+            pass
+
+    def test_waiting_full(self):
+        # a pending full lock must not starve behind a stream of volume locks
+        vm = VMutex()
+        a = vm.vol("/a")
+        b = vm.vol("/b")
+        a.acquire()
+        got = []
+
+        def full():
+            with vm:
+                got.append(1)
+
+        thr = threading.Thread(target=full)
+        thr.start()
+        time.sleep(0.1)
+        self.assertFalse(b.acquire(timeout=0.1))
+        self.assertEqual(got, [])
+        a.release()
+        thr.join()
+        self.assertEqual(got, [1])
+        self.assertTrue(b.acquire(timeout=0.1))
+        b.release()
+
+    def test_vol_more(self):
+        # a volume holder can grab more volumes, skipping queued full-takers
+        vm = VMutex()
+        a = vm.vol("/a")
+        a.acquire()
+        thr = threading.Thread(target=lambda: vm.acquire() and vm.release())
+        thr.start()
+        time.sleep(0.1)
+
+        # already holding /a, so that part is a no-op
+        ab = vm.vol_more(set(["/a", "/b"]), 0.1)
+        self.assertEqual(ab.ptops, set(["/b"]))
+        self.assertEqual(vm.mine(), set(["/a", "/b"]))
+
+        got = []
+
+        def grab():
+            got.append(vm.vol_more(set(["/b"]), 0.1))
+
+        thr2 = threading.Thread(target=grab)
+        thr2.start()
+        thr2.join()
+        self.assertEqual(got, [None])
+
+        ab.release()
+        a.release()
+        self.assertEqual(vm.mine(), set())
+        thr.join()
+        self.assertFalse(vm.busy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from copyparty.authsrv import AuthSrv
+from copyparty.httpcli import HttpCli
+from tests import util as tu
+from tests.util import Cfg
+
+
+class TestRanges(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        self.data = bytes(bytearray(x % 251 for x in range(1000)))
+        with open("f", "wb") as f:
+            f.write(self.data)
+
+        self.args = Cfg(v=[".::r"], a=[])
+        self.asrv = AuthSrv(self.args, self.log)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def log(self, src, msg, c=0):
+        pass
+
+    def get(self, *hdrs):
+        buf = "GET /f HTTP/1.1\r\nConnection: close\r\n%s\r\n" % (
+            "".join(x + "\r\n" for x in hdrs),
+        )
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, buf.encode("utf-8"))
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        h = h.decode("utf-8")
+        return int(h.split(" ")[1]), h, b
+
+    def test_etag(self):
+        st, h, b = self.get()
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.data)
+        etag = re.search(r"\nETag: (.*)", h).group(1)
+
+        st, h, b = self.get("If-None-Match: W/%s, \"x\"" % (etag,))
+        self.assertEqual(st, 304)
+
+        # if-none-match wins over if-modified-since
+        zs = "If-Modified-Since: Fri, 01 Jan 2100 00:00:00 GMT"
+        st, h, b = self.get('If-None-Match: "x"', zs)
+        self.assertEqual(st, 200)
+
+        st, h, b = self.get("Range: bytes=10-19", "If-Range: " + etag)
+        self.assertEqual((st, b), (206, self.data[10:20]))
+
+        st, h, b = self.get("Range: bytes=10-19", 'If-Range: "x"')
+        self.assertEqual((st, b), (200, self.data))
+
+    def test_ranges(self):
+        st, h, b = self.get("Range: bytes=-10")
+        self.assertEqual((st, b), (206, self.data[-10:]))
+        self.assertIn("Content-Range: bytes 990-999/1000", h)
+
+        st, h, b = self.get("Range: bytes=2000-")
+        self.assertEqual(st, 416)
+
+        st, h, b = self.get("Range: bytes=0-9,5-20,-10,50-60,2000-")
+        self.assertEqual(st, 206)
+        self.assertIn("Content-Length: %d\r\n" % (len(b),), h)
+        bnd = re.search(r"boundary=([0-9a-f]+)", h).group(1).encode("ascii")
+        parts = b.split(b"\r\n--" + bnd)
+        self.assertEqual(parts[0], b"")
+        self.assertEqual(parts[-1], b"--\r\n")
+        got = []
+        for part in parts[1:-1]:
+            ph, pb = part.split(b"\r\n\r\n", 1)
+            m = re.search(br"Content-Range: bytes (\d+)-(\d+)/1000", ph)
+            a, z = int(m.group(1)), int(m.group(2))
+            self.assertEqual(pb, self.data[a : z + 1])
+            got.append((a, z))
+
+        self.assertEqual(got, [(0, 20), (50, 60), (990, 999)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from copyparty.th_srv import ThumbIdx
+from tests import util as tu
+
+
+class TestThumbIdx(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def test_nbytes(self):
+        idx = ThumbIdx(self.td)
+        self.assertFalse(idx.built)
+        idx.set([("th/aa/bb/c1", 100, 10), ("th/aa/bb/c2", 200, 20)])
+        idx.set([("ac/aa/bb/c3/x.opus", 50, 30)])
+        self.assertEqual(idx.nbytes, 350)
+
+        # replacing an entry only counts the difference
+        idx.set([("th/aa/bb/c1", 150, 40)])
+        self.assertEqual(idx.nbytes, 400)
+
+        idx.pop("th/aa/bb/c2")
+        idx.pop("th/aa/bb/nope")
+        self.assertEqual(idx.nbytes, 200)
+        idx.set_built()
+
+        # size and built-flag survive a restart
+        idx.conn.close()
+        idx = ThumbIdx(self.td)
+        self.assertEqual(idx.nbytes, 200)
+        self.assertTrue(idx.built)
+        idx.conn.close()
+
+    def test_lru(self):
+        idx = ThumbIdx(self.td)
+        idx.set([("th/k%d" % (n,), 1, 100 + n) for n in range(5)])
+        self.assertEqual(idx.coldest(2), ["th/k0", "th/k1"])
+
+        # using a thumbnail moves it to the back of the line
+        idx.touch("th/k0", 200)
+        idx.touch("th/k2", 201)
+        self.assertEqual(idx.coldest(9), ["th/k1", "th/k3", "th/k4", "th/k0", "th/k2"])
+
+        idx.set([("ac/k9/x.opus", 1, 50)])
+        self.assertEqual(idx.coldest(1), ["ac/k9/x.opus"])
+        self.assertEqual(sorted(idx.older("th", 104)), ["th/k1", "th/k3"])
+        self.assertEqual(idx.older("ac", 104), ["ac/k9/x.opus"])
+        idx.conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
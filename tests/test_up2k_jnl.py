@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from copyparty.up2k import Up2k
+from tests import util as tu
+
+
+class VFS(object):
+    def __init__(self, histtab):
+        self.histtab = histtab
+
+
+class AuthSrv(object):
+    def __init__(self, histtab):
+        self.vfs = VFS(histtab)
+
+
+def mkjob(wark, nchunks):
+    hashes = ["%s-%d" % (wark, n) for n in range(nchunks)]
+    return {"wark": wark, "ptop": "/v", "hash": hashes, "need": list(hashes)}
+
+
+class TestJnl(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def test_replay(self):
+        u = Up2k.__new__(Up2k)
+        u.asrv = AuthSrv({"/v": self.td})
+        u.log = lambda *a, **ka: None
+        u.jnl_f = {"/v": None}
+        u.jnl_sz = {"/v": 0}
+
+        # state as of the last up2k.snap
+        snap = {"a": mkjob("a", 4), "b": mkjob("b", 2), "c": mkjob("c", 2)}
+
+        # changes since then
+        u._jnl("/v", {"a": "c", "w": "a", "h": ["a-0", "a-2"]})
+        u._jnl("/v", {"a": "j", "j": mkjob("d", 3)})
+        u._jnl("/v", {"a": "c", "w": "d", "h": ["d-1"]})
+        u._jnl("/v", {"a": "c", "w": "b", "h": ["b-0", "b-1"]})
+        u._jnl("/v", {"a": "f", "w": "b"})
+        u._jnl("/v", {"a": "d", "w": "c"})
+        u.jnl_f["/v"].close()
+
+        # crash during a write
+        path = os.path.join(self.td, "up2k.jnl")
+        with open(path, "ab") as f:
+            f.write(b'{"a":"d","w":"a')
+
+        drp, n = u._jnl_replay(path, snap)
+        self.assertEqual(n, 6)
+        self.assertEqual(drp, ["b"])
+        self.assertEqual(sorted(snap), ["a", "b", "d"])
+        self.assertEqual(list(snap["a"]["need"]), ["a-1", "a-3"])
+        self.assertEqual(list(snap["b"]["need"]), [])
+        self.assertEqual(snap["b"]["done"], 1)
+        self.assertEqual(list(snap["d"]["need"]), ["d-0", "d-2"])
+
+        # replaying again on top of a newer snap changes nothing
+        snap2 = {k: u._ser_job(v) for k, v in snap.items()}
+        u._jnl_replay(path, snap2)
+        self.assertEqual(list(snap2["a"]["need"]), ["a-1", "a-3"])
+        self.assertEqual(list(snap2["d"]["need"]), ["d-0", "d-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
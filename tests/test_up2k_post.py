@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from copyparty.authsrv import AuthSrv
+from copyparty.broker_thr import BrokerThr
+from copyparty.httpcli import HttpCli
+from copyparty.up2k import Up2k
+from tests import util as tu
+from tests.util import Cfg
+
+
+class Broker(object):
+    # forwards httpcli's broker.ask to the Up2k in this process
+    ask = BrokerThr.ask
+
+    def __init__(self, hub):
+        self.hub = hub
+
+
+PACK = "X-Up2k-Pack: 1\r\nContent-Type: application/octet-stream\r\n"
+
+
+def chash(buf):
+    return base64.urlsafe_b64encode(hashlib.sha512(buf).digest()[:33]).decode()
+
+
+class TestUp2kPost(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        os.mkdir("sub")
+        self.up2k = None
+
+    def tearDown(self):
+        if self.up2k:
+            self.up2k.shutdown()
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def log(self, src, msg, c=0):
+        pass
+
+    def mk(self, vcfg, **ka):
+        self.args = Cfg(v=vcfg, a=["u1:u1"], plain_ip=True, **ka)
+        self.asrv = AuthSrv(self.args, self.log)
+        self.up2k = Up2k(self)
+
+    def post(self, url, body, hdrs=""):
+        zs = "POST /%s HTTP/1.1\r\nPW: u1\r\nConnection: close\r\n%sContent-Length: %d\r\n\r\n"
+        buf = (zs % (url, hdrs, len(body))).encode("utf-8") + body
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, buf)
+        conn.hsrv.broker = Broker(self)
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        return int(h.split(b" ")[1]), b
+
+    def hs(self, files):
+        reqs = []
+        for rd, name, buf, replace in files:
+            zd = {"name": name, "size": len(buf), "lmod": 1, "hash": [chash(buf)]}
+            if rd:
+                zd["rd"] = rd
+            if replace:
+                zd["replace"] = True
+            reqs.append(zd)
+
+        body = json.dumps({"batch": reqs}).encode("utf-8")
+        st, b = self.post("", body, "Content-Type: text/plain\r\n")
+        self.assertEqual(st, 200)
+        return json.loads(b)["batch"]
+
+    def test_hs_batch(self):
+        # u1 can delete in the top volume, but not in the sub-volume
+        self.mk([".::rwd,u1", "sub:sub:rw,u1"])
+        for fn in ("sub/f.txt", "f.txt"):
+            with open(fn, "wb") as f:
+                f.write(b"old")
+
+        rets = self.hs(
+            [
+                ("sub", "f.txt", b"new1", True),
+                ("", "f.txt", b"new2", True),
+                ("sub", "g.txt", b"new3", False),
+            ]
+        )
+        self.assertNotEqual(rets[0]["name"], "f.txt")
+        self.assertEqual(rets[0]["purl"], "/sub/")
+        self.assertEqual(rets[1]["name"], "f.txt")
+        self.assertEqual(rets[2]["name"], "g.txt")
+        with open("sub/f.txt", "rb") as f:
+            self.assertEqual(f.read(), b"old")  # not replaced
+
+        # garbage entries fail on their own, not the whole batch
+        zs = '{"batch":[1,{"rd":5,"name":"a"},{"size":1},{"name":"x","size":1,"lmod":1,"hash":["%s"]}]}'
+        zb = (zs % (chash(b"x"),)).encode("utf-8")
+        st, b = self.post("", zb, "Content-Type: text/plain\r\n")
+        self.assertEqual(st, 200)
+        rets = json.loads(b)["batch"]
+        self.assertEqual([x.get("err") for x in rets], [400, 400, 400, None])
+        self.assertEqual(rets[3]["name"], "x")
+
+        # a client-supplied err must not skip the handshake and
+        # send back the server-side info that _hs_prep adds
+        zs = '{"batch":[{"name":"y","size":1,"lmod":1,"hash":["%s"],"err":200}]}'
+        zb = (zs % (chash(b"y"),)).encode("utf-8")
+        st, b = self.post("", zb, "Content-Type: text/plain\r\n")
+        self.assertEqual(st, 200)
+        ret = json.loads(b)["batch"][0]
+        self.assertEqual(ret["name"], "y")
+        self.assertNotIn("ptop", ret)
+        self.assertNotIn("vcfg", ret)
+        self.assertNotIn(self.td.encode("utf-8"), b)
+
+    def test_pack(self):
+        self.mk([".::rw,u1"], e2d=True)
+        files = [("a.txt", b"hello"), ("b.txt", b"world")]
+        rets = self.hs([("", fn, buf, False) for fn, buf in files])
+        warks = [x["wark"] for x in rets]
+        self.assertEqual([x["hash"] for x in rets], [[chash(x[1])] for x in files])
+
+        # second file gets corrupted in transit
+        body = b""
+        for (fn, buf), wark in zip(files, warks):
+            zb = buf if fn == "a.txt" else b"w0rld"
+            zs = "%s %s %d\n" % (wark, chash(buf), len(zb))
+            body += zs.encode("ascii") + zb
+
+        st, b = self.post("", body, PACK)
+        self.assertEqual(st, 200)
+        errs = json.loads(b)["err"]
+        self.assertEqual(list(errs), [warks[1]])
+        self.assertIn("corrupted", errs[warks[1]])
+
+        with open("a.txt", "rb") as f:
+            self.assertEqual(f.read(), b"hello")
+        with open("b.txt", "rb") as f:
+            self.assertNotEqual(f.read(), b"w0rld")  # placeholder only
+
+        # finish_pack committed the good one to the db
+        cur = self.up2k.cur[self.td]
+        q = "select fn from up where substr(w,1,16) = ?"
+        self.assertEqual(cur.execute(q, (warks[0][:16],)).fetchall(), [("a.txt",)])
+        self.assertFalse(cur.execute(q, (warks[1][:16],)).fetchall())
+        self.assertFalse(self.up2k.no_commit)
+
+        # and the bad one can be retried
+        zs = "%s %s %d\n" % (warks[1], chash(b"world"), 5)
+        st, b = self.post("", zs.encode("ascii") + b"world", PACK)
+        self.assertEqual(json.loads(b)["err"], {})
+        with open("b.txt", "rb") as f:
+            self.assertEqual(f.read(), b"world")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -45,7 +45,7 @@ from copyparty.__init__ import E
 from copyparty.__main__ import init_E
 from copyparty.ico import Ico
 from copyparty.u2idx import U2idx
-from copyparty.util import FHC, CachedDict, Garda, Unrecv
+from copyparty.util import FHC, CachedDict, Cz, Garda, Shaper, Unrecv
 
 init_E(E)
 
@@ -111,7 +111,7 @@ class Cfg(Namespace):
     def __init__(self, a=None, v=None, c=None, **ka0):
         ka = {}
 
-        ex = "daw dav_auth dav_inf dav_mac dav_rt e2d e2ds e2dsa e2t e2ts e2tsr e2v e2vu e2vp early_ban ed emp exp force_js getmod grid gsel hardlink ih ihead magic never_symlink nid nih no_acode no_athumb no_dav no_dedup no_del no_dupe no_lifetime no_logues no_mv no_pipe no_poll no_readme no_robots no_sb_md no_sb_lg no_scandir no_tarcmp no_thumb no_vthumb no_zip nrand nw og og_no_head og_s_title q rand smb srch_dbg stats uqe vague_403 vc ver xdev xlink xvol"
+        ex = "bak_flips daw dav_auth dav_inf dav_mac dav_rt e2d e2ds e2dsa e2t e2ts e2tsr e2v e2vu e2vp early_ban ed emp exp force_js fts getmod grid gsel hardlink ih ihead inotify magic mtag_mp never_symlink nid nih no_acode no_athumb no_cz no_dav no_dedup no_del no_dupe no_lifetime no_logues no_mv no_pipe no_poll no_readme no_robots no_sb_md no_sb_lg no_scandir no_tarcmp no_thumb no_vthumb no_zip nrand no_db_ip nw og og_no_head og_s_title q rand smb srch_dbg stats uqe vague_403 vc ver xdev xlink xvol"
         ka.update(**{k: False for k in ex.split()})
 
         ex = "dotpart dotsrch no_dhash no_fastboot no_rescan no_sendfile no_snap no_voldump re_dhash plain_ip"
@@ -123,16 +123,16 @@ class Cfg(Namespace):
         ex = "hash_mt srch_time u2abort u2j u2sz"
         ka.update(**{k: 1 for k in ex.split()})
 
-        ex = "au_vol mtab_age reg_cap s_thead s_tbody th_convt"
+        ex = "au_vol idx_dev idx_mt mtab_age reg_cap s_thead s_tbody th_convt"
         ka.update(**{k: 9 for k in ex.split()})
 
-        ex = "db_act k304 loris re_maxage rproxy rsp_jtr rsp_slp s_wr_slp snap_wri theme themes turbo"
+        ex = "cz_cache cz_fmax cz_min db_act e2v_age e2v_bw e2v_idle k304 log_q loris re_maxage rproxy rsp_jtr rsp_slp s_wr_slp snap_jnl snap_wri th_maxsz theme themes turbo"
         ka.update(**{k: 0 for k in ex.split()})
 
-        ex = "ah_alg bname doctitle df exit favico idp_h_usr html_head lg_sbf log_fk md_sbf name og_desc og_site og_th og_title og_title_a og_title_v og_title_i tcolor textfiles unlist vname R RS SR"
+        ex = "ah_alg bname bw_all bw_grace bw_usr bw_vol cz doctitle df exit favico idp_h_usr html_head lg_sbf log_fk md_sbf name og_desc og_site og_th og_title og_title_a og_title_v og_title_i tcolor textfiles unlist vname R RS SR"
         ka.update(**{k: "" for k in ex.split()})
 
-        ex = "grp on403 on404 xad xar xau xban xbd xbr xbu xiu xm"
+        ex = "bw_acct grp on403 on404 xad xar xau xban xbd xbr xbu xiu xm"
         ka.update(**{k: [] for k in ex.split()})
 
         ex = "exp_lg exp_md"
@@ -226,6 +226,8 @@ class VHttpSrv(object):
         self.g404 = Garda("")
         self.g403 = Garda("")
         self.gurl = Garda("")
+        self.shaper = Shaper(args)
+        self.cz = Cz(args)
 
         self.u2idx = None
         self.ptn_cc = re.compile(r"[\x00-\x1f]")